@@ -0,0 +1,225 @@
+"""
+Preprocesado de notas de voz antes de transcribir.
+
+Las notas de WhatsApp llegan en OGG/Opus (a menudo 48 kHz, con silencio al
+principio y al final). Antes de subirlas:
+1. se decodifican localmente con ffmpeg a PCM mono 16 kHz (downmix + resample),
+2. un VAD de energía recorta el silencio inicial y final (con margen),
+3. se re-codifican en Opus mono de bajo bitrate (voz),
+4. las notas largas se parten en trozos, cortando en el tramo más silencioso
+   cerca de cada límite, para transcribirlos en paralelo y concatenar.
+
+Sin ffmpeg/numpy, o si algo falla, se devuelve el audio original tal cual.
+"""
+
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import add_audio_prep_bytes, observe_audio_prep
+
+load_dotenv()
+AUDIO_PREP_ENABLED = os.getenv("AUDIO_PREP_ENABLED", "true").lower() in ("1", "true", "yes")
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+# Complejidad del encoder Opus (0-10): a 24 kbps el tamaño apenas cambia y 10 cuesta ~4x más CPU
+AUDIO_OPUS_COMPLEXITY = os.getenv("AUDIO_OPUS_COMPLEXITY", "2")
+# VAD: trama de 30 ms; voz = energía sobre el umbral absoluto y sobre el ruido de fondo + margen
+AUDIO_VAD_FRAME_MS = 30
+AUDIO_VAD_THRESHOLD_DBFS = float(os.getenv("AUDIO_VAD_THRESHOLD_DBFS", "-45"))
+AUDIO_VAD_MARGIN_DB = float(os.getenv("AUDIO_VAD_MARGIN_DB", "10"))
+AUDIO_VAD_PAD_MS = int(os.getenv("AUDIO_VAD_PAD_MS", "250"))
+# Notas más largas que esto se trocean (~AUDIO_CHUNK_SECONDS por trozo)
+AUDIO_CHUNK_SECONDS = float(os.getenv("AUDIO_CHUNK_SECONDS", "60"))
+AUDIO_CHUNK_SEARCH_SECONDS = 5.0
+AUDIO_PARALLEL = int(os.getenv("AUDIO_PARALLEL", "4"))
+AUDIO_FFMPEG_TIMEOUT = float(os.getenv("AUDIO_FFMPEG_TIMEOUT", "20"))
+
+
+@dataclass
+class TrimmedAudio:
+    # Solo la voz (PCM int16 mono 16 kHz; vacío si no se detectó habla) y su energía por trama
+    pcm: Any
+    db: Any
+    raw_bytes: int
+    original_seconds: float
+
+    @property
+    def speech_seconds(self) -> float:
+        return len(self.pcm) / AUDIO_SAMPLE_RATE
+
+
+@dataclass
+class PreparedAudio:
+    # (bytes, nombre de archivo) por trozo, en orden; vacío si solo había silencio
+    chunks: List[Tuple[bytes, str]] = field(default_factory=list)
+    raw_bytes: int = 0
+    original_seconds: float = 0.0
+    speech_seconds: float = 0.0
+    prepared: bool = False
+
+    @property
+    def uploaded_bytes(self) -> int:
+        return sum(len(c) for c, _ in self.chunks)
+
+
+_ffmpeg_path: Optional[str] = None
+
+
+def ffmpeg_path() -> Optional[str]:
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        _ffmpeg_path = shutil.which(FFMPEG_BIN) or ""
+        if not _ffmpeg_path:
+            print(f"[WARN] ffmpeg no encontrado ({FFMPEG_BIN}); el audio se sube sin preprocesar")
+    return _ffmpeg_path or None
+
+
+def _ffmpeg(args: List[str], data: bytes) -> bytes:
+    proc = subprocess.run(
+        [ffmpeg_path(), "-hide_banner", "-loglevel", "error", "-nostdin", *args],
+        input=data, capture_output=True, timeout=AUDIO_FFMPEG_TIMEOUT, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg: {proc.stderr.decode('utf-8', 'replace').strip()[:200]}")
+    return proc.stdout
+
+
+def decode_pcm(data: bytes):
+    """Cualquier audio que entienda ffmpeg -> PCM int16 mono 16 kHz (numpy)."""
+    import numpy as np
+
+    raw = _ffmpeg(["-i", "pipe:0", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), "-f", "s16le", "pipe:1"], data)
+    return np.frombuffer(raw, dtype=np.int16)
+
+
+def encode_opus(pcm) -> bytes:
+    """PCM int16 mono 16 kHz -> OGG/Opus de voz a AUDIO_BITRATE."""
+    return _ffmpeg([
+        "-f", "s16le", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", AUDIO_BITRATE, "-application", "voip",
+        "-compression_level", AUDIO_OPUS_COMPLEXITY, "-f", "ogg", "pipe:1",
+    ], pcm.tobytes())
+
+
+def frame_energy_db(pcm, frame: int):
+    """Energía RMS (dBFS) por trama de `frame` muestras."""
+    import numpy as np
+
+    n = len(pcm) // frame
+    if n == 0:
+        return np.zeros(0)
+    frames = pcm[: n * frame].astype(np.float32).reshape(n, frame) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-6))
+
+
+def speech_bounds(db, frame: int, total: int) -> Optional[Tuple[int, int]]:
+    """(inicio, fin) en muestras de la voz detectada, con margen; None si todo es silencio."""
+    import numpy as np
+
+    if len(db) == 0:
+        return None
+    noise = float(np.percentile(db, 10))
+    voiced = np.nonzero(db > max(AUDIO_VAD_THRESHOLD_DBFS, noise + AUDIO_VAD_MARGIN_DB))[0]
+    if len(voiced) == 0:
+        # Nivel uniforme (voz continua sin pausas o ruido): solo el umbral absoluto decide
+        if float(np.median(db)) > AUDIO_VAD_THRESHOLD_DBFS:
+            return 0, total
+        return None
+    pad = AUDIO_SAMPLE_RATE * AUDIO_VAD_PAD_MS // 1000
+    return max(0, int(voiced[0]) * frame - pad), min(total, (int(voiced[-1]) + 1) * frame + pad)
+
+
+def split_points(db, frame: int, total: int) -> List[int]:
+    """Cortes (muestras) cada ~AUDIO_CHUNK_SECONDS, en la trama más silenciosa de la ventana de búsqueda."""
+    import numpy as np
+
+    chunk = int(AUDIO_CHUNK_SECONDS * AUDIO_SAMPLE_RATE)
+    if chunk <= 0 or total <= chunk * 1.25:
+        return []
+    search = int(AUDIO_CHUNK_SEARCH_SECONDS * AUDIO_SAMPLE_RATE) // frame
+    cuts, pos = [], 0
+    while total - pos > chunk * 1.25:
+        target = (pos + chunk) // frame
+        lo, hi = max(pos // frame + 1, target - search), min(len(db), target + search)
+        best = lo + int(np.argmin(db[lo:hi])) if hi > lo else target
+        pos = best * frame
+        cuts.append(pos)
+    return cuts
+
+
+def trim_audio(data: bytes) -> Optional[TrimmedAudio]:
+    """
+    Decodifica a mono 16 kHz y recorta el silencio inicial/final.
+    None si el preprocesado está deshabilitado o no se puede (sin ffmpeg/numpy, audio inválido).
+    """
+    if not AUDIO_PREP_ENABLED or not data or ffmpeg_path() is None:
+        return None
+    try:
+        pcm = decode_pcm(data)
+        frame = AUDIO_SAMPLE_RATE * AUDIO_VAD_FRAME_MS // 1000
+        db = frame_energy_db(pcm, frame)
+        trimmed = TrimmedAudio(pcm=pcm[:0], db=db[:0], raw_bytes=len(data), original_seconds=len(pcm) / AUDIO_SAMPLE_RATE)
+        bounds = speech_bounds(db, frame, len(pcm))
+        if bounds is not None:
+            lo, hi = bounds
+            # La energía se reutiliza para los cortes (desfase < 1 trama)
+            trimmed.pcm, trimmed.db = pcm[lo:hi], db[lo // frame:]
+        return trimmed
+    except Exception as e:
+        print(f"[WARN] Preprocesado de audio falló ({e}); se usa el original")
+        return None
+
+
+def encode_chunks(trimmed: TrimmedAudio) -> List[Tuple[bytes, str]]:
+    """Voz recortada -> trozos OGG/Opus de ~AUDIO_CHUNK_SECONDS, cortados en silencios."""
+    if len(trimmed.pcm) == 0:
+        return []
+    frame = AUDIO_SAMPLE_RATE * AUDIO_VAD_FRAME_MS // 1000
+    edges = [0, *split_points(trimmed.db, frame, len(trimmed.pcm)), len(trimmed.pcm)]
+    segments = [trimmed.pcm[a:b] for a, b in zip(edges, edges[1:])]
+    if len(segments) == 1:
+        encoded = [encode_opus(segments[0])]
+    else:
+        # Un ffmpeg por trozo en paralelo (subprocesos: no compiten por el GIL)
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(AUDIO_PARALLEL, len(segments))) as pool:
+            encoded = list(pool.map(encode_opus, segments))
+    return [(data, f"audio_{i}.ogg") for i, data in enumerate(encoded)]
+
+
+def prepare_audio(data: bytes, filename: str = "audio.ogg", trimmed: Optional[TrimmedAudio] = None) -> PreparedAudio:
+    """
+    Audio listo para subir: recortado, mono 16 kHz, Opus compacto y troceado.
+    Nunca lanza: ante cualquier problema devuelve el original como único trozo.
+    `trimmed` evita decodificar otra vez si ya se recortó (selección de motor).
+    """
+    original = PreparedAudio(chunks=[(data, filename)], raw_bytes=len(data))
+    add_audio_prep_bytes("raw", len(data))
+    start = time.perf_counter()
+    if trimmed is None:
+        trimmed = trim_audio(data)
+    chunks = None
+    if trimmed is not None:
+        try:
+            chunks = encode_chunks(trimmed)
+        except Exception as e:
+            print(f"[WARN] Re-codificación de audio falló ({e}); se sube el original")
+    if chunks is None:
+        add_audio_prep_bytes("uploaded", len(data))
+        return original
+    result = PreparedAudio(
+        chunks=chunks, raw_bytes=len(data), original_seconds=trimmed.original_seconds,
+        speech_seconds=trimmed.speech_seconds, prepared=True,
+    )
+    observe_audio_prep(time.perf_counter() - start)
+    add_audio_prep_bytes("uploaded", result.uploaded_bytes)
+    return result
@@ -0,0 +1,93 @@
+"""Utilidades de caché compartidas (LRU en proceso + Redis como nivel compartido)."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import redis
+except Exception:
+    redis = None  # runtime import guard
+
+load_dotenv()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+USE_REDIS = os.getenv("USE_REDIS", "true").lower() == "true"
+
+_MISSING = object()
+
+
+class LRUCache:
+    """LRU thread-safe con TTL opcional por entrada."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_redis_client = None
+_redis_failed_at = 0.0
+_redis_lock = threading.Lock()
+_REDIS_RETRY_SECONDS = 30.0
+
+
+def get_redis():
+    """
+    Devuelve un cliente Redis compartido (pool de conexiones) o None si Redis
+    está deshabilitado o no disponible. Tras un fallo se reintenta cada 30s.
+    """
+    global _redis_client, _redis_failed_at
+    if not USE_REDIS or redis is None:
+        return None
+    if _redis_client is not None:
+        return _redis_client
+    if time.monotonic() - _redis_failed_at < _REDIS_RETRY_SECONDS:
+        return None
+    with _redis_lock:
+        if _redis_client is None:
+            try:
+                client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+                client.ping()
+                _redis_client = client
+            except Exception as e:
+                print(f"[WARN] Redis no disponible para caché ({e}). Usando solo caché local.")
+                _redis_failed_at = time.monotonic()
+                return None
+    return _redis_client
@@ -1,15 +1,26 @@
+import os
+from typing import Any, Dict, Tuple
+
 import httpx
 
-async def add_chatwoot_label(conversation_id: str, label: str):
-    # Asegúrate de que la URL sea dinámica (o fija si así se requiere, pero el usuario pidió dinámica basada en ID)
-    # URL template: http://192.168.18.32:3000/api/v1/accounts/1/conversations/{conversation_id}/labels
-    url = f"http://192.168.18.32:3000/api/v1/accounts/1/conversations/{conversation_id}/labels"
+# URL template: http://192.168.18.32:3000/api/v1/accounts/1/conversations/{conversation_id}/labels
+CHATWOOT_URL = os.getenv("CHATWOOT_URL", "http://192.168.18.32:3000")
+CHATWOOT_ACCOUNT_ID = os.getenv("CHATWOOT_ACCOUNT_ID", "1")
+CHATWOOT_API_TOKEN = os.getenv("CHATWOOT_API_TOKEN", "uP4dPFSh9wxyDfs6gSXw9huu")
+
+def label_request(conversation_id: str, label: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """(url, headers, body) para añadir una etiqueta a la conversación."""
+    url = f"{CHATWOOT_URL.rstrip('/')}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}/labels"
     headers = {
-        "api_access_token": "uP4dPFSh9wxyDfs6gSXw9huu",
+        "api_access_token": CHATWOOT_API_TOKEN,
         "Content-Type": "application/json"
     }
-    data = {"labels": [label]}
-    
+    return url, headers, {"labels": [label]}
+
+async def add_chatwoot_label(conversation_id: str, label: str):
+    # Llamada directa (bloqueante para quien la espera); en el flujo del bot usar app.outbound.enqueue_label
+    url, headers, data = label_request(conversation_id, label)
+
     print(f"[DEBUG] Adding label '{label}' to conversation {conversation_id} at {url}")
     try:
         async with httpx.AsyncClient(timeout=5.0) as client:
@@ -0,0 +1,124 @@
+"""
+Codec compacto para lo que se guarda en Redis (historial, flujo, cachés).
+
+Formato versionado: 1 byte de versión + 1 byte de flags + payload msgpack,
+comprimido con zstd si supera CODEC_COMPRESS_MIN_BYTES (textos largos de
+OCR/transcripciones) y la compresión realmente ahorra. Los valores JSON
+antiguos (empiezan por `{`, `[` o `"`) se siguen leyendo: no hace falta
+migrar antes de desplegar (scripts/migrate_redis_codec.py lo hace en caliente).
+
+Los mensajes de chat se guardan como {"t": tipo, "c": contenido} (+ campos no
+vacíos) en vez del dict completo de LangChain, y se reconstruyen directamente
+con el constructor del mensaje.
+
+msgpack y zstandard son opcionales: sin msgpack se escribe JSON legado; sin
+zstandard no se comprime (y un valor comprimido no se puede leer).
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import increment_codec_legacy_read
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None  # runtime import guard
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None  # runtime import guard
+
+load_dotenv()
+CODEC_ENABLED = os.getenv("CODEC_ENABLED", "true").lower() in ("1", "true", "yes")
+CODEC_COMPRESS_MIN_BYTES = int(os.getenv("CODEC_COMPRESS_MIN_BYTES", "1024"))
+CODEC_ZSTD_LEVEL = int(os.getenv("CODEC_ZSTD_LEVEL", "3"))
+
+VERSION = 1
+_FLAG_ZSTD = 0x01
+# Primer byte de un valor JSON legado: '{', '[' o '"'
+_JSON_START = (0x7B, 0x5B, 0x22)
+
+_zstd_c = zstandard.ZstdCompressor(level=CODEC_ZSTD_LEVEL) if zstandard is not None else None
+_zstd_d = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def is_legacy(raw: Any) -> bool:
+    if isinstance(raw, str):
+        return True
+    return bool(raw) and raw[0] in _JSON_START
+
+
+def encode(obj: Any) -> bytes:
+    """Serializa `obj` en el formato compacto (o JSON legado si está deshabilitado / sin msgpack)."""
+    if not CODEC_ENABLED or msgpack is None:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    payload = msgpack.packb(obj, use_bin_type=True)
+    flags = 0
+    if _zstd_c is not None and len(payload) >= CODEC_COMPRESS_MIN_BYTES:
+        compressed = _zstd_c.compress(payload)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, _FLAG_ZSTD
+    return bytes((VERSION, flags)) + payload
+
+
+def decode(raw: Any, store: str = "default") -> Any:
+    """Lee un valor compacto o JSON legado. `store` etiqueta la métrica de lecturas legadas."""
+    if raw is None or raw == b"" or raw == "":
+        return None
+    if is_legacy(raw):
+        increment_codec_legacy_read(store)
+        return json.loads(raw)
+    version, flags, payload = raw[0], raw[1], raw[2:]
+    if version != VERSION:
+        raise ValueError(f"Versión de codec desconocida: {version}")
+    if flags & _FLAG_ZSTD:
+        if _zstd_d is None:
+            raise ValueError("Valor comprimido con zstd pero zstandard no está instalado")
+        payload = _zstd_d.decompress(payload)
+    if msgpack is None:
+        raise ValueError("Valor msgpack pero msgpack no está instalado")
+    return msgpack.unpackb(payload, raw=False)
+
+
+# ---------- mensajes de chat ----------
+_MESSAGE_FIELDS = (("k", "additional_kwargs"), ("m", "response_metadata"), ("n", "name"), ("i", "id"))
+
+
+def message_to_compact(message) -> Dict[str, Any]:
+    data: Dict[str, Any] = {"t": message.type, "c": message.content}
+    for short, attr in _MESSAGE_FIELDS:
+        value = getattr(message, attr, None)
+        if value:
+            data[short] = value
+    return data
+
+
+def message_from_compact(data: Dict[str, Any]):
+    from langchain_core.messages import AIMessage, ChatMessage, HumanMessage, SystemMessage, messages_from_dict
+
+    if "type" in data and "data" in data:
+        # Entrada legada de RedisChatMessageHistory (message_to_dict)
+        return messages_from_dict([data])[0]
+    kwargs = {attr: data[short] for short, attr in _MESSAGE_FIELDS if short in data}
+    cls = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}.get(data["t"])
+    if cls is None:
+        return ChatMessage(content=data["c"], role=data["t"], **kwargs)
+    return cls(content=data["c"], **kwargs)
+
+
+def encode_message(message) -> bytes:
+    if not CODEC_ENABLED or msgpack is None:
+        from langchain_core.messages import message_to_dict
+
+        return json.dumps(message_to_dict(message), ensure_ascii=False).encode("utf-8")
+    return encode(message_to_compact(message))
+
+
+def decode_message(raw: Any, store: str = "history") -> Optional[Any]:
+    data = decode(raw, store)
+    return message_from_compact(data) if data is not None else None
@@ -0,0 +1,140 @@
+"""
+Presupuesto de tiempo por request (deadline) y cancelación.
+
+El webhook crea un `Deadline` (REQUEST_DEADLINE_SECONDS, o la cabecera
+X-Request-Deadline-Ms si el gateway la envía) y lo propaga:
+- en el estado del grafo: cada nodo llama `deadline.enter(stage)` al empezar
+  y no arranca si el presupuesto se agotó,
+- en un contextvar: las llamadas a LLM (app/scheduled_llm.py) usan el tiempo
+  restante como timeout y el scheduler no encola ni reintenta más allá,
+- a los agentes downstream (app/tools/intent_tools.py): timeout acotado y la
+  cabecera X-Request-Deadline-Ms con el restante,
+- `run_until_done` cancela el grafo si vence el plazo o el cliente se desconecta.
+"""
+
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import increment_deadline_exceeded, increment_request_cancelled
+
+load_dotenv()
+# Por debajo de los 15 s tras los que el gateway de WhatsApp abandona /webhook
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "14"))
+# No vale la pena empezar una llamada con menos tiempo que esto
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "0.2"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline agotado en '{stage}'")
+        self.stage = stage
+
+
+class RequestCancelled(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Cliente desconectado durante '{stage}'")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget: float = REQUEST_DEADLINE_SECONDS):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        # Etapa en curso (nodo del grafo): etiqueta de las métricas
+        self.stage = "start"
+        self.started_at = time.monotonic()
+        # (etapa, inicio) en orden: desglose por nodo del registro de requests lentos
+        self.stages: List[Tuple[str, float]] = []
+        self._counted = False
+
+    @classmethod
+    def from_header(cls, value: Optional[str], default: float = REQUEST_DEADLINE_SECONDS) -> "Deadline":
+        """Presupuesto de la cabecera del gateway (ms) si es válido; si no, el por defecto."""
+        try:
+            ms = float(value) if value else 0.0
+        except ValueError:
+            ms = 0.0
+        return cls(ms / 1000.0 if ms > 0 else default)
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s, stage={self.stage!r})"
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def exceeded(self, stage: Optional[str] = None) -> DeadlineExceeded:
+        """Excepción a lanzar; cuenta la métrica una sola vez por request."""
+        stage = stage or self.stage
+        if not self._counted:
+            self._counted = True
+            increment_deadline_exceeded(stage)
+        return DeadlineExceeded(stage)
+
+    def enter(self, stage: str):
+        """Inicio de una etapa: la registra y falla si ya no queda presupuesto."""
+        self.stage = stage
+        self.stages.append((stage, time.monotonic()))
+        if self.remaining() <= 0:
+            raise self.exceeded(stage)
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Timeout para una llamada: el tiempo restante, acotado por `cap`."""
+        remaining = self.remaining()
+        if remaining < DEADLINE_MIN_CALL_SECONDS:
+            raise self.exceeded()
+        return min(cap, remaining) if cap else remaining
+
+    def stage_timings(self, end: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Duración de cada etapa hasta el inicio de la siguiente (la última, hasta `end`)."""
+        end = end if end is not None else time.monotonic()
+        marks = [("start", self.started_at)] + self.stages + [(None, end)]
+        return [{"stage": stage, "ms": round((marks[i + 1][1] - at) * 1000, 1)} for i, (stage, at) in enumerate(marks[:-1])]
+
+    def headers(self) -> Dict[str, str]:
+        return {DEADLINE_HEADER: str(max(0, int(self.remaining() * 1000)))}
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline del request en curso (se hereda en tareas e hilos del grafo)."""
+    return _current.get()
+
+
+def set_deadline(deadline: Optional[Deadline]):
+    return _current.set(deadline)
+
+
+def reset_deadline(token):
+    _current.reset(token)
+
+
+async def run_until_done(coro: Awaitable[Any], deadline: Deadline, request: Any = None) -> Any:
+    """
+    Ejecuta `coro` como tarea y la cancela si vence el plazo (DeadlineExceeded)
+    o si el cliente HTTP se desconecta (RequestCancelled).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            wait = min(DISCONNECT_POLL_SECONDS, max(deadline.remaining(), 0.0))
+            done, _ = await asyncio.wait({task}, timeout=wait)
+            if done:
+                return task.result()
+            if deadline.remaining() <= 0:
+                raise deadline.exceeded()
+            if request is not None and await request.is_disconnected():
+                increment_request_cancelled(deadline.stage)
+                raise RequestCancelled(deadline.stage)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
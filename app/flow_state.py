@@ -0,0 +1,143 @@
+"""
+Estado de flujo por sesión ("flujo_actual" del ROUTER_PROMPT).
+
+Cuando un worker de un flujo (pedido, productos, seguimiento) termina su
+respuesta con una pregunta, se guarda {intent, pending_question, turns} en
+Redis (`flow:{session_id}`, junto al historial). La siguiente respuesta corta
+del usuario ("sí", "negra", "M") va directa al nodo dueño del flujo sin
+llamar al router.
+
+Condiciones de salida (se vuelve al router y se borra el flujo):
+- el bot no dejó pregunta pendiente o el flujo expiró (FLOW_TTL),
+- el mensaje es largo (FLOW_FOLLOWUP_MAX_WORDS) o contiene una palabra de salida,
+- se alcanzó FLOW_MAX_TURNS respuestas seguidas sin pasar por el router.
+"""
+
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.cache import LRUCache, get_redis
+from app.codec import decode, encode
+from app.metrics.prometheus_metrics import increment_flow_event
+from app.vector.embedding_cache import normalize_query
+
+load_dotenv()
+FLOW_STATE_ENABLED = os.getenv("FLOW_STATE_ENABLED", "true").lower() in ("1", "true", "yes")
+FLOW_TTL = int(os.getenv("FLOW_TTL", "900"))
+FLOW_FOLLOWUP_MAX_WORDS = int(os.getenv("FLOW_FOLLOWUP_MAX_WORDS", "4"))
+FLOW_MAX_TURNS = int(os.getenv("FLOW_MAX_TURNS", "6"))
+
+# Intenciones con conversación de varios pasos (preguntas de talla, color, datos de envío...)
+FLOW_INTENTS = {"pedido", "consulta_producto", "productos", "seguimiento"}
+
+_EXIT_WORDS = {
+    "cancelar", "cancela", "salir", "olvidalo", "humano", "asesor", "persona", "agente",
+    "gracias", "chau", "adios", "hola", "otra consulta", "otra pregunta",
+}
+_EXIT_RE = re.compile(r"\b(" + "|".join(re.escape(w) for w in sorted(_EXIT_WORDS, key=len, reverse=True)) + r")\b")
+
+# Fallback si Redis no está disponible (por proceso)
+_local = LRUCache(maxsize=10000, ttl=FLOW_TTL)
+
+
+def _key(session_id: str) -> str:
+    return f"flow:{session_id}"
+
+
+def get_flow(session_id: str) -> Optional[Dict[str, Any]]:
+    if not FLOW_STATE_ENABLED or not session_id:
+        return None
+    client = get_redis()
+    if client is None:
+        return _local.get(session_id)
+    try:
+        raw = client.get(_key(session_id))
+        return decode(raw, "flow")
+    except Exception as e:
+        print(f"[WARN] Error leyendo estado de flujo: {e}")
+        return None
+
+
+def save_flow(session_id: str, flow: Dict[str, Any]):
+    client = get_redis()
+    if client is None:
+        _local.set(session_id, flow)
+    else:
+        try:
+            client.set(_key(session_id), encode(flow), ex=FLOW_TTL)
+        except Exception as e:
+            print(f"[WARN] Error guardando estado de flujo: {e}")
+
+
+def clear_flow(session_id: str):
+    _local.delete(session_id)
+    client = get_redis()
+    if client is not None:
+        try:
+            client.delete(_key(session_id))
+        except Exception as e:
+            print(f"[WARN] Error borrando estado de flujo: {e}")
+
+
+def _pending_question(reply: str) -> Optional[str]:
+    """Última pregunta de la respuesta del bot, si la respuesta termina preguntando."""
+    text = (reply or "").strip()
+    if not text.endswith("?"):
+        return None
+    start = max(0, max(text.rfind(sep, 0, len(text) - 1) for sep in (".", "!", "\n", "¿")))
+    return text[start:].lstrip(".!\n ").strip() or text
+
+
+def follow_up_intent(flow: Optional[Dict[str, Any]], user_message: str) -> Optional[str]:
+    """Intención del flujo activo si el mensaje es una respuesta a su pregunta pendiente; None -> router."""
+    if not flow or not flow.get("pending_question"):
+        return None
+    norm = normalize_query(user_message)
+    if _EXIT_RE.search(norm):
+        increment_flow_event("exit_keyword")
+        return None
+    if len(norm.split()) > FLOW_FOLLOWUP_MAX_WORDS:
+        increment_flow_event("exit_long_message")
+        return None
+    if int(flow.get("turns", 0)) >= FLOW_MAX_TURNS:
+        increment_flow_event("exit_max_turns")
+        return None
+    increment_flow_event("bypass")
+    return flow["intent"]
+
+
+def describe_flow(flow: Optional[Dict[str, Any]]) -> str:
+    """Texto `flujo_actual` para el contexto del router cuando no se hace bypass."""
+    if not flow:
+        return ""
+    question = flow.get("pending_question")
+    return f"flujo_actual: {flow['intent']}" + (f" (pregunta pendiente: {question})" if question else "")
+
+
+def update_flow(session_id: str, intent: str, reply: str, previous: Optional[Dict[str, Any]] = None, bypassed: bool = False):
+    """
+    Tras responder: abre/continúa el flujo si el worker dejó una pregunta; si no,
+    lo cierra. `previous` es el flujo leído al inicio del turno.
+    """
+    if not FLOW_STATE_ENABLED or not session_id:
+        return
+    question = _pending_question(reply) if intent in FLOW_INTENTS else None
+    if question is None:
+        if previous:
+            increment_flow_event("closed")
+            clear_flow(session_id)
+        return
+    previous = previous or {}
+    turns = int(previous.get("turns", 0)) + 1 if bypassed and previous.get("intent") == intent else 0
+    if not previous:
+        increment_flow_event("opened")
+    save_flow(session_id, {
+        "intent": intent,
+        "pending_question": question,
+        "turns": turns,
+        "updated_at": int(time.time()),
+    })
@@ -1,19 +1,29 @@
 """Grafo de LangGraph para el bot de ecommerce con patrón Orquestador - Worker - Sintetizador y state persistente."""
 
-from typing import TypedDict, Annotated, Sequence, Any, Tuple
+from typing import TypedDict, Annotated, Sequence, Any, AsyncIterator, Dict, Optional, Tuple
 from langchain_core.messages import BaseMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
 from app.tools.intent_tools import products_tool, orders_tool, knowledge_tool, greeting_tool, human_tool, tracking_tool
 from app.router import make_router
 from app.memory import get_message_history
-from app.llm_utils import make_llm
+from app.llm_utils import make_llm, make_stage_llms
 from app.metrics.prometheus_metrics import (
     increment_agent_request_count, observe_agent_latency,
-    increment_intent_count, increment_guardrail_count
+    increment_intent_count, increment_guardrail_count, increment_model_escalation,
+    increment_request_cancelled
 )
-from app.chatwoot_client import add_chatwoot_label
+from app.outbound import enqueue_label
+from app.streaming import SegmentStreamer, split_segments
+from app.intent_batcher import INTENT_BATCHING_ENABLED, get_intent_batcher
+from app.intent_knn import INTENT_KNN_ENABLED, classify_knn
+from app.flow_state import get_flow, follow_up_intent, describe_flow, update_flow
+from app.deadline import Deadline, DeadlineExceeded, reset_deadline, set_deadline
+import asyncio
+import json
 import os
+import re
 import traceback
 import time
 
@@ -29,7 +39,10 @@ class BotState(TypedDict):
     context_summary: str
     raw_output: str  # Output crudo del Worker
     final_output: str  # Output sintetizado
-    llm: Any  # LLM dinámico
+    disable_guardrail: bool  # Flag por request para saltar el guardrail
+    flow: Optional[Dict[str, Any]]  # Flujo activo de la sesión (app/flow_state.py)
+    flow_bypass: bool  # True si la intención vino del flujo, sin router
+    deadline: Optional[Deadline]  # Presupuesto de tiempo del request (app/deadline.py)
 
 # Prompt para el Sintetizador (modificable en app/prompts.py o aquí)
 SYNTHESIZER_PROMPT = ChatPromptTemplate.from_messages([
@@ -44,7 +57,7 @@ Eres un sintetizador de respuestas para un bot de ecommerce por WhatsApp.
     ("human", "{raw_output}")
 ])
 
-# Prompt para Guardrail
+# Prompt para Guardrail (instrucciones estáticas primero: prefijo cacheable por el proveedor)
 GUARDRAIL_PROMPT = ChatPromptTemplate.from_messages([
     ("system", """
 Eres un guardrail de seguridad para un bot de ecommerce.
@@ -61,6 +74,46 @@ Si falla alguna verificación o es demasiado vaga/irrelevante, responde con: "RE
     ("human", "{final_output}")
 ])
 
+# Intents válidos -> nodo que los maneja
+INTENT_ROUTES = {
+    "consulta_producto": "handle_products",
+    "productos": "handle_products",
+    "pedido": "handle_orders",
+    "otro": "handle_knowledge",
+    "saludo": "handle_greeting",
+    "seguimiento": "handle_tracking",
+    "humano": "handle_human",
+    "human": "handle_human",
+}
+
+def _normalize_intent(raw: str) -> str:
+    """El modelo barato a veces añade comillas, puntos o texto extra: quedarse con la etiqueta."""
+    text = (raw or "").strip().lower()
+    # \w (unicode): una etiqueta con tilde o ñ no se corta a la mitad
+    match = re.search(r"\w+", text)
+    return match.group(0) if match else ""
+
+def _model_name(llm: Any) -> Optional[str]:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None)
+
+def _escalates(llms: Dict[str, Any], stage: str) -> bool:
+    """Cada etapa tiene su propia instancia: escalar solo si ESCALATION_MODEL es otro modelo."""
+    return _model_name(llms["escalation"]) != _model_name(llms[stage])
+
+# Cadenas construidas una vez por LLM de etapa (make_stage_llms los cachea, su id es estable)
+_stage_chains: Dict[Tuple[str, int], Tuple[Any, Any]] = {}
+
+def _stage_chain(kind: str, llm: Any, summary_llm: Any = None):
+    key = (kind, id(llm))
+    entry = _stage_chains.get(key)
+    if entry is None:
+        if kind == "router":
+            chain, _, _ = make_router(llm, summary_llm=summary_llm)
+        else:
+            chain = GUARDRAIL_PROMPT | llm
+        entry = _stage_chains[key] = (llm, chain)  # conservar referencia al LLM
+    return entry[1]
+
 # Instancia del router (asumiendo que se crea una vez)
 _router_chain = None
 
@@ -72,14 +125,52 @@ def get_router(provider=None, model=None, temperature=None):
     return _router_chain
 
 # Nodo: Clasificar intención
-def classify_intent(state: BotState) -> BotState:
+def _stage_llms(config: Optional[RunnableConfig]) -> Dict[str, Any]:
+    """LLMs por etapa: viajan en config["configurable"], no en el estado del grafo."""
+    llms = ((config or {}).get("configurable") or {}).get("llms")
+    return llms if llms is not None else make_stage_llms()
+
+def _enter(state: BotState, stage: str):
+    """Registra la etapa en curso; DeadlineExceeded si el request ya agotó su presupuesto."""
+    deadline = state.get("deadline")
+    if deadline is not None:
+        deadline.enter(stage)
+
+def classify_intent(state: BotState, config: RunnableConfig) -> BotState:
+    _enter(state, "classify_intent")
     start_time = time.time()
     user_message = state["messages"][-1].content if state["messages"] else ""
-    context = state.get("context_summary", "")
-    combined_input = (f"{context}\n\n{user_message}") if context else user_message
-    llm = state["llm"]
-    router, _, _ = make_router(llm)  # Crear router con llm dinámico
-    intent = router.invoke({"input": combined_input}).strip().lower()
+    # Respuesta a la pregunta pendiente de un flujo activo: directo al worker, sin router
+    flow = state.get("flow")
+    followed = follow_up_intent(flow, user_message)
+    if followed is not None:
+        increment_intent_count(followed)
+        print(f"[DEBUG] Flow follow-up: {followed} (took {time.time() - start_time:.3f}s)")
+        return {"intent": followed, "flow_bypass": True}
+
+    # El contexto va en su propio mensaje tras el prefijo estático (no antepuesto al input)
+    context = "\n".join(c for c in (state.get("context_summary", ""), describe_flow(flow)) if c)
+    router_input = {"input": user_message, "context": context}
+    llms = _stage_llms(config)
+    intent = None
+    # Respuestas cortas a mitad de conversación ("sí", "negra") dependen del contexto: van al LLM
+    if INTENT_KNN_ENABLED and not (router_input["context"] and len(user_message.split()) <= 2):
+        # k-NN sobre ejemplos etiquetados: unos ms; None si la confianza no llega al umbral
+        intent, confidence = classify_knn(user_message)
+        if intent is not None:
+            print(f"[DEBUG] k-NN intent: {intent} (confidence {confidence:.2f})")
+    if intent is None and INTENT_BATCHING_ENABLED:
+        # None = el lote no trajo etiqueta para este mensaje -> llamada individual
+        intent = get_intent_batcher(llms["router"]).classify(user_message, router_input["context"])
+    if intent is None:
+        intent = _stage_chain("router", llms["router"], llms["summary"]).invoke(router_input)
+    intent = _normalize_intent(intent)
+
+    # Cascada: solo si el modelo barato devuelve algo fuera de vocabulario
+    if intent not in INTENT_ROUTES and _escalates(llms, "router"):
+        increment_model_escalation("router", "unknown_intent")
+        escalated = _stage_chain("router", llms["escalation"], llms["summary"])
+        intent = _normalize_intent(escalated.invoke(router_input))
 
     # Métricas
     increment_intent_count(intent)
@@ -89,15 +180,23 @@ def classify_intent(state: BotState) -> BotState:
     return {"intent": intent}
 
 # Nodos: Manejar cada intención
-def handle_products(state: BotState) -> BotState:
+def _worker_output(output: str) -> BotState:
+    """Salida de un worker: también es la respuesta final si no pasa por synthesize."""
+    return {"raw_output": output, "final_output": output}
+
+async def handle_products(state: BotState) -> BotState:
+    _enter(state, "handle_products")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
     try:
-        output = products_tool._run(user_message, session_id=session_id, context_summary=context)  # Síncrono por simplicidad
+        output = await products_tool._arun(user_message, session_id=session_id, context_summary=context, deadline=state.get("deadline"))
         increment_agent_request_count("products", "success")
+    except DeadlineExceeded:
+        increment_agent_request_count("products", "timeout")
+        raise
     except Exception as e:
         print(f"[ERROR] Products agent error: {e}")
         output = "Lo siento, hubo un problema al consultar productos. Por favor intenta de nuevo."
@@ -106,17 +205,21 @@ def handle_products(state: BotState) -> BotState:
     duration = time.time() - start_time
     observe_agent_latency("products", duration)
     print(f"[DEBUG] Raw output from products_tool: {output} (took {duration:.3f}s)")
-    return {"raw_output": output}
+    return _worker_output(output)
 
-def handle_orders(state: BotState) -> BotState:
+async def handle_orders(state: BotState) -> BotState:
+    _enter(state, "handle_orders")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
     try:
-        output = orders_tool._run(user_message, session_id=session_id, context_summary=context)
+        output = await orders_tool._arun(user_message, session_id=session_id, context_summary=context, deadline=state.get("deadline"))
         increment_agent_request_count("orders", "success")
+    except DeadlineExceeded:
+        increment_agent_request_count("orders", "timeout")
+        raise
     except Exception as e:
         print(f"[ERROR] Orders agent error: {e}")
         output = "Lo siento, hubo un problema al consultar pedidos. Por favor intenta de nuevo."
@@ -124,17 +227,21 @@ def handle_orders(state: BotState) -> BotState:
 
     duration = time.time() - start_time
     observe_agent_latency("orders", duration)
-    return {"raw_output": output}
+    return _worker_output(output)
 
-def handle_knowledge(state: BotState) -> BotState:
+async def handle_knowledge(state: BotState) -> BotState:
+    _enter(state, "handle_knowledge")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
     try:
-        output = knowledge_tool._run(user_message, session_id=session_id, context_summary=context)
+        output = await knowledge_tool._arun(user_message, session_id=session_id, context_summary=context, deadline=state.get("deadline"))
         increment_agent_request_count("knowledge", "success")
+    except DeadlineExceeded:
+        increment_agent_request_count("knowledge", "timeout")
+        raise
     except Exception as e:
         print(f"[ERROR] Knowledge agent error: {e}")
         output = "Lo siento, hubo un problema al consultar información. Por favor intenta de nuevo."
@@ -142,17 +249,21 @@ def handle_knowledge(state: BotState) -> BotState:
 
     duration = time.time() - start_time
     observe_agent_latency("knowledge", duration)
-    return {"raw_output": output}
+    return _worker_output(output)
 
-def handle_greeting(state: BotState) -> BotState:
+async def handle_greeting(state: BotState) -> BotState:
+    _enter(state, "handle_greeting")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
     try:
-        output = greeting_tool._run(user_message, session_id=session_id, context_summary=context)
+        output = await greeting_tool._arun(user_message, session_id=session_id, context_summary=context, deadline=state.get("deadline"))
         increment_agent_request_count("greeting", "success")
+    except DeadlineExceeded:
+        increment_agent_request_count("greeting", "timeout")
+        raise
     except Exception as e:
         print(f"[ERROR] Greeting agent error: {e}")
         output = "¡Hola! ¿En qué puedo ayudarte hoy?"
@@ -160,17 +271,22 @@ def handle_greeting(state: BotState) -> BotState:
 
     duration = time.time() - start_time
     observe_agent_latency("greeting", duration)
-    return {"raw_output": output}
+    return _worker_output(output)
 
-def handle_tracking(state: BotState) -> BotState:
+async def handle_tracking(state: BotState) -> BotState:
+    _enter(state, "handle_tracking")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
     try:
-        output = tracking_tool._run(user_message, session_id=session_id, context_summary=context)
+        # Con número de pedido responde el estado desde la caché de WooCommerce
+        output = await tracking_tool._arun(user_message, session_id=session_id, context_summary=context, deadline=state.get("deadline"))
         increment_agent_request_count("tracking", "success")
+    except DeadlineExceeded:
+        increment_agent_request_count("tracking", "timeout")
+        raise
     except Exception as e:
         print(f"[ERROR] Tracking agent error: {e}")
         output = "Lo siento, hubo un problema al consultar el seguimiento. Por favor intenta de nuevo."
@@ -178,20 +294,18 @@ def handle_tracking(state: BotState) -> BotState:
 
     duration = time.time() - start_time
     observe_agent_latency("tracking", duration)
-    return {"raw_output": output}
+    return _worker_output(output)
 
 async def handle_human(state: BotState) -> BotState:
+    _enter(state, "handle_human")
     start_time = time.time()
     user_message = state["messages"][-1].content
     session_id = state.get("session_id")
     context = state.get("context_summary", "")
 
-    # Ejecutar etiquetado en Chatwoot (side effect)
-    try:
-        if session_id:
-             await add_chatwoot_label(session_id, "human")
-    except Exception as e:
-        print(f"[WARN] Could not label conversation as human: {e}")
+    # Etiquetado en Chatwoot (side effect): se encola, la respuesta no espera la entrega
+    if session_id:
+        enqueue_label(session_id, "human")
 
     try:
         output = human_tool._run(user_message, session_id=session_id, context_summary=context)
@@ -203,12 +317,12 @@ async def handle_human(state: BotState) -> BotState:
 
     duration = time.time() - start_time
     observe_agent_latency("human", duration)
-    return {"raw_output": output}
+    return _worker_output(output)
 
 # Nodo: Sintetizar respuesta
 def synthesize(state: BotState) -> BotState:
     # Bypass summarization as per user request
-    # llm = state["llm"]
+    # llm = _stage_llms(config)["router"]  (el nodo debe aceptar `config: RunnableConfig`)
     # chain = SYNTHESIZER_PROMPT | llm
     # response = chain.invoke({"raw_output": state["raw_output"]})
     # print(f"[DEBUG] Synthesized output: {response.content}")
@@ -218,7 +332,7 @@ def synthesize(state: BotState) -> BotState:
     return {"final_output": state["raw_output"]}
 
 # Nodo: Guardrail de seguridad
-def guardrail(state: BotState) -> BotState:
+async def guardrail(state: BotState, config: RunnableConfig) -> BotState:
     # Allow bypassing the guardrail per-request via state flag or global env var
     disabled_env = os.getenv("ORCHESTRATOR_GUARDRAIL_ENABLED", "true").lower() in ["0", "false", "no"]
     if state.get("disable_guardrail") or disabled_env:
@@ -226,11 +340,17 @@ def guardrail(state: BotState) -> BotState:
         print("[DEBUG] Guardrail disabled for this request; bypassing checks.")
         return {"final_output": state["final_output"]}
 
-    llm = state["llm"]
-    chain = GUARDRAIL_PROMPT | llm
-    response = chain.invoke({"final_output": state["final_output"]})
+    _enter(state, "guardrail")
+    llms = _stage_llms(config)
+    response = await _stage_chain("guardrail", llms["guardrail"]).ainvoke({"final_output": state["final_output"]})
     guarded_output = response.content.strip()
 
+    # Cascada: veredicto fuera de formato -> reintentar una vez con el modelo de escalado
+    if not guarded_output.startswith(("APROBADO:", "RECHAZADO:")) and _escalates(llms, "guardrail"):
+        increment_model_escalation("guardrail", "bad_format")
+        response = await _stage_chain("guardrail", llms["escalation"]).ainvoke({"final_output": state["final_output"]})
+        guarded_output = response.content.strip()
+
     if guarded_output.startswith("APROBADO:"):
         # Extraer la respuesta original
         final_output = guarded_output.replace("APROBADO:", "").strip()
@@ -251,139 +371,217 @@ def guardrail(state: BotState) -> BotState:
 
 # Función de ruteo condicional
 def route_intent(state: BotState) -> str:
-    intent = state.get("intent", "")
-    mapping = {
-        "consulta_producto": "handle_products",
-        "productos": "handle_products",
-        "pedido": "handle_orders",
-        "otro": "handle_knowledge",
-        "saludo": "handle_greeting",
-        "seguimiento": "handle_tracking",
-        "humano": "handle_human",
-        "human": "handle_human",
+    return INTENT_ROUTES.get(state.get("intent", ""), "handle_knowledge")
+
+HANDLER_NODES = ["handle_products", "handle_orders", "handle_knowledge", "handle_greeting", "handle_tracking", "handle_human"]
+
+# Perfil de pipeline por handler: nodos que corren después del worker.
+# synthesize es hoy un pass-through (SYNTHESIZER_ENABLED=false lo quita de todos los perfiles);
+# tracking y human devuelven textos fijos del agente y no necesitan guardrail.
+SYNTHESIZER_ENABLED = os.getenv("SYNTHESIZER_ENABLED", "false").lower() in ("1", "true", "yes")
+DEFAULT_PIPELINE = ["synthesize", "guardrail"]
+
+def _profiles_from_env() -> Dict[str, list]:
+    """
+    Override por entorno, p. ej. PIPELINE_PROFILES='{"handle_greeting": []}'.
+    JSON inválido -> se ignora entero; handlers o nodos desconocidos -> se descartan
+    con aviso, y los nodos quedan sin repetir y en el orden de DEFAULT_PIPELINE
+    (un nodo inexistente rompe compile(); uno repetido haría un ciclo en _next_step).
+    """
+    raw = os.getenv("PIPELINE_PROFILES", "") or "{}"
+    try:
+        profiles = json.loads(raw)
+        if not isinstance(profiles, dict) or not all(isinstance(v, list) for v in profiles.values()):
+            raise ValueError("se espera un objeto {handler: [nodos]}")
+    except ValueError as e:
+        print(f"[WARN] PIPELINE_PROFILES inválido ({e}); se usan los perfiles por defecto")
+        return {}
+    clean: Dict[str, list] = {}
+    for handler, steps in profiles.items():
+        if handler not in HANDLER_NODES:
+            print(f"[WARN] PIPELINE_PROFILES: handler desconocido '{handler}' ignorado")
+            continue
+        unknown = [n for n in steps if n not in DEFAULT_PIPELINE]
+        if unknown:
+            print(f"[WARN] PIPELINE_PROFILES: nodos desconocidos {unknown} en '{handler}' ignorados")
+        clean[handler] = [n for n in DEFAULT_PIPELINE if n in steps]
+    return clean
+
+PIPELINE_PROFILES: Dict[str, list] = {
+    "handle_tracking": [],
+    "handle_human": [],
+    **_profiles_from_env(),
+}
+# Perfil "completo" (todos los nodos), para comparar en benchmarks
+FULL_PROFILES: Dict[str, list] = {node: DEFAULT_PIPELINE for node in HANDLER_NODES}
+
+def resolve_profiles(profiles: Optional[Dict[str, list]] = None, synthesizer: bool = SYNTHESIZER_ENABLED) -> Dict[str, list]:
+    """Pipeline efectivo por handler (sin synthesize si está deshabilitado)."""
+    profiles = PIPELINE_PROFILES if profiles is None else profiles
+    return {
+        node: [n for n in profiles.get(node, DEFAULT_PIPELINE) if synthesizer or n != "synthesize"]
+        for node in HANDLER_NODES
     }
-    return mapping.get(intent, "handle_knowledge")
 
-# Construir el grafo
-graph = StateGraph(BotState)
-
-# Agregar nodos
-graph.add_node("classify_intent", classify_intent)
-graph.add_node("handle_products", handle_products)
-graph.add_node("handle_orders", handle_orders)
-graph.add_node("handle_knowledge", handle_knowledge)
-graph.add_node("handle_greeting", handle_greeting)
-graph.add_node("handle_human", handle_human)
-graph.add_node("handle_tracking", handle_tracking)
-graph.add_node("synthesize", synthesize)
-graph.add_node("guardrail", guardrail)
-
-# Edges
-graph.set_entry_point("classify_intent")
-graph.add_conditional_edges(
-    "classify_intent",
-    route_intent,
-    {
-        "handle_products": "handle_products",
-        "handle_orders": "handle_orders",
-        "handle_knowledge": "handle_knowledge",
-        "handle_greeting": "handle_greeting",
-        "handle_tracking": "handle_tracking",
-        "handle_human": "handle_human",
-    }
-)
+def _next_step(after: str, profiles: Dict[str, list]):
+    """Arista condicional: siguiente nodo del perfil del handler elegido, o END."""
+    def route(state: BotState) -> str:
+        steps = profiles[route_intent(state)]
+        if after in steps:
+            idx = steps.index(after) + 1
+            return steps[idx] if idx < len(steps) else END
+        return steps[0] if steps else END
+    return route
 
-# Todos los nodos de manejo van a synthesize
-for node in ["handle_products", "handle_orders", "handle_knowledge", "handle_greeting", "handle_tracking", "handle_human"]:
-    graph.add_edge(node, "synthesize")
-
-# Sintetizador va a guardrail
-graph.add_edge("synthesize", "guardrail")
+# Construir el grafo
+def build_graph(profiles: Optional[Dict[str, list]] = None, synthesizer: bool = SYNTHESIZER_ENABLED) -> StateGraph:
+    profiles = resolve_profiles(profiles, synthesizer)
+    graph = StateGraph(BotState)
+
+    # Agregar nodos
+    graph.add_node("classify_intent", classify_intent)
+    graph.add_node("handle_products", handle_products)
+    graph.add_node("handle_orders", handle_orders)
+    graph.add_node("handle_knowledge", handle_knowledge)
+    graph.add_node("handle_greeting", handle_greeting)
+    graph.add_node("handle_human", handle_human)
+    graph.add_node("handle_tracking", handle_tracking)
+    post_nodes = {n for steps in profiles.values() for n in steps}
+    if "synthesize" in post_nodes:
+        graph.add_node("synthesize", synthesize)
+    if "guardrail" in post_nodes:
+        graph.add_node("guardrail", guardrail)
+
+    # Edges
+    graph.set_entry_point("classify_intent")
+    graph.add_conditional_edges(
+        "classify_intent",
+        route_intent,
+        {node: node for node in HANDLER_NODES}
+    )
+
+    # Cada handler sigue su perfil: synthesize -> guardrail -> END, solo lo que necesita
+    targets = {n: n for n in post_nodes}
+    targets[END] = END
+    for node in HANDLER_NODES:
+        steps = profiles[node]
+        graph.add_edge(node, steps[0] if steps else END)
+    for node in post_nodes:
+        graph.add_conditional_edges(node, _next_step(node, profiles), targets)
+
+    return graph
+
+# Grafo compilado: se construye en el warm-up (lifespan) o en el primer uso
+_compiled_graph = None
+
+def get_compiled_graph():
+    global _compiled_graph
+    if _compiled_graph is None:
+        _compiled_graph = build_graph().compile()
+    return _compiled_graph
+
+# Respuesta si el request agota su deadline (el gateway probablemente ya no la espera)
+DEADLINE_REPLY = "Lo siento, tu consulta está tardando más de lo normal. Por favor intenta de nuevo en un momento."
+
+ERROR_REPLY = "Parece que hubo un problema al intentar conectar con el agente. Esto puede deberse a un error de red. Te recomiendo intentar de nuevo más tarde. Si el problema persiste, por favor contáctanos por otro medio. ¡Estamos aquí para ayudarte!"
+
+def _make_langfuse_handler(session_id: str):
+    # INTEGRACIÓN MINIMALISTA LANGFUSE (PoC)
+    langfuse_handler = None
+    try:
+        try:
+            from langfuse.callback import CallbackHandler
+        except ImportError:
+            from langfuse.langchain import CallbackHandler
 
-# Guardrail va a END
-graph.add_edge("guardrail", END)
+        # Confiamos 100% en las variables de entorno (LANGFUSE_HOST, PUBLIC_KEY, SECRET_KEY)
+        print(f"[INFO] Inicializando Langfuse para sesión: {session_id}")
+        try:
+            # SDK < 3.0.0 acepta session_id en constructor
+            langfuse_handler = CallbackHandler(session_id=session_id)
+        except Exception as e:
+            print(f"[WARN] Error init CallbackHandler con session_id: {e}. Probando sin args.")
+            langfuse_handler = CallbackHandler()
 
-# Compilar el grafo
-compiled_graph = graph.compile()
+        if hasattr(langfuse_handler, "auth_check"):
+            langfuse_handler.auth_check()
+    except Exception as e:
+        print(f"[WARN] Langfuse no disponible: {e}")
+    return langfuse_handler
 
-# Función para invocar el grafo
-async def run_graph(session_id: str, user_text: str, provider=None, model=None, temperature=None, router_summary=None, disable_guardrail: bool = False) -> Tuple[str, str]:
-    try:
-        # INTEGRACIÓN MINIMALISTA LANGFUSE (PoC)
-        langfuse_handler = None
+def _flush_langfuse(langfuse_handler):
+    # FLUSH: Vital para asegurar envío de datos antes de terminar
+    if langfuse_handler:
         try:
-            try:
-                from langfuse.callback import CallbackHandler
-            except ImportError:
-                from langfuse.langchain import CallbackHandler
-            
-            # Confiamos 100% en las variables de entorno (LANGFUSE_HOST, PUBLIC_KEY, SECRET_KEY)
-            print(f"[INFO] Inicializando Langfuse para sesión: {session_id}")
-            try:
-                # SDK < 3.0.0 acepta session_id en constructor
-                langfuse_handler = CallbackHandler(session_id=session_id)
-            except Exception as e:
-                print(f"[WARN] Error init CallbackHandler con session_id: {e}. Probando sin args.")
-                langfuse_handler = CallbackHandler()
-
-            if hasattr(langfuse_handler, "auth_check"):
-                langfuse_handler.auth_check()
+           langfuse_handler.flush()
         except Exception as e:
-            print(f"[WARN] Langfuse no disponible: {e}")
+           print(f"[WARN] Fallo al hacer flush de Langfuse: {e}")
 
-        # Obtener historial y añadir mensaje del usuario
-        hist = get_message_history(session_id)
+def _run_config(callbacks, provider=None, model=None, temperature=None) -> RunnableConfig:
+    """Config del grafo: callbacks + LLMs por etapa en `configurable` (fuera del estado)."""
+    return {"callbacks": callbacks, "configurable": {"llms": make_stage_llms(provider, model, temperature)}}
+
+def _prepare_run(session_id: str, user_text: str, router_summary=None, disable_guardrail: bool = False, deadline: Optional[Deadline] = None):
+    """Añade el mensaje al historial y construye el estado inicial del grafo."""
+    # Obtener historial y añadir mensaje del usuario
+    hist = get_message_history(session_id)
+    try:
+        hist.add_user_message(user_text)
+    except Exception:
+        # Si la implementación de historial falla, continuar
+        pass
+
+    # Construir context_summary a partir de la memoria del router si está disponible
+    context_summary = ""
+    if router_summary is not None:
         try:
-            hist.add_user_message(user_text)
+            router_vars = router_summary.load_memory_variables({})
+            ctx = router_vars.get("summary_context", "")
+            if isinstance(ctx, list):
+                # Extraer texto si vienen como mensajes
+                parts = []
+                for m in ctx:
+                    if hasattr(m, "content"):
+                        parts.append(m.content)
+                    else:
+                        parts.append(str(m))
+                context_summary = " ".join(parts)
+            else:
+                context_summary = str(ctx)
         except Exception:
-            # Si la implementación de historial falla, continuar
-            pass
+            context_summary = ""
+
+    # Estado inicial
+    initial_state = {
+        "messages": [HumanMessage(content=user_text)],
+        "intent": "",
+        "session_id": session_id,
+        "context_summary": context_summary,
+        "raw_output": "",
+        "final_output": "",
+        "flow": get_flow(session_id),
+        "flow_bypass": False,
+        # Per-request flag to disable guardrail
+        "disable_guardrail": bool(disable_guardrail),
+        "deadline": deadline,
+    }
+    return hist, initial_state
 
-        # Construir context_summary a partir de la memoria del router si está disponible
-        context_summary = ""
-        if router_summary is not None:
-            try:
-                router_vars = router_summary.load_memory_variables({})
-                ctx = router_vars.get("summary_context", "")
-                if isinstance(ctx, list):
-                    # Extraer texto si vienen como mensajes
-                    parts = []
-                    for m in ctx:
-                        if hasattr(m, "content"):
-                            parts.append(m.content)
-                        else:
-                            parts.append(str(m))
-                    context_summary = " ".join(parts)
-                else:
-                    context_summary = str(ctx)
-            except Exception:
-                context_summary = ""
-
-        # Estado inicial
-        initial_state = {
-            "messages": [HumanMessage(content=user_text)],
-            "intent": "",
-            "session_id": session_id,
-            "context_summary": context_summary,
-            "raw_output": "",
-            "final_output": "",
-            "llm": get_synthesizer_llm(provider, model, temperature),
-            # Per-request flag to disable guardrail
-            "disable_guardrail": bool(disable_guardrail),
-        }
+# Función para invocar el grafo
+async def run_graph(session_id: str, user_text: str, provider=None, model=None, temperature=None, router_summary=None, disable_guardrail: bool = False, deadline: Optional[Deadline] = None) -> Tuple[str, str]:
+    # El deadline llega a los nodos por el estado y a las llamadas LLM por contextvar
+    token = set_deadline(deadline)
+    try:
+        langfuse_handler = _make_langfuse_handler(session_id)
+        hist, initial_state = _prepare_run(session_id, user_text, router_summary, disable_guardrail, deadline)
 
         print(f"[DEBUG] Initial state: {initial_state}")
 
         # Ejecutar grafo
         callbacks = [langfuse_handler] if langfuse_handler else []
-        result = await compiled_graph.ainvoke(initial_state, config={"callbacks": callbacks})
+        result = await get_compiled_graph().ainvoke(initial_state, config=_run_config(callbacks, provider, model, temperature))
 
-        # FLUSH: Vital para asegurar envío de datos antes de terminar
-        if langfuse_handler:
-            try:
-               langfuse_handler.flush()
-            except Exception as e:
-               print(f"[WARN] Fallo al hacer flush de Langfuse: {e}")
+        _flush_langfuse(langfuse_handler)
 
         print(f"[DEBUG] Graph result: {result}")
 
@@ -394,10 +592,111 @@ async def run_graph(session_id: str, user_text: str, provider=None, model=None,
             hist.add_ai_message(output)
         except Exception:
             pass
+        update_flow(session_id, intent, output, initial_state["flow"], bool(result.get("flow_bypass")))
 
         return output, intent
+    except DeadlineExceeded as e:
+        print(f"[WARN] {e}; se corta el grafo")
+        return DEADLINE_REPLY, "timeout"
     except Exception as e:
         print(f"[ERROR] Exception in run_graph: {e}")
         import traceback
         traceback.print_exc()
-        return "Parece que hubo un problema al intentar conectar con el agente. Esto puede deberse a un error de red. Te recomiendo intentar de nuevo más tarde. Si el problema persiste, por favor contáctanos por otro medio. ¡Estamos aquí para ayudarte!", "error"
\ No newline at end of file
+        return ERROR_REPLY, "error"
+    finally:
+        reset_deadline(token)
+
+# Nodos cuyo fin se notifica como evento de progreso en modo streaming
+_STREAM_NODES = {"classify_intent", "handle_products", "handle_orders", "handle_knowledge",
+                 "handle_greeting", "handle_tracking", "handle_human", "synthesize", "guardrail"}
+
+async def stream_graph(session_id: str, user_text: str, provider=None, model=None, temperature=None, router_summary=None, disable_guardrail: bool = False, deadline: Optional[Deadline] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Variante en streaming de `run_graph`: emite eventos a medida que los nodos terminan.
+
+    Eventos: {"event": "node", "node", "elapsed_ms"}, {"event": "intent", "intent"},
+    {"event": "segment", "index", "text"} y al final {"event": "done", "reply", "intent"}.
+    Los segmentos se emiten en cuanto el texto es definitivo: tokens del guardrail
+    cuando aprueba la respuesta, o la salida completa del nodo final.
+    Si el cliente se desconecta, Starlette cancela el generador y con él el grafo.
+    """
+    start = time.time()
+    # Generador async: el contextvar vive en el contexto del consumidor; se restaura al terminar
+    token = set_deadline(deadline)
+    langfuse_handler = _make_langfuse_handler(session_id)
+    state: Dict[str, Any] = {}
+    segmenter = SegmentStreamer()
+    guardrail_buffer = ""
+    guardrail_streaming = False
+    emitted = 0
+    try:
+        hist, initial_state = _prepare_run(session_id, user_text, router_summary, disable_guardrail, deadline)
+        callbacks = [langfuse_handler] if langfuse_handler else []
+        async for ev in get_compiled_graph().astream_events(initial_state, config=_run_config(callbacks, provider, model, temperature), version="v2"):
+            kind = ev.get("event")
+            node = (ev.get("metadata") or {}).get("langgraph_node")
+
+            # Tokens del guardrail: solo se transmiten si el veredicto es APROBADO
+            if kind == "on_chat_model_stream" and node == "guardrail":
+                chunk = getattr(ev["data"].get("chunk"), "content", "") or ""
+                if guardrail_streaming:
+                    for seg in segmenter.feed(chunk):
+                        yield {"event": "segment", "index": emitted, "text": seg}
+                        emitted += 1
+                else:
+                    guardrail_buffer += chunk
+                    if guardrail_buffer.lstrip().startswith("APROBADO:"):
+                        guardrail_streaming = True
+                        rest = guardrail_buffer.lstrip()[len("APROBADO:"):].lstrip()
+                        for seg in segmenter.feed(rest):
+                            yield {"event": "segment", "index": emitted, "text": seg}
+                            emitted += 1
+                continue
+
+            if kind != "on_chain_end" or ev.get("name") not in _STREAM_NODES:
+                continue
+            name = ev["name"]
+            output = ev["data"].get("output")
+            if isinstance(output, dict):
+                state.update(output)
+            yield {"event": "node", "node": name, "elapsed_ms": int((time.time() - start) * 1000)}
+            if name == "classify_intent":
+                yield {"event": "intent", "intent": state.get("intent", "")}
+
+        _flush_langfuse(langfuse_handler)
+        output = state.get("final_output") or "Respuesta no disponible."
+        intent = state.get("intent", "otro")
+        if guardrail_streaming:
+            for seg in segmenter.flush():
+                yield {"event": "segment", "index": emitted, "text": seg}
+                emitted += 1
+        else:
+            for seg in split_segments(output):
+                yield {"event": "segment", "index": emitted, "text": seg}
+                emitted += 1
+        try:
+            hist.add_ai_message(output)
+        except Exception:
+            pass
+        update_flow(session_id, intent, output, initial_state["flow"], bool(state.get("flow_bypass")))
+        yield {"event": "done", "reply": output, "intent": intent, "elapsed_ms": int((time.time() - start) * 1000)}
+    except asyncio.CancelledError:
+        increment_request_cancelled(deadline.stage if deadline is not None else "stream")
+        raise
+    except DeadlineExceeded as e:
+        print(f"[WARN] {e}; se corta el stream")
+        if emitted == 0:
+            yield {"event": "segment", "index": 0, "text": DEADLINE_REPLY}
+        yield {"event": "done", "reply": DEADLINE_REPLY, "intent": "timeout", "elapsed_ms": int((time.time() - start) * 1000)}
+    except Exception as e:
+        print(f"[ERROR] Exception in stream_graph: {e}")
+        traceback.print_exc()
+        if emitted == 0:
+            yield {"event": "segment", "index": 0, "text": ERROR_REPLY}
+        yield {"event": "done", "reply": ERROR_REPLY, "intent": "error", "elapsed_ms": int((time.time() - start) * 1000)}
+    finally:
+        try:
+            reset_deadline(token)
+        except ValueError:
+            # aclose() desde otro contexto (generador abandonado y recolectado): nada que restaurar aquí
+            pass
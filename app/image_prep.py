@@ -0,0 +1,119 @@
+"""
+Preprocesado de imágenes antes del OCR.
+
+El modelo de visión no usa la resolución completa: con detail "high" la
+imagen se ajusta a 2048x2048 y luego el lado corto a 768 px, y se cobra por
+teselas de 512 px. Mandar la foto original solo agranda el payload. Aquí se
+reescala a ese tamaño efectivo (respetando la orientación EXIF) y se
+re-codifica en JPEG; si el resultado no es más chico, se manda el original.
+
+Pillow es opcional: sin Pillow (o con una imagen que no abre) se usa el original.
+"""
+
+import io
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import add_image_prep_bytes
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None  # runtime import guard
+    ImageOps = None
+
+load_dotenv()
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_SHORT_SIDE = int(os.getenv("IMAGE_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# auto | high | low (low: 512x512 fijo, barato pero pierde texto chico)
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto").lower()
+
+# Tokens por imagen (base, por tesela de 512 px). gpt-4o-mini cuenta ~33x más tokens a menor precio.
+_VISION_TOKENS = {
+    "gpt-4o-mini": (2833, 5667),
+}
+_DEFAULT_VISION_TOKENS = (85, 170)
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mimetype: str
+    width: int
+    height: int
+    raw_bytes: int
+    prepared: bool = False
+
+
+def open_image(data: bytes) -> Optional[Any]:
+    """Imagen Pillow con la orientación EXIF aplicada; None si no se puede abrir."""
+    if Image is None or not data:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        return ImageOps.exif_transpose(image)
+    except Exception as e:
+        print(f"[WARN] No se pudo abrir la imagen ({e})")
+        return None
+
+
+def target_size(width: int, height: int) -> Tuple[int, int]:
+    """Tamaño que el modelo de visión usa realmente (detail high)."""
+    scale = min(1.0, IMAGE_MAX_SIDE / max(width, height))
+    short = min(width, height) * scale
+    if short > IMAGE_SHORT_SIDE:
+        scale *= IMAGE_SHORT_SIDE / short
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def vision_tokens(width: int, height: int, model: str = "gpt-4o-mini", detail: str = IMAGE_DETAIL) -> int:
+    """Tokens de entrada que cuesta la imagen en el modelo de visión."""
+    base, per_tile = _VISION_TOKENS.get(model, _DEFAULT_VISION_TOKENS)
+    if detail == "low":
+        return base
+    w, h = target_size(width, height)
+    return base + per_tile * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+def prepare_image(data: bytes, mimetype: str, image: Optional[Any] = None) -> PreparedImage:
+    """
+    Imagen lista para el modelo de visión: reescalada al tamaño efectivo y en JPEG.
+    Nunca lanza: ante cualquier problema devuelve el original.
+    """
+    add_image_prep_bytes("raw", len(data))
+    if image is None:
+        image = open_image(data)
+    if image is None:
+        add_image_prep_bytes("uploaded", len(data))
+        return PreparedImage(data=data, mimetype=mimetype, width=0, height=0, raw_bytes=len(data))
+    original = PreparedImage(data=data, mimetype=mimetype, width=image.width, height=image.height, raw_bytes=len(data))
+    if not IMAGE_PREP_ENABLED:
+        add_image_prep_bytes("uploaded", len(data))
+        return original
+    try:
+        size = target_size(image.width, image.height)
+        resized = image.resize(size, Image.LANCZOS) if size != (image.width, image.height) else image
+        if resized.mode not in ("RGB", "L"):
+            # JPEG no admite alfa: se compone sobre blanco (capturas con transparencia)
+            background = Image.new("RGB", resized.size, (255, 255, 255))
+            rgba = resized.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            resized = background
+        out = io.BytesIO()
+        resized.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        encoded = out.getvalue()
+    except Exception as e:
+        print(f"[WARN] Re-codificación de imagen falló ({e}); se manda el original")
+        add_image_prep_bytes("uploaded", len(data))
+        return original
+    if len(encoded) >= len(data) and size == (image.width, image.height):
+        add_image_prep_bytes("uploaded", len(data))
+        return original
+    add_image_prep_bytes("uploaded", len(encoded))
+    return PreparedImage(data=encoded, mimetype="image/jpeg", width=size[0], height=size[1], raw_bytes=len(data), prepared=True)
@@ -0,0 +1,161 @@
+"""
+Clasificación de intención por lotes entre sesiones concurrentes.
+
+Los mensajes que llegan dentro de una ventana de INTENT_BATCH_WAIT_MS se
+clasifican con una sola llamada de salida estructurada (mismo prefijo del
+router + lista numerada de mensajes con su contexto). Esquema
+líder/seguidor: el primer hilo espera la ventana y hace UNA llamada (su lote);
+al terminar pasa el liderazgo al primero de la cola, que lanza el siguiente
+lote sin volver a esperar (sus mensajes ya esperaron la llamada anterior).
+Así ningún líder queda atrapado vaciando la cola bajo carga sostenida.
+
+Sin tráfico reciente (nada llegó en INTENT_BATCH_IDLE_MS) no hay con quién
+agrupar: el mensaje va directo a la llamada individual, sin esperar la ventana.
+
+`classify` devuelve None si el lote falla o no trae etiqueta para el
+mensaje: el llamador hace entonces la llamada individual de siempre.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+from app.metrics.prometheus_metrics import observe_intent_batch_size, increment_intent_batch_fallback
+from app.prompts import ROUTER_INSTRUCTIONS
+
+load_dotenv()
+INTENT_BATCHING_ENABLED = os.getenv("INTENT_BATCHING_ENABLED", "false").lower() in ("1", "true", "yes")
+INTENT_BATCH_WAIT_MS = float(os.getenv("INTENT_BATCH_WAIT_MS", "8"))
+INTENT_BATCH_MAX = int(os.getenv("INTENT_BATCH_MAX", "16"))
+INTENT_BATCH_IDLE_MS = float(os.getenv("INTENT_BATCH_IDLE_MS", "200"))
+
+BATCH_ROUTER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", ROUTER_INSTRUCTIONS),
+    ("system", """
+MODO LOTE: recibirás varios mensajes de clientes distintos, numerados, cada uno
+con su propio contexto. Clasifica cada mensaje de forma independiente (no mezcles
+contextos) y devuelve una etiqueta por número usando la herramienta.
+"""),
+    ("human", "{items}"),
+])
+
+
+class IntentLabel(BaseModel):
+    id: int = Field(description="Número del mensaje")
+    intent: str = Field(description="Intención elegida para ese mensaje")
+
+
+class BatchIntents(BaseModel):
+    """Intención de cada mensaje del lote."""
+    labels: List[IntentLabel]
+
+
+class _Pending:
+    __slots__ = ("text", "context", "event", "intent", "done")
+
+    def __init__(self, text: str, context: str):
+        self.text = text
+        self.context = context
+        # Se activa al terminar su lote o al recibir el liderazgo (done=False)
+        self.event = threading.Event()
+        self.intent: Optional[str] = None
+        self.done = False
+
+
+def _format_items(batch: List[_Pending]) -> str:
+    parts = []
+    for i, p in enumerate(batch, start=1):
+        context = p.context.strip() if p.context else "(sin contexto)"
+        parts.append(f"[{i}]\nContexto: {context}\nMensaje: {p.text}")
+    return "\n\n".join(parts)
+
+
+class IntentBatcher:
+    def __init__(self, llm: Any, max_wait_ms: float = INTENT_BATCH_WAIT_MS, max_batch: int = INTENT_BATCH_MAX,
+                 idle_ms: float = INTENT_BATCH_IDLE_MS):
+        self.llm = llm
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
+        self.idle_ms = idle_ms
+        self._chain = BATCH_ROUTER_PROMPT | llm.with_structured_output(BatchIntents)
+        self._lock = threading.Lock()
+        self._queue: List[_Pending] = []
+        self._leader_active = False
+        self._last_arrival = 0.0
+
+    def classify(self, text: str, context: str = "") -> Optional[str]:
+        pending = _Pending(text, context)
+        now = time.monotonic()
+        with self._lock:
+            idle = not self._leader_active and (now - self._last_arrival) * 1000.0 > self.idle_ms
+            self._last_arrival = now
+            if idle:
+                increment_intent_batch_fallback("idle")
+                return None
+            self._queue.append(pending)
+            is_leader = not self._leader_active
+            self._leader_active = True
+
+        if is_leader:
+            time.sleep(self.max_wait_ms / 1000.0)
+        else:
+            pending.event.wait()
+            if pending.done:
+                return pending.intent
+            # Liderazgo recibido: su lote sale ya
+            pending.event.clear()
+        self._lead()
+        return pending.intent
+
+    def _lead(self):
+        """Un solo lote (el líder va primero en la cola) y traspaso del liderazgo."""
+        with self._lock:
+            batch = self._queue[: self.max_batch]
+            del self._queue[: self.max_batch]
+        self._flush(batch)
+        with self._lock:
+            if self._queue:
+                self._queue[0].event.set()
+            else:
+                self._leader_active = False
+
+    def _flush(self, batch: List[_Pending]):
+        observe_intent_batch_size(len(batch))
+        try:
+            if len(batch) == 1:
+                # Lote de uno: la llamada individual normal es más barata
+                increment_intent_batch_fallback("single")
+                return
+            result = self._chain.invoke({"items": _format_items(batch)})
+            labels: Dict[int, str] = {item.id: item.intent for item in (result.labels if result else [])}
+            for i, p in enumerate(batch, start=1):
+                p.intent = labels.get(i)
+                if p.intent is None:
+                    increment_intent_batch_fallback("missing_label")
+        except Exception as e:
+            print(f"[WARN] Clasificación por lotes falló ({e}); usando llamadas individuales.")
+            increment_intent_batch_fallback("error")
+        finally:
+            for p in batch:
+                p.done = True
+                p.event.set()
+
+
+_batchers: Dict[int, IntentBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_intent_batcher(llm: Any) -> IntentBatcher:
+    """Un batcher por LLM de router (los LLM de etapa están cacheados, su id es estable)."""
+    batcher = _batchers.get(id(llm))
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(id(llm))
+            if batcher is None:
+                batcher = _batchers[id(llm)] = IntentBatcher(llm)
+    return batcher
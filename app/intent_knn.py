@@ -0,0 +1,201 @@
+"""
+Clasificador de intención k-NN sobre embeddings de ejemplos etiquetados.
+
+- Ejemplos semilla tomados del ROUTER_PROMPT, ampliables con JSONL de
+  producción ({"text": ..., "intent": ...}) vía scripts/build_intent_index.py.
+- Matriz float32 normalizada en INTENT_KNN_DIR/vectors-<build>.npy, cargada
+  con memory-map (compartida entre workers por el page cache). labels.json
+  apunta a la matriz de su build y se reemplaza al final (os.replace): es el
+  único puntero, así un lector nunca mezcla etiquetas y vectores de builds
+  distintos. Se recarga si labels.json cambia en disco.
+- Similitud coseno vectorizada + voto ponderado de los k vecinos; devuelve
+  intención y confianza para consultar al LLM solo por debajo del umbral.
+- Los mensajes entrantes se embeben con `get_embeddings()` (mismo camino y
+  caché que las consultas de app/vector/vector.py). Si el embedding falla se
+  delega en el LLM, como con confianza baja.
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.deadline import DeadlineExceeded
+from app.metrics.prometheus_metrics import increment_intent_knn
+from app.vector.embedding_cache import get_embeddings
+
+load_dotenv()
+INTENT_KNN_ENABLED = os.getenv("INTENT_KNN_ENABLED", "false").lower() in ("1", "true", "yes")
+INTENT_KNN_DIR = os.getenv("INTENT_KNN_DIR", "data/intent_knn")
+INTENT_KNN_K = int(os.getenv("INTENT_KNN_K", "5"))
+INTENT_KNN_THRESHOLD = float(os.getenv("INTENT_KNN_THRESHOLD", "0.75"))
+
+# Ejemplos del ROUTER_PROMPT (reglas 5-13)
+SEED_EXAMPLES: Dict[str, List[str]] = {
+    "saludo": ["Hola", "Buenas tardes", "Buenos días", "Buenas noches", "Hola, ¿qué tal?"],
+    "consulta_producto": [
+        "Quiero zapatos", "Me interesa una pulsera", "Estoy buscando collares",
+        "Me gustaría ver aretes", "¿Tienen ropa de mujer?", "¿Venden accesorios?",
+        "Busco zapatos negros", "Necesito un collar dorado",
+    ],
+    "otro": [
+        "¿Cómo saber mi talla?", "¿Tienen tienda física?", "¿Cuánto tarda el envío?",
+        "¿Qué métodos de pago tienen?", "¿Cómo registrar mi pago?", "¿Cuáles son los medios de pago?",
+        "¿Qué formas de entrega tienen?", "¿Tienen catálogo?", "¿Qué promociones hay?", "¿Qué venden?",
+    ],
+    "pedido": ["mi correo es cliente@correo.com", "mi número es 987654321", "Quiero hacer un pedido"],
+    "seguimiento": ["¿Dónde está mi pedido?", "¿Cuál es el estado de mi pedido?", "¿Ya enviaron mi pedido?"],
+    "humano": [
+        "Quiero hablar con una persona", "Pásame con un humano", "Estoy molesto, nadie me ayuda",
+        "Ya te lo dije varias veces", "Esto no sirve, quiero un asesor",
+    ],
+}
+
+
+def _labels_path(directory: str = INTENT_KNN_DIR) -> str:
+    return os.path.join(directory, "labels.json")
+
+
+def load_examples(paths: Iterable[str] = ()) -> List[Tuple[str, str]]:
+    """Ejemplos semilla + los de los JSONL indicados (deduplicados por texto)."""
+    examples = {text: intent for intent, texts in SEED_EXAMPLES.items() for text in texts}
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    row = json.loads(line)
+                    examples[row["text"]] = row["intent"]
+    return list(examples.items())
+
+
+def _atomic_write(path: str, write):
+    """Escribe en un temporal único del mismo directorio y lo mueve con os.replace."""
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as fh:
+        tmp = fh.name
+        try:
+            write(fh)
+        except BaseException:
+            fh.close()
+            os.unlink(tmp)
+            raise
+    os.replace(tmp, path)
+
+
+def build_index(examples: List[Tuple[str, str]], directory: str = INTENT_KNN_DIR) -> int:
+    """Embebe los ejemplos y guarda matriz normalizada + etiquetas (escritura atómica)."""
+    import numpy as np
+
+    texts = [t for t, _ in examples]
+    vectors = np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    os.makedirs(directory, exist_ok=True)
+    vectors_name = f"vectors-{uuid.uuid4().hex[:12]}.npy"
+    _atomic_write(os.path.join(directory, vectors_name), lambda fh: np.save(fh, vectors))
+    meta = {"vectors": vectors_name, "labels": [i for _, i in examples], "texts": texts}
+    # labels.json va al final: su reemplazo publica el build completo
+    _atomic_write(_labels_path(directory), lambda fh: fh.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+    # Matrices de builds anteriores: los workers que aún las tienen mapeadas conservan su copia
+    for old in glob.glob(os.path.join(directory, "vectors*.npy")):
+        if os.path.basename(old) != vectors_name:
+            try:
+                os.unlink(old)
+            except OSError:
+                pass
+    return len(texts)
+
+
+class KNNIntentClassifier:
+    def __init__(self, vectors, labels: List[str], k: int = INTENT_KNN_K):
+        self.vectors = vectors
+        self.labels = labels
+        self.k = k
+
+    @classmethod
+    def load(cls, directory: str = INTENT_KNN_DIR) -> "KNNIntentClassifier":
+        import numpy as np
+
+        with open(_labels_path(directory), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        # Índices anteriores a los builds con nombre: vectors.npy fijo
+        vectors = np.load(os.path.join(directory, meta.get("vectors", "vectors.npy")), mmap_mode="r")
+        if len(vectors) != len(meta["labels"]):
+            raise ValueError(f"{len(vectors)} vectores para {len(meta['labels'])} etiquetas")
+        return cls(vectors, meta["labels"])
+
+    def scores(self, vector) -> Dict[str, float]:
+        """Voto ponderado por similitud de los k vecinos más cercanos."""
+        import numpy as np
+
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        sims = self.vectors @ q
+        k = min(self.k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        votes: Dict[str, float] = {}
+        for i in top:
+            votes[self.labels[i]] = votes.get(self.labels[i], 0.0) + max(float(sims[i]), 0.0)
+        return votes
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """
+        (intención, confianza). Confianza = similitud acumulada del ganador / k:
+        combina acuerdo entre vecinos y cercanía (5 vecinos a 0.9 -> 0.9; 3 de 5 -> 0.54).
+        """
+        votes = self.scores(get_embeddings().embed_query(text))
+        if not votes:
+            return None, 0.0
+        intent = max(votes, key=votes.get)
+        return intent, votes[intent] / min(self.k, len(self.labels))
+
+
+_loaded: Optional[Tuple[float, KNNIntentClassifier]] = None
+_load_lock = threading.Lock()
+
+
+def get_knn_classifier() -> Optional[KNNIntentClassifier]:
+    """Clasificador cargado, o None si aún no se construyó el índice. Se recarga si cambia labels.json."""
+    global _loaded
+    try:
+        mtime = os.path.getmtime(_labels_path())
+    except OSError:
+        return None
+    if _loaded and _loaded[0] == mtime:
+        return _loaded[1]
+    with _load_lock:
+        if _loaded and _loaded[0] == mtime:
+            return _loaded[1]
+        try:
+            classifier = KNNIntentClassifier.load()
+        except Exception as e:
+            print(f"[WARN] No se pudo cargar el índice k-NN de intenciones: {e}")
+            return _loaded[1] if _loaded else None
+        _loaded = (mtime, classifier)
+        return classifier
+
+
+def classify_knn(text: str, threshold: float = INTENT_KNN_THRESHOLD) -> Tuple[Optional[str], float]:
+    """Intención si la confianza supera el umbral; (None, confianza) para delegar en el LLM."""
+    classifier = get_knn_classifier()
+    if classifier is None or not text.strip():
+        increment_intent_knn("unavailable")
+        return None, 0.0
+    try:
+        intent, confidence = classifier.predict(text)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Sin embedding (API caída, timeout) el turno sigue con el clasificador LLM
+        print(f"[WARN] k-NN de intenciones falló ({e}); se usa el LLM")
+        increment_intent_knn("error")
+        return None, 0.0
+    if intent is None or confidence < threshold:
+        increment_intent_knn("below_threshold")
+        return None, confidence
+    increment_intent_knn("hit")
+    return intent, confidence
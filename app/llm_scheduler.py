@@ -0,0 +1,350 @@
+"""
+Control de admisión global para llamadas a OpenAI (chat, Whisper, visión).
+
+Todas las llamadas pasan por `get_scheduler()`:
+- Límite de concurrencia con prioridades: `interactive` (router, guardrail)
+  > `media` (Whisper/OCR) > `background` (resúmenes de memoria).
+- Buckets de requests/minuto y tokens/minuto compartidos entre workers vía
+  Redis (script Lua atómico), con fallback a buckets en proceso.
+- Reintentos con backoff que respeta Retry-After ante 429/5xx.
+- Con un deadline de request activo (app/deadline.py) no se espera turno ni
+  se reintenta más allá del presupuesto.
+- Las llamadas async esperan turno en el propio loop (futures + asyncio.sleep):
+  una cola de LLM bajo 429 no ocupa hilos del executor por defecto, que
+  comparten el preprocesado, la memoria y los nodos síncronos del grafo.
+- Los buckets se esperan antes de tomar el slot: un request frenado por RPM/TPM
+  no retiene concurrencia.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv
+
+from app.cache import get_redis
+from app.deadline import current_deadline
+from app.metrics.prometheus_metrics import (
+    increment_llm_request_count, observe_llm_queue_wait, increment_llm_rate_limited
+)
+
+load_dotenv()
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_MAX_CONCURRENCY", "2"))
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+LLM_TPM = int(os.getenv("LLM_TPM", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+PRIORITIES = {"interactive": 0, "media": 1, "background": 2}
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted", "abandoned")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+        self.abandoned = False
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class _PrioritySemaphore:
+    """
+    Semáforo con prioridades para hilos (`acquire`) y corrutinas (`aacquire`).
+    `release` entrega el slot directamente al primer waiter de la cola (sin
+    carrera por re-adquirirlo); un waiter async espera un future de su loop,
+    no un hilo.
+    """
+
+    def __init__(self, slots: int):
+        self._slots = slots
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+
+    def _try_take(self, priority: int, waiter: Optional[_Waiter]) -> bool:
+        """Con el lock tomado: toma un slot libre o encola el waiter."""
+        # Invariante: con slots libres no hay waiters vivos (release entrega directo al primero)
+        if self._slots > 0:
+            self._slots -= 1
+            return True
+        heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Timeout/cancelación: True si el slot ya le había sido entregado (hay que usarlo o liberarlo)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            # Borrado perezoso: release lo salta
+            waiter.abandoned = True
+            return False
+
+    def acquire(self, priority: int, timeout: Optional[float] = None) -> bool:
+        """False si pasa `timeout` sin obtener slot (se sale de la cola)."""
+        waiter = _Waiter()
+        with self._lock:
+            if self._try_take(priority, waiter):
+                return True
+        if waiter.event.wait(timeout):
+            return True
+        return self._give_up(waiter)
+
+    async def aacquire(self, priority: int, timeout: Optional[float] = None) -> bool:
+        """Variante async: espera en el loop. False si pasa `timeout`; cancelable sin perder el slot."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            if self._try_take(priority, waiter):
+                return True
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._give_up(waiter)
+        except asyncio.CancelledError:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if not waiter.abandoned:
+                    waiter.granted = True
+                    waiter.wake()
+                    return
+            self._slots += 1
+
+
+class _LocalTokenBucket:
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._tokens = float(per_minute)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float) -> float:
+        """Consume `amount` si hay saldo; si no, devuelve los segundos a esperar."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+
+# Bucket compartido en Redis: mismo algoritmo, atómico y con reloj del servidor
+_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = math.min(tonumber(ARGV[3]), capacity)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) / 1000 * rate)
+local wait = 0
+if tokens >= requested then
+  tokens = tokens - requested
+else
+  wait = math.ceil((requested - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return wait
+"""
+
+
+class _RedisTokenBucket:
+    def __init__(self, name: str, per_minute: int, fallback: _LocalTokenBucket):
+        self.key = f"llm:bucket:{name}"
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.fallback = fallback
+        self._script = None
+
+    def take(self, amount: float) -> float:
+        client = get_redis()
+        if client is None:
+            return self.fallback.take(amount)
+        try:
+            if self._script is None:
+                self._script = client.register_script(_BUCKET_LUA)
+            wait_ms = self._script(keys=[self.key], args=[self.rate, self.capacity, int(amount)])
+            return int(wait_ms) / 1000.0
+        except Exception as e:
+            print(f"[WARN] Bucket Redis no disponible ({e}); usando límite en proceso.")
+            return self.fallback.take(amount)
+
+
+def _is_retryable(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(e).__name__ in ("APIConnectionError", "APITimeoutError", "RateLimitError")
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after"):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) / (1000.0 if header.endswith("-ms") else 1.0)
+            except ValueError:
+                pass
+    return None
+
+
+def _backoff(retry_after: Optional[float], attempt: int) -> float:
+    """Espera antes del reintento; DeadlineExceeded si no cabe en el presupuesto del request."""
+    delay = retry_after if retry_after is not None else min(20.0, 0.5 * 2 ** attempt)
+    delay += random.uniform(0, delay * 0.25)
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() <= delay:
+        raise deadline.exceeded()
+    return delay
+
+
+def _bucket_wait(wait: float, deadline) -> float:
+    """Cuánto dormir antes de volver a pedir tokens; DeadlineExceeded si no cabe en el presupuesto."""
+    if deadline is not None and deadline.remaining() < wait:
+        raise deadline.exceeded()
+    return min(wait, 5.0)
+
+
+class LLMScheduler:
+    def __init__(self):
+        self._sem = _PrioritySemaphore(LLM_MAX_CONCURRENCY)
+        self._background = _PrioritySemaphore(LLM_BACKGROUND_MAX_CONCURRENCY)
+        self._rpm = _RedisTokenBucket("rpm", LLM_RPM, _LocalTokenBucket(LLM_RPM))
+        self._tpm = _RedisTokenBucket("tpm", LLM_TPM, _LocalTokenBucket(LLM_TPM))
+
+    def _buckets(self, est_tokens: int):
+        return ((self._rpm, 1), (self._tpm, est_tokens))
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", est_tokens: int = 500):
+        """
+        Espera turno (buckets y luego concurrencia) y mide el tiempo en cola. Con
+        un deadline de request activo no espera más allá: DeadlineExceeded.
+        """
+        level = PRIORITIES.get(priority, 0)
+        start = time.monotonic()
+        deadline = current_deadline()
+        for bucket, amount in self._buckets(est_tokens):
+            while True:
+                wait = bucket.take(amount)
+                if wait <= 0:
+                    break
+                time.sleep(_bucket_wait(wait, deadline))
+        is_background = priority == "background"
+        if is_background and not self._background.acquire(level, deadline.remaining() if deadline is not None else None):
+            raise deadline.exceeded()
+        if not self._sem.acquire(level, deadline.remaining() if deadline is not None else None):
+            if is_background:
+                self._background.release()
+            raise deadline.exceeded()
+        try:
+            observe_llm_queue_wait(priority, time.monotonic() - start)
+            yield
+        finally:
+            self._sem.release()
+            if is_background:
+                self._background.release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: str = "interactive", est_tokens: int = 500):
+        """`slot` para corrutinas: toda la espera ocurre en el loop, sin ocupar hilos."""
+        level = PRIORITIES.get(priority, 0)
+        start = time.monotonic()
+        deadline = current_deadline()
+        for bucket, amount in self._buckets(est_tokens):
+            while True:
+                # Un round-trip corto a Redis (o el bucket en proceso): fuera del loop
+                wait = await asyncio.to_thread(bucket.take, amount)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(_bucket_wait(wait, deadline))
+        is_background = priority == "background"
+        if is_background and not await self._background.aacquire(level, deadline.remaining() if deadline is not None else None):
+            raise deadline.exceeded()
+        try:
+            if not await self._sem.aacquire(level, deadline.remaining() if deadline is not None else None):
+                raise deadline.exceeded()
+        except BaseException:
+            if is_background:
+                self._background.release()
+            raise
+        try:
+            observe_llm_queue_wait(priority, time.monotonic() - start)
+            yield
+        finally:
+            self._sem.release()
+            if is_background:
+                self._background.release()
+
+    def run(self, fn: Callable[[], Any], priority: str = "interactive", est_tokens: int = 500, model: str = "unknown") -> Any:
+        """Ejecuta `fn` dentro de un slot, reintentando 429/5xx con backoff."""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            with self.slot(priority, est_tokens):
+                try:
+                    result = fn()
+                    increment_llm_request_count(model, "success")
+                    return result
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        increment_llm_request_count(model, "error")
+                        raise
+                    increment_llm_rate_limited(priority)
+                    delay = _retry_after(e)
+            # El backoff se duerme fuera del slot para no bloquear a otros
+            time.sleep(_backoff(delay, attempt))
+
+    async def arun(self, afn: Callable[[], Any], priority: str = "interactive", est_tokens: int = 500, model: str = "unknown") -> Any:
+        """Variante async: la espera de admisión ocurre en el loop (aslot)."""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self.aslot(priority, est_tokens):
+                try:
+                    result = await afn()
+                    increment_llm_request_count(model, "success")
+                    return result
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        increment_llm_request_count(model, "error")
+                        raise
+                    increment_llm_rate_limited(priority)
+                    delay = _retry_after(e)
+            await asyncio.sleep(_backoff(delay, attempt))
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
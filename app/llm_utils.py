@@ -1,6 +1,6 @@
 import os
-from typing import Optional
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,18 +11,64 @@ DEFAULT_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE", "0"))
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
+# Modelo por etapa: las etapas de alto volumen usan el modelo más barato/rápido.
+# Si no se define, cada etapa usa MODEL_NAME.
+STAGE_MODELS = {
+    "router": os.getenv("ROUTER_MODEL") or None,
+    "guardrail": os.getenv("GUARDRAIL_MODEL") or None,
+    "summary": os.getenv("SUMMARY_MODEL") or None,
+    "ocr": os.getenv("OCR_MODEL", "gpt-4o-mini"),
+    # Modelo más capaz, solo si el barato devuelve algo fuera de vocabulario
+    "escalation": os.getenv("ESCALATION_MODEL", "gpt-4o"),
+}
+# Prioridad en el scheduler de LLM por etapa
+STAGE_PRIORITIES = {"summary": "background", "ocr": "media"}
+
 def make_llm(
     provider: Optional[str] = None,
     model: Optional[str] = None,
-    temperature: Optional[float] = None
+    temperature: Optional[float] = None,
+    priority: str = "interactive",
+    stage: str = "default",
 ):
     provider = (provider or DEFAULT_PROVIDER).lower()
     model = model or DEFAULT_MODEL
     temperature = temperature if temperature is not None else DEFAULT_TEMPERATURE
 
     if provider == "openai":
-        return ChatOpenAI(model=model, temperature=temperature)
+        # Import diferido: langchain_openai es pesado y no se necesita para importar la app
+        from app.scheduled_llm import ScheduledChatOpenAI
+        # Los reintentos los gestiona el scheduler (respetando Retry-After), no el cliente
+        # stream_usage: el último chunk trae el uso de tokens para la contabilidad por etapa
+        return ScheduledChatOpenAI(
+            model=model, temperature=temperature, max_retries=0, stream_usage=True,
+            llm_priority=priority, llm_stage=stage,
+        )
     else:
         # Only OpenAI supported in this build to avoid extra optional providers.
         raise ValueError(f"Unsupported provider: {provider}. Supported: openai")
-    
\ No newline at end of file
+    
+
+def resolve_stage_models(model: Optional[str] = None) -> Dict[str, str]:
+    """Nombre de modelo por etapa. Un override explícito (`model`) aplica a
+    router/guardrail/summary; OCR y escalado mantienen su configuración."""
+    models = {}
+    for stage, configured in STAGE_MODELS.items():
+        if model and stage in ("router", "guardrail", "summary"):
+            models[stage] = model
+        else:
+            models[stage] = configured or DEFAULT_MODEL
+    return models
+
+@lru_cache(maxsize=32)
+def make_stage_llms(
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+) -> Dict[str, Any]:
+    """LLMs por etapa (router, guardrail, summary, escalation), cacheados por configuración."""
+    models = resolve_stage_models(model)
+    return {
+        stage: make_llm(provider, models[stage], temperature, priority=STAGE_PRIORITIES.get(stage, "interactive"), stage=stage)
+        for stage in ("router", "guardrail", "summary", "escalation")
+    }
@@ -1,42 +1,25 @@
+from contextlib import asynccontextmanager
 from typing import Any, Dict, Optional, Tuple
-from fastapi import FastAPI, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from pydantic import BaseModel, ValidationError
 
-
-from app.router import make_router
-from app.memory import get_message_history
-from app.graph import run_graph
-from app.llm_utils import make_llm, DEFAULT_PROVIDER, DEFAULT_MODEL, DEFAULT_TEMPERATURE
-from app.media_utils import preprocess_message
+# Las dependencias pesadas (langchain, langgraph, qdrant, openai) se importan
+# de forma diferida: en el warm-up del lifespan o en el primer uso.
+from app.llm_utils import DEFAULT_PROVIDER, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from app.deadline import DEADLINE_HEADER, Deadline, DeadlineExceeded, RequestCancelled, run_until_done
+from app.media_utils import MEDIA_MAX_BYTES, MediaTooLarge, fetch_media, preprocess_media, preprocess_message
+from app.memory import asave_summary_context
 from app.metrics.prometheus_metrics import get_metrics
+from app.profiling import record_request, start_loop_lag_monitor, stop_loop_lag_monitor
+from app.traffic_capture import close_capture, finish_capture, set_processed_text, start_capture
 from fastapi import Query
-import httpx
-
-async def send_webhook_test(session_id: str, message: str, msg_type: str, user: Optional[str] = None) -> Optional[str]:
-    url = "https://NNNNNNNNNNNN.com/webhook/chatwood-bot"
-    data = {
-        "user": user or "unknown",
-        "mensaje": message,
-        "type": msg_type,
-        "conversation_id": session_id
-    }
-    try:
-        # Timeout un poco mayor para permitir lectura de respuesta
-        async with httpx.AsyncClient(timeout=3.0) as client:
-           resp = await client.post(url, json=data)
-           if resp.status_code == 200:
-               try:
-                   data_resp = resp.json()
-                   print(f"[DEBUG] Webhook response: {data_resp}")
-                   # Intenta capturar conversation_id o id de la respuesta
-                   # Priorizamos conversation_id si viene en la respuesta
-                   val = data_resp.get("conversation_id") or data_resp.get("id")
-                   return str(val) if val else None
-               except Exception as e:
-                   print(f"[WARN] Error parsing webhook json: {e}")
-    except Exception as e:
-        print(f"[WARN] Failed to send webhook data to {url}: {e}")
-    return None
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import os
+import time
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
 
 # =========================
 # Fábrica de LLMs
@@ -49,53 +32,242 @@ def build_runtime(
     temperature: Optional[float] = None
 ):
     """Crea (llm, router_chain, router_summary, router_with_mem) con el proveedor indicado."""
+    from app.llm_utils import make_stage_llms, resolve_stage_models
+    from app.router import make_router
+
     use_provider = (provider or DEFAULT_PROVIDER).lower()
     use_model = model or DEFAULT_MODEL
     use_temperature = float(temperature if temperature is not None else DEFAULT_TEMPERATURE)
 
-    llm = make_llm(use_provider, use_model, use_temperature)
+    # Un modelo por etapa (router/guardrail/summary/OCR/escalado)
+    llms = make_stage_llms(use_provider, model, use_temperature)
 
-    router_chain, router_summary, router_with_mem = make_router(llm)
+    router_chain, router_summary, router_with_mem = make_router(llms["router"], summary_llm=llms["summary"])
 
     return {
         "provider": use_provider,
         "model": use_model,
         "temperature": use_temperature,
-        "llm": llm,
+        "stage_models": resolve_stage_models(model),
+        "llm": llms["router"],
         "router_chain": router_chain,
         "router_summary": router_summary,
         "router_with_mem": router_with_mem,
     }
 
 # =========================
-# FastAPI app
+# Arranque: construcción diferida + warm-up
 # =========================
-app = FastAPI(title="Ecom WhatsApp Bot")
+# Runtime por defecto (env); se construye en el lifespan o en el primer uso
+_runtime: Optional[Dict[str, Any]] = None
+_startup_timings: Dict[str, float] = {}
+# Lo marca el lifespan al terminar el warm-up; /health lo lee sin construir nada
+_ready = False
+
+def get_runtime() -> Dict[str, Any]:
+    global _runtime
+    if _runtime is None:
+        _runtime = build_runtime()
+    return _runtime
+
+def _timed(name: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    _startup_timings[name] = round(time.perf_counter() - start, 3)
+    return result
+
+def _warm_up_sync():
+    """Imports pesados, compilación del grafo, runtime y render de prompts (en un hilo)."""
+    from app.graph import get_compiled_graph, GUARDRAIL_PROMPT
+    from app.prompts import ROUTER_PROMPT
+
+    _timed("graph_compile", get_compiled_graph)
+    _timed("runtime", get_runtime)
+    _timed("local_index", _load_local_indexes)
+    _timed("transcription", _warm_up_transcription)
+    # Pre-renderiza los prompts para que el primer request no pague el parseo de plantillas
+    _timed("prompts", lambda: (
+        ROUTER_PROMPT.format_messages(summary_context=[], input="hola"),
+        GUARDRAIL_PROMPT.format_messages(final_output="hola"),
+    ))
+
+def _warm_up_transcription():
+    """Motor de transcripción local (si TRANSCRIPTION_ENGINE=local|auto): procesos y modelo residentes."""
+    from app.transcription import warm_up_transcription
+    warm_up_transcription()
+
+def _load_local_indexes():
+    """Snapshot en memoria de las colecciones pequeñas (las grandes quedan en Qdrant)."""
+    from app.vector.local_index import get_local_index
+    for collection in ("other_kb",):
+        try:
+            get_local_index(collection)
+        except Exception as e:
+            print(f"[WARN] No se pudo cargar índice local '{collection}': {e}")
+
+async def _open_pools():
+    """Abre conexiones de larga vida (Redis, pool WooCommerce) antes del primer request."""
+    from app.cache import get_redis
+    await asyncio.to_thread(_timed, "redis", get_redis)
+    if os.getenv("WC_URL"):
+        try:
+            from app.tools.woo_async import get_async_woo
+            _timed("woo_pool", get_async_woo)
+        except Exception as e:
+            print(f"[WARN] No se pudo abrir el pool de WooCommerce: {e}")
+
+async def warm_up():
+    start = time.perf_counter()
+    await asyncio.gather(asyncio.to_thread(_warm_up_sync), _open_pools())
+    _startup_timings["total"] = round(time.perf_counter() - start, 3)
+    print(f"[INFO] Warm-up completado: {_startup_timings}")
 
-# Runtime por defecto (env)
-_runtime = build_runtime()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.outbound import get_outbound
+    # La cola saliente arranca siempre (también sin warm-up): los webhooks se encolan desde el primer request
+    global _ready
+    await get_outbound().start()
+    start_loop_lag_monitor()
+    if WARMUP_ENABLED:
+        await warm_up()
+    # Sin warm-up se sirve igual (construcción diferida en el primer request)
+    _ready = True
+    yield
+    _ready = False
+    from app.tools.woo_async import close_async_woo
+    # Entrega lo pendiente (o lo manda al spill) antes de cerrar
+    await get_outbound().drain()
+    await close_async_woo()
+    from app.transcription import shutdown_transcription
+    shutdown_transcription()
+    from app.ocr import shutdown_ocr
+    shutdown_ocr()
+    close_capture()
+    await stop_loop_lag_monitor()
 
-def products_agent_dump():
-    return _runtime["products_agent_obj"].dump()
+# =========================
+# FastAPI app
+# =========================
+app = FastAPI(title="Ecom WhatsApp Bot", lifespan=lifespan)
 
 class WAIn(BaseModel):
     session_id: str
-    text: str
+    text: str = ""  # texto, o el media en base64 (formato anterior)
     mimetype: str = "text"  # Default to text for backward compatibility
     filename: str = ""
+    media_url: Optional[str] = None  # media por referencia: se descarga al preprocesar
+
+
+# El body se parsea a mano (JSON o multipart); se documentan ambos formatos
+_INBOUND_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": WAIn.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["session_id"],
+                    "properties": {
+                        "session_id": {"type": "string"},
+                        "text": {"type": "string"},
+                        "mimetype": {"type": "string"},
+                        "filename": {"type": "string"},
+                        "file": {"type": "string", "format": "binary"},
+                    },
+                }
+            },
+        },
+    }
+}
+
+
+async def _read_inbound(request: Request) -> Tuple[WAIn, Optional[bytes]]:
+    """
+    Mensaje entrante y, si vino como multipart, los bytes crudos del media.
+    Multipart: campos de WAIn + `file` (hasta MEDIA_MAX_BYTES). JSON: WAIn tal cual.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is not None and isinstance(upload, str):
+            raise HTTPException(status_code=422, detail="'file' must be a file upload")
+        try:
+            msg = WAIn(
+                session_id=form.get("session_id") or "",
+                text=form.get("text") or "",
+                mimetype=form.get("mimetype") or (upload.content_type if upload is not None else None) or "text",
+                filename=form.get("filename") or (upload.filename if upload is not None else None) or "",
+            )
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors())
+        if not msg.session_id:
+            raise HTTPException(status_code=422, detail="session_id is required")
+        media = None
+        if upload is not None:
+            # Starlette ya lo volcó a un SpooledTemporaryFile: una sola copia en memoria
+            media = await upload.read(MEDIA_MAX_BYTES + 1)
+            await upload.close()
+            if len(media) > MEDIA_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Media exceeds {MEDIA_MAX_BYTES} bytes")
+        return msg, media
+    try:
+        return WAIn(**(await request.json())), None
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid JSON body")
+
+
+async def _preprocess(msg: WAIn, media: Optional[bytes], runtime: Dict[str, Any]) -> str:
+    """Convierte el mensaje a texto: media crudo, `media_url` (descarga con tope) o JSON/base64."""
+    mimetype = msg.mimetype
+    if media is None and msg.media_url:
+        try:
+            media, content_type = await fetch_media(msg.media_url)
+        except MediaTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"[WARN] No se pudo descargar media_url: {e}")
+            raise HTTPException(status_code=502, detail="Could not fetch media_url")
+        if mimetype == "text" and content_type:
+            mimetype = content_type.split(";")[0].strip()
+    # Transcripción/OCR son bloqueantes: fuera del event loop
+    if media is not None:
+        return await asyncio.to_thread(preprocess_media, media, mimetype, msg.filename, runtime["provider"], runtime["stage_models"]["ocr"])
+    if mimetype == "text":
+        return msg.text
+    return await asyncio.to_thread(preprocess_message, msg.text, mimetype, msg.filename, runtime["provider"], runtime["stage_models"]["ocr"])
 
 @app.get("/health")
 def health():
-    return {"ok": True, "provider": _runtime["provider"], "model": _runtime["model"]}
+    # Readiness: 503 hasta que termine el warm-up; nunca dispara la carga del runtime
+    if not _ready:
+        return JSONResponse(status_code=503, content={"ok": False, "ready": False, "startup_seconds": _startup_timings})
+    from app.llm_utils import resolve_stage_models
+    from app.vector.embedding_cache import embedding_cache_stats
+    runtime = _runtime or {}
+    return {
+        "ok": True,
+        "ready": True,
+        "provider": runtime.get("provider", DEFAULT_PROVIDER),
+        "model": runtime.get("model", DEFAULT_MODEL),
+        "stage_models": runtime.get("stage_models") or resolve_stage_models(),
+        "embedding_cache": embedding_cache_stats(),
+        "startup_seconds": _startup_timings,
+    }
 
 @app.get("/metrics")
 def metrics():
     """Endpoint de métricas de Prometheus."""
     return get_metrics()
 
-@app.post("/webhook")
+@app.post("/webhook", openapi_extra=_INBOUND_OPENAPI)
 async def webhook(
-    msg: WAIn,
+    request: Request,
     provider: Optional[str] = Query(None, description="Override provider: openai|ollama|gemini"),
     model: Optional[str] = Query(None, description="Override model name for the selected provider"),
     temperature: Optional[float] = Query(None, description="Override temperature"),
@@ -104,9 +276,50 @@ async def webhook(
     """
     Permite override puntual del proveedor/modelo/temperature vía query params.
     Si no se pasa nada, usa el runtime por defecto (env).
+
+    Body: JSON (WAIn; el media puede ir en base64 en `text` o por referencia en
+    `media_url`) o multipart/form-data con los mismos campos y el media crudo en `file`.
+
+    El request tiene un presupuesto de tiempo (REQUEST_DEADLINE_SECONDS o la
+    cabecera X-Request-Deadline-Ms): vencido, o si el cliente se desconecta,
+    el grafo se cancela en vez de seguir gastando tokens.
     """
-    # Si llega override, levantamos un runtime temporal para esta llamada
-    runtime = _runtime if not (provider or model or (temperature is not None)) else build_runtime(provider, model, temperature)
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    msg, media = await _read_inbound(request)
+    # Captura opcional del request (CAPTURE_ENABLED) para replay; las respuestas downstream se agregan solas
+    capture, capture_token = start_capture(request, msg, media)
+    status = 500
+    try:
+        # Si llega override, levantamos un runtime temporal para esta llamada
+        runtime = get_runtime() if not (provider or model or (temperature is not None)) else build_runtime(provider, model, temperature)
+
+        # Preprocesar mensaje multimedia si es necesario
+        deadline.enter("preprocess")
+        processed_text = await _preprocess(msg, media, runtime)
+        del media
+        set_processed_text(capture, processed_text)
+        print(f"[DEBUG] Processed text: {processed_text[:100]}...")
+
+        # Un turno por sesión a la vez, aunque los mensajes lleguen a réplicas distintas
+        from app.session_lock import SessionBusy, session_lease
+        try:
+            async with session_lease(msg.session_id, deadline):
+                result = await _webhook_turn(msg, request, runtime, processed_text, deadline, disable_guardrail)
+        except SessionBusy:
+            raise HTTPException(status_code=409, detail="Session busy, retry later")
+        status = result.status_code if isinstance(result, Response) else 200
+        return result
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    finally:
+        finish_capture(capture, capture_token, status)
+        record_request("/webhook", msg.session_id, deadline, status)
+
+async def _webhook_turn(msg: WAIn, request: Request, runtime: Dict[str, Any], processed_text: str, deadline: Deadline, disable_guardrail: bool):
+    """Turno de /webhook bajo el lease de la sesión: historial, grafo, resumen y outgoing."""
+    from app.graph import DEADLINE_REPLY, run_graph
+    from app.memory import get_message_history
 
     hist = get_message_history(msg.session_id)
 
@@ -137,23 +350,15 @@ async def webhook(
     except Exception:
         top_history = []
 
-    # Preprocesar mensaje multimedia si es necesario
-    processed_text = preprocess_message(msg.text, msg.mimetype, msg.filename, runtime["provider"])
-    print(f"[DEBUG] Processed text: {processed_text[:100]}...")
 
-    # Notificar Incoming (Usuario -> Agente)
-    # Iniciamos la tarea pero guardamos la referencia para esperar su resultado después
-    import asyncio
-    initial_webhook_task = None
-    try:
-         # Usamos msg.session_id inicialmente. Si el webhook devuelve un ID numérico (conversation_id), actualizaremos chatwood_id después.
-         initial_webhook_task = asyncio.create_task(send_webhook_test(msg.session_id, processed_text, "incoming", user=msg.session_id))
-    except Exception as e:
-         print(f"[WARN] Error dispatching incoming webhook: {e}")
+    # Notificar Incoming (Usuario -> Agente): se encola, la respuesta no espera la entrega.
+    # El conversation_id que devuelva el webhook se resuelve en la cola para los outgoing.
+    from app.outbound import enqueue_webhook, get_outbound
+    enqueue_webhook(msg.session_id, processed_text, "incoming", user=msg.session_id)
 
     # Usar el grafo de LangGraph para manejar la intención y ejecutar la acción
     try:
-            output, intent = await run_graph(
+            output, intent = await run_until_done(run_graph(
                 msg.session_id,
                 processed_text,
                 runtime["provider"],
@@ -161,7 +366,15 @@ async def webhook(
                 runtime["temperature"],
                 runtime.get("router_summary"),
                 disable_guardrail=disable_guardrail,
-            )
+                deadline=deadline,
+            ), deadline, request)
+    except RequestCancelled as e:
+        # Nadie recibirá la respuesta: ni resumen (LLM) ni outgoing
+        print(f"[WARN] {e}; respuesta descartada")
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        print(f"[WARN] {e}; grafo cancelado")
+        output, intent = DEADLINE_REPLY, "timeout"
     except Exception as e:
         print(f"[ERROR] Exception in webhook run_graph: {e}")
         import traceback
@@ -169,25 +382,14 @@ async def webhook(
         output = "Parece que hubo un problema al intentar conectar con el agente. Esto puede deberse a un error de red. Te recomiendo intentar de nuevo más tarde. Si el problema persiste, por favor contáctanos por otro medio. ¡Estamos aquí para ayudarte!"
         intent = "error"
 
-    runtime["router_summary"].save_context({"input": msg.text}, {"output": output})
+    if intent != "timeout":
+        # save_context resume con el LLM (bloqueante): fuera del event loop
+        await asave_summary_context(runtime["router_summary"], processed_text, output)
 
-    # Recuperar conversation_id actualizado del webhook inicial (si existe)
-    chatwood_id = msg.session_id
-    if initial_webhook_task:
-        try:
-            # Esperamos a que termine el webhook inicial (ya debería haber terminado o estar cerca)
-            result_id = await initial_webhook_task
-            if result_id:
-                chatwood_id = str(result_id)
-                print(f"[DEBUG] Updated conversation_id from webhook: {chatwood_id}")
-        except Exception as e:
-            print(f"[WARN] Error awaiting initial webhook: {e}")
-
-    # Notificar Outgoing (Agente -> Usuario) usando el ID actualizado
-    try:
-         asyncio.create_task(send_webhook_test(chatwood_id, output, "outgoing"))
-    except Exception as e:
-         print(f"[WARN] Error dispatching outgoing webhook: {e}")
+    # Notificar Outgoing (Agente -> Usuario); la cola usa el conversation_id resuelto por el incoming
+    enqueue_webhook(msg.session_id, output, "outgoing")
+    # conversation_id ya conocido de turnos anteriores (el de este turno puede estar aún en vuelo)
+    chatwood_id = get_outbound().conversation_id(msg.session_id) or msg.session_id
     
     # DEBUGs útiles
     print("[DEBUG] Provider:", runtime["provider"])
@@ -202,25 +404,140 @@ async def webhook(
         "conversation_id": chatwood_id,
     }
 
-@app.get("/debug/memory")
-def debug_memory(session_id: str = Query(..., description="ID de sesión")) -> Dict[str, Any]:
-    hist = get_message_history(session_id)
-    history_msgs = [{"type": m.type, "content": m.content} for m in hist.messages]
+@app.post("/webhook/stream", openapi_extra=_INBOUND_OPENAPI)
+async def webhook_stream(
+    request: Request,
+    provider: Optional[str] = Query(None, description="Override provider: openai|ollama|gemini"),
+    model: Optional[str] = Query(None, description="Override model name for the selected provider"),
+    temperature: Optional[float] = Query(None, description="Override temperature"),
+    disable_guardrail: Optional[bool] = Query(False, description="Disable orchestrator guardrail for this request"),
+    deliver: Optional[bool] = Query(True, description="Send each reply segment to the outgoing webhook as soon as it is ready"),
+):
+    """
+    Igual que /webhook (mismos formatos de body) pero responde en streaming NDJSON
+    (una línea JSON por evento): progreso por nodo, intención, segmentos de
+    respuesta y un evento final `done`.
+    """
+    from app.graph import DEADLINE_REPLY, stream_graph
+    from app.outbound import enqueue_webhook
+    from app.session_lock import SessionBusy, session_lease
+
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    msg, media = await _read_inbound(request)
+    capture, capture_token = start_capture(request, msg, media)
+    # Hasta entregar el stream, la captura y el registro del request se cierran aquí (como en /webhook)
+    status = 500
+    try:
+        runtime = get_runtime() if not (provider or model or (temperature is not None)) else build_runtime(provider, model, temperature)
+        deadline.enter("preprocess")
+        processed_text = await _preprocess(msg, media, runtime)
+        del media
+        set_processed_text(capture, processed_text)
+        enqueue_webhook(msg.session_id, processed_text, "incoming", user=msg.session_id)
+    except BaseException as e:
+        if isinstance(e, HTTPException):
+            status = e.status_code
+        finish_capture(capture, capture_token, status)
+        record_request("/webhook/stream", msg.session_id, deadline, status)
+        raise
+
+    async def events():
+        yield json.dumps({"event": "accepted", "session_id": msg.session_id}) + "\n"
+        output = None
+        status = 500
+        try:
+            # El lease cubre todo el stream y la actualización del resumen
+            async with session_lease(msg.session_id, deadline):
+                try:
+                    async for ev in stream_graph(
+                        msg.session_id,
+                        processed_text,
+                        runtime["provider"],
+                        runtime["model"],
+                        runtime["temperature"],
+                        runtime.get("router_summary"),
+                        disable_guardrail=disable_guardrail,
+                        deadline=deadline,
+                    ):
+                        if ev["event"] == "segment" and deliver:
+                            # Cada segmento sale en orden por la cola de la sesión, sin frenar el stream
+                            enqueue_webhook(msg.session_id, ev["text"], "outgoing")
+                        elif ev["event"] == "done":
+                            output = ev["reply"]
+                        yield json.dumps(ev, ensure_ascii=False) + "\n"
+                    status = 200
+                finally:
+                    if output is not None and output != DEADLINE_REPLY:
+                        await asave_summary_context(runtime["router_summary"], processed_text, output)
+        except SessionBusy:
+            status = 409
+            yield json.dumps({"event": "error", "error": "session_busy"}) + "\n"
+        finally:
+            finish_capture(capture, capture_token, status)
+            record_request("/webhook/stream", msg.session_id, deadline, status)
 
-    router_vars = _runtime["router_summary"].load_memory_variables({})
-    summary_context = router_vars.get("summary_context", [])
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
-    prod_mem = products_agent_dump()
-    return {
-        "session_id": session_id,
-        "provider": _runtime["provider"],
-        "model": _runtime["model"],
-        "history": history_msgs,
-        "router_summary_context": summary_context,
-        "products_agent_memory": prod_mem,
-    }
+@app.post("/webhook/woocommerce")
+async def woocommerce_webhook(request: Request):
+    """Webhooks de WooCommerce (order.*, product.*): actualizan/invalidan la caché de lecturas."""
+    from app.tools.woo_async import WC_WEBHOOK_SECRET, handle_webhook, verify_webhook_signature, woo_configured
+
+    if not WC_WEBHOOK_SECRET:
+        # Sin secreto no hay forma de autenticar al emisor: el endpoint queda cerrado
+        raise HTTPException(status_code=503, detail="WooCommerce webhook secret not configured")
+    if not woo_configured():
+        # Sin cliente WooCommerce no hay caché de lecturas que mantener
+        raise HTTPException(status_code=503, detail="WooCommerce client not configured")
+    body = await request.body()
+    if not verify_webhook_signature(body, request.headers.get("X-WC-Webhook-Signature")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    topic = request.headers.get("X-WC-Webhook-Topic", "")
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        # WooCommerce envía un ping form-encoded (webhook_id=...) al crear el webhook
+        return {"ok": True, "result": "ping"}
+    result = await asyncio.to_thread(handle_webhook, topic, payload)
+    print(f"[DEBUG] WooCommerce webhook {topic} id={payload.get('id')}: {result}")
+    return {"ok": True, "result": result}
+
+def _check_debug_token(request: Request):
+    """Los /debug/* solo existen con DEBUG_TOKEN configurado y exigen la cabecera X-Debug-Token."""
+    import hmac
+    from app.profiling import DEBUG_TOKEN, DEBUG_TOKEN_HEADER
+
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get(DEBUG_TOKEN_HEADER, ""), DEBUG_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+@app.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, description="Duración del muestreo (máximo PROFILE_MAX_SECONDS)"),
+    interval_ms: Optional[float] = Query(None, ge=1, description="Intervalo entre muestras (por defecto PROFILE_INTERVAL_MS)"),
+    idle: bool = Query(False, description="Incluir hilos ociosos (loop esperando I/O, workers sin trabajo)"),
+):
+    """
+    Perfil por muestreo de todo el proceso (event loop + hilos del executor) en
+    formato de stacks colapsados: `flamegraph.pl perfil.txt > perfil.svg` o
+    abrirlo en speedscope.
+    """
+    from fastapi.responses import PlainTextResponse
+    from app.profiling import PROFILE_INTERVAL_MS, ProfilerBusy, profile
+
+    _check_debug_token(request)
+    try:
+        collapsed, samples = await profile(seconds, interval_ms or PROFILE_INTERVAL_MS, idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profile already running")
+    return PlainTextResponse(collapsed, headers={"X-Profile-Samples": str(samples)})
+
+@app.get("/debug/slow")
+def debug_slow(request: Request) -> Dict[str, Any]:
+    """Requests recientes por encima de SLOW_REQUEST_SECONDS, con desglose por nodo y lag del event loop."""
+    from app.profiling import SLOW_REQUEST_SECONDS, slow_requests
 
-@app.get("/debug/search")
-def debug_search(q: str):
-    docs = _runtime["products_agent_obj"].retriever.get_relevant_documents(q)
-    return [{"content": d.page_content, "meta": d.metadata} for d in docs]
+    _check_debug_token(request)
+    return {"threshold_seconds": SLOW_REQUEST_SECONDS, "requests": slow_requests()}
@@ -1,15 +1,94 @@
-"""Utilidades para procesar mensajes multimedia (audio e imagen)."""
+"""Utilidades para procesar mensajes multimedia (audio e imagen).
+
+El media llega como bytes crudos (multipart o `media_url`, ver `fetch_media`)
+o, por compatibilidad, en base64 dentro del JSON (`preprocess_message`).
+"""
 
 import os
 import base64
+import ipaddress
 import logging
-from langchain_core.messages import HumanMessage
+import socket
+from typing import Optional, Tuple
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-import openai
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Tope por media (las notas de voz/imágenes de WhatsApp no pasan de 16 MB)
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(16 * 1024 * 1024)))
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "10"))
+# Hosts permitidos para `media_url` (vacío = cualquier host público)
+MEDIA_URL_ALLOWED_HOSTS = {h.strip().lower() for h in os.getenv("MEDIA_URL_ALLOWED_HOSTS", "").split(",") if h.strip()}
+# Direcciones privadas/loopback/link-local (Redis, Qdrant, metadata de la nube): solo para desarrollo local
+MEDIA_URL_ALLOW_PRIVATE = os.getenv("MEDIA_URL_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes")
+MEDIA_MAX_REDIRECTS = int(os.getenv("MEDIA_MAX_REDIRECTS", "3"))
+
+
+class MediaTooLarge(ValueError):
+    pass
+
+
+async def _check_media_url(url: str):
+    """
+    ValueError si la URL no se puede descargar: esquema distinto de http(s),
+    host fuera de MEDIA_URL_ALLOWED_HOSTS, o un host que resuelve a una
+    dirección no pública (se revisa en cada redirección).
+    """
+    import asyncio
+
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        raise ValueError(f"Esquema de media_url no soportado: {parsed.scheme}")
+    host = (parsed.hostname or "").lower()
+    if not host:
+        raise ValueError("media_url sin host")
+    if MEDIA_URL_ALLOWED_HOSTS and host not in MEDIA_URL_ALLOWED_HOSTS:
+        raise ValueError(f"Host de media_url no permitido: {host}")
+    if MEDIA_URL_ALLOW_PRIVATE:
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"Host de media_url no resuelve: {host} ({e})")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise ValueError(f"Host de media_url no permitido: {host} resuelve a {address}")
+
+
+async def fetch_media(url: str, max_bytes: int = MEDIA_MAX_BYTES) -> Tuple[bytes, Optional[str]]:
+    """
+    Descarga `url` en streaming con tope de tamaño: (bytes, content-type).
+    Corta en cuanto se supera `max_bytes` (o si Content-Length ya lo supera).
+    Las redirecciones se siguen a mano (hasta MEDIA_MAX_REDIRECTS), validando cada destino.
+    """
+    import httpx
+
+    async with httpx.AsyncClient(timeout=MEDIA_FETCH_TIMEOUT, follow_redirects=False) as client:
+        for _ in range(MEDIA_MAX_REDIRECTS + 1):
+            await _check_media_url(url)
+            async with client.stream("GET", url) as resp:
+                if resp.is_redirect:
+                    url = str(resp.url.join(resp.headers["location"]))
+                    continue
+                resp.raise_for_status()
+                length = resp.headers.get("content-length")
+                if length and length.isdigit() and int(length) > max_bytes:
+                    raise MediaTooLarge(f"Media de {length} bytes supera el tope de {max_bytes}")
+                buf = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    buf.extend(chunk)
+                    if len(buf) > max_bytes:
+                        raise MediaTooLarge(f"Media supera el tope de {max_bytes} bytes")
+                content_type = resp.headers.get("content-type")
+                break
+        else:
+            raise ValueError(f"media_url con más de {MEDIA_MAX_REDIRECTS} redirecciones")
+    logger.info(f"Media descargado de {urlparse(url).hostname}: {len(buf)} bytes ({content_type})")
+    return bytes(buf), content_type
+
 
 def transcribe_audio(base64_audio: str, provider: str = "openai") -> str:
     """Transcribe audio base64 a texto usando el provider especificado."""
@@ -20,48 +99,20 @@ def transcribe_audio(base64_audio: str, provider: str = "openai") -> str:
     except Exception as e:
         logger.error(f"Base64 inválido para audio: {e}")
         return f"Error: Base64 de audio inválido. {e}"
+    return transcribe_audio_bytes(audio_data, provider)
 
-    if provider.lower() == "openai":
-        return _transcribe_audio_openai(audio_data)
-    else:
-        logger.warning(f"Provider {provider} no soporta transcripción de audio. Use 'openai'.")
-        return "Error: provider not supported for audio transcription. Use 'openai'."
-
-# Gemini-specific transcription removed to avoid Google dependency. Use OpenAI transcription.
-
-def _transcribe_audio_openai(audio_data: bytes) -> str:
-    try:
-        import tempfile
-        import os
-
-        # Guardar temporalmente el audio
-        with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
-            temp_file.write(audio_data)
-            temp_file_path = temp_file.name
-
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        with open(temp_file_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
-            )
 
-        # Limpiar archivo temporal
-        os.unlink(temp_file_path)
+def transcribe_audio_bytes(audio_data: bytes, provider: str = "openai", filename: str = "") -> str:
+    """
+    Transcribe audio crudo a texto. El motor (OpenAI o local) lo decide
+    TRANSCRIPTION_ENGINE (app/transcription.py), no el provider del LLM.
+    """
+    from app.transcription import transcribe
 
-        logger.info(f"Transcripción OpenAI obtenida: '{transcript}'")
+    # Whisper deduce el formato de la extensión; las notas de WhatsApp son OGG/Opus
+    return transcribe(audio_data, filename if os.path.splitext(filename)[1] else "audio.ogg")
 
-        if not transcript or transcript.strip() == "":
-            logger.error("Transcripción vacía o inválida.")
-            return "Error: No se pudo transcribir el audio. Intente nuevamente."
-
-        return transcript
-    except Exception as e:
-        logger.error(f"Error en transcripción OpenAI: {e}")
-        return f"Error en transcripción: {e}"
-
-def extract_text_from_image(base64_image: str, mimetype: str, provider: str = "openai") -> str:
+def extract_text_from_image(base64_image: str, mimetype: str, provider: str = "openai", model: str = "gpt-4o-mini") -> str:
     """Extrae texto de imagen base64 usando el provider especificado."""
     logger.info(f"Extrayendo texto de imagen con {provider}, tamaño base64: {len(base64_image)}")
     try:
@@ -70,52 +121,37 @@ def extract_text_from_image(base64_image: str, mimetype: str, provider: str = "o
     except Exception as e:
         logger.error(f"Base64 inválido para imagen: {e}")
         return f"Error: Base64 de imagen inválido. {e}"
+    return extract_text_from_image_bytes(image_data, mimetype, provider, model)
 
-    if provider.lower() == "openai":
-        return _extract_text_from_image_openai(base64_image, mimetype)
-    else:
-        logger.warning(f"Provider {provider} no soporta OCR. Use 'openai'.")
-        return "Error: provider not supported for image OCR. Use 'openai'."
 
-# Gemini-specific OCR removed to avoid Google dependency. Use OpenAI-based OCR instead.
+def extract_text_from_image_bytes(image_data: bytes, mimetype: str, provider: str = "openai", model: str = "gpt-4o-mini") -> str:
+    """
+    Extrae texto de una imagen cruda: OCR local para documentos legibles y el
+    modelo de visión `model` para el resto (app/ocr.py), sea cual sea el provider del LLM.
+    """
+    from app.ocr import extract_text
 
-def _extract_text_from_image_openai(base64_image: str, mimetype: str) -> str:
-    try:
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        data_url = f"data:{mimetype};base64,{base64_image}"
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # o gpt-4o para mejor visión
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Extrae el texto de esta imagen usando OCR."},
-                        {"type": "image_url", "image_url": {"url": data_url}}
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
-        extracted = response.choices[0].message.content
-        logger.info(f"Texto extraído OpenAI: '{extracted}'")
-
-        if not extracted or extracted.strip() == "":
-            logger.error("Texto extraído vacío o inválido.")
-            return "Error: No se pudo extraer texto de la imagen. Intente con una imagen más clara."
-
-        return extracted
-    except Exception as e:
-        logger.error(f"Error en OCR OpenAI: {e}")
-        return f"Error en OCR: {e}"
+    return extract_text(image_data, mimetype, model)
+
+def preprocess_media(data: bytes, mimetype: str, filename: str, provider: str = "openai", ocr_model: str = "gpt-4o-mini") -> str:
+    """Convierte a texto un media crudo (multipart o media_url)."""
+    mimetype = (mimetype or "").lower()
+    if mimetype.startswith("audio/"):
+        return transcribe_audio_bytes(data, provider, filename)
+    elif mimetype.startswith("image/"):
+        return extract_text_from_image_bytes(data, mimetype, provider, ocr_model)
+    else:
+        logger.warning(f"Tipo de media no soportado: {mimetype}")
+        return f"Tipo de mensaje no soportado: {mimetype}. Por favor use texto, audio o imagen."
 
-def preprocess_message(text: str, mimetype: str, filename: str, provider: str = "gemini") -> str:
-    """Preprocesa el mensaje basado en mimetype, convirtiendo a texto si es necesario."""
+def preprocess_message(text: str, mimetype: str, filename: str, provider: str = "gemini", ocr_model: str = "gpt-4o-mini") -> str:
+    """Preprocesa el mensaje basado en mimetype, convirtiendo a texto si es necesario (media en base64)."""
     if mimetype == "text" or mimetype.startswith("text/"):
         return text
     elif mimetype.startswith("audio/ogg; codecs=opus") or mimetype.startswith("audio/"):
         return transcribe_audio(text, provider)  # text es base64
     elif mimetype.startswith("image/"):
-        return extract_text_from_image(text, mimetype, provider)  # text es base64
+        return extract_text_from_image(text, mimetype, provider, ocr_model)  # text es base64
     else:
         logger.warning(f"Tipo de mensaje no soportado: {mimetype}")
         return f"Tipo de mensaje no soportado: {mimetype}. Por favor use texto, audio o imagen."
\ No newline at end of file
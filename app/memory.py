@@ -1,40 +1,115 @@
+import asyncio
+import contextvars
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.memory import (
-    ConversationBufferWindowMemory,
-    ConversationSummaryBufferMemory,
-    ConversationSummaryMemory,
-)
-from langchain_community.chat_message_histories import RedisChatMessageHistory
-from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 load_dotenv()
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 USE_REDIS = os.getenv("USE_REDIS", "true").lower() == "true"
 
+HISTORY_KEY_PREFIX = "message_store:"  # mismo prefijo que RedisChatMessageHistory: las entradas legadas siguen visibles
+
+@lru_cache(maxsize=1)
+def _history_cls():
+    from langchain_core.chat_history import BaseChatMessageHistory
+    from app.codec import decode_message, encode_message
+
+    class CompactRedisChatMessageHistory(BaseChatMessageHistory):
+        """
+        Historial en Redis con el codec compacto (app/codec.py); lee también las
+        entradas JSON de RedisChatMessageHistory. Con lease de sesión las
+        escrituras van con fencing (LeaseLost si otra réplica tomó la sesión).
+        """
+
+        def __init__(self, session_id: str, client, lease=None, ttl: Optional[int] = None):
+            self.session_id = session_id
+            self.client = client
+            self.lease = lease
+            self.ttl = ttl
+
+        @property
+        def key(self) -> str:
+            return HISTORY_KEY_PREFIX + self.session_id
+
+        @property
+        def messages(self):
+            raw = self.client.lrange(self.key, 0, -1)
+            return [decode_message(r) for r in reversed(raw)]
+
+        def add_message(self, message) -> None:
+            raw = encode_message(message)
+            if self.lease is not None:
+                self.lease.fenced_lpush(self.client, self.key, raw, self.ttl or 0)
+                return
+            self.client.lpush(self.key, raw)
+            if self.ttl:
+                self.client.expire(self.key, self.ttl)
+
+        def clear(self) -> None:
+            self.client.delete(self.key)
+
+    return CompactRedisChatMessageHistory
+
 def get_message_history(session_id: str):
     """
     Retorna una historia de chat.
     Si USE_REDIS=false, usa memoria en RAM (no persistente).
+    Con un lease de sesión activo (app/session_lock.py) las escrituras van con fencing.
     """
+    # Imports diferidos: langchain/langchain_community son pesados al arrancar
+    from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
+    from app.cache import get_redis
+    from app.session_lock import current_lease
+
     if USE_REDIS:
-        try:
-            return RedisChatMessageHistory(session_id=session_id, url=REDIS_URL)
-        except Exception as e:
-            print(f"[WARN] Redis no disponible ({e}). Usando memoria local temporal.")
-            return ChatMessageHistory()
+        # Cliente compartido (pool) en vez de una conexión nueva por request
+        client = get_redis()
+        if client is not None:
+            return _history_cls()(session_id, client, lease=current_lease(session_id))
+        print("[WARN] Redis no disponible. Usando memoria local temporal.")
+        return ChatMessageHistory()
     else:
         print("[INFO] Redis deshabilitado, usando ChatMessageHistory en memoria.")
         return ChatMessageHistory()
 
-def make_global_summary_memory(llm: ChatOpenAI):
-    return ConversationSummaryMemory(llm=llm, memory_key="summary_context", return_messages=True)
+def make_global_summary_memory(llm: "ChatOpenAI"):
+    from langchain.memory import ConversationSummaryMemory
+    from app.scheduled_llm import with_priority
+    # Los resúmenes no son de cara al usuario: prioridad baja en el scheduler
+    return ConversationSummaryMemory(llm=with_priority(llm, "background"), memory_key="summary_context", return_messages=True)
+
+# La memoria del router es una por proceso (compartida por todas las sesiones):
+# save_context lee y reescribe el resumen, así que dos escrituras a la vez pierden
+# una actualización. Se serializan con un lock y, desde el loop, en un hilo propio
+# para no ocupar el executor por defecto mientras esperan turno.
+_summary_lock = threading.Lock()
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="router-summary")
+
+def save_summary_context(memory, user_text: str, output: str):
+    """save_context serializado sobre la memoria compartida (bloqueante: llama al LLM)."""
+    with _summary_lock:
+        memory.save_context({"input": user_text}, {"output": output})
+
+async def asave_summary_context(memory, user_text: str, output: str):
+    """save_summary_context fuera del event loop, en el hilo de resúmenes."""
+    ctx = contextvars.copy_context()
+    await asyncio.get_running_loop().run_in_executor(
+        _summary_executor, ctx.run, save_summary_context, memory, user_text, output
+    )
 
 def make_agent_window_memory(k: int = 5):
+    from langchain.memory import ConversationBufferWindowMemory
     return ConversationBufferWindowMemory(k=k, memory_key="chat_history", return_messages=True)
 
-def make_hybrid_memory(llm: ChatOpenAI, max_tokens: int = 800):
+def make_hybrid_memory(llm: "ChatOpenAI", max_tokens: int = 800):
+    from langchain.memory import ConversationSummaryBufferMemory
+    from app.scheduled_llm import with_priority
     return ConversationSummaryBufferMemory(
-        llm=llm, max_token_limit=max_tokens, memory_key="summary_context", return_messages=True
+        llm=with_priority(llm, "background"), max_token_limit=max_tokens, memory_key="summary_context", return_messages=True
     )
@@ -35,8 +35,8 @@ AGENT_LATENCY = Histogram(
 # Métricas de LLM
 LLM_TOKEN_COUNT = Counter(
     'agent_orchestrator_llm_tokens_total',
-    'Total number of LLM tokens used',
-    ['token_type', 'model']
+    'Total number of LLM tokens used (token_type: prompt | completion | cached)',
+    ['token_type', 'model', 'stage']
 )
 
 LLM_REQUEST_COUNT = Counter(
@@ -45,6 +45,19 @@ LLM_REQUEST_COUNT = Counter(
     ['model', 'status']
 )
 
+LLM_QUEUE_WAIT = Histogram(
+    'agent_orchestrator_llm_queue_wait_seconds',
+    'Time spent waiting for LLM admission (concurrency + rate buckets)',
+    ['priority'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.3, 0.5, 1, 2, 5, 10)
+)
+
+LLM_RATE_LIMITED_COUNT = Counter(
+    'agent_orchestrator_llm_rate_limited_total',
+    'LLM calls retried after a 429/5xx response',
+    ['priority']
+)
+
 # Métricas de intents
 INTENT_COUNT = Counter(
     'agent_orchestrator_intent_total',
@@ -59,6 +72,182 @@ GUARDRAIL_COUNT = Counter(
     ['result']
 )
 
+# Clasificación de intención por lotes
+INTENT_BATCH_SIZE = Histogram(
+    'agent_orchestrator_intent_batch_size',
+    'Number of messages classified per batched router call',
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+
+INTENT_BATCH_FALLBACK_COUNT = Counter(
+    'agent_orchestrator_intent_batch_fallback_total',
+    'Messages that fell back to a single router call',
+    ['reason']
+)
+
+# Clasificador k-NN de intenciones (hit = no se consultó al LLM)
+INTENT_KNN_COUNT = Counter(
+    'agent_orchestrator_intent_knn_total',
+    'k-NN intent classifications by result',
+    ['result']
+)
+
+# Estado de flujo por sesión (bypass = respuesta enviada al worker sin router)
+FLOW_EVENT_COUNT = Counter(
+    'agent_orchestrator_flow_events_total',
+    'Conversation flow state events',
+    ['event']
+)
+
+# Entrega saliente (webhook del bot, etiquetas Chatwoot)
+OUTBOUND_DELIVERY_COUNT = Counter(
+    'agent_orchestrator_outbound_delivery_total',
+    'Outbound deliveries by kind and result (delivered, retried, spilled, dropped, dead)',
+    ['kind', 'result']
+)
+
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    'agent_orchestrator_outbound_queue_depth',
+    'Jobs waiting in the outbound delivery queues'
+)
+
+# Deadline por request y cancelación (stage = etapa en curso al cortar)
+DEADLINE_EXCEEDED_COUNT = Counter(
+    'agent_orchestrator_deadline_exceeded_total',
+    'Requests stopped because their deadline budget ran out, by stage',
+    ['stage']
+)
+
+REQUEST_CANCELLED_COUNT = Counter(
+    'agent_orchestrator_request_cancelled_total',
+    'Requests cancelled because the client disconnected, by stage',
+    ['stage']
+)
+
+# Lease distribuido por sesión (acquired, contended, busy, lost, fenced)
+SESSION_LOCK_COUNT = Counter(
+    'agent_orchestrator_session_lock_total',
+    'Per-session lease events',
+    ['result']
+)
+
+SESSION_LOCK_WAIT = Histogram(
+    'agent_orchestrator_session_lock_wait_seconds',
+    'Time spent waiting for the per-session lease',
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.3, 0.5, 1, 2, 5, 10)
+)
+
+# Codec compacto de Redis: lecturas de entradas JSON legadas (tiende a 0 tras migrar)
+CODEC_LEGACY_READ_COUNT = Counter(
+    'agent_orchestrator_codec_legacy_reads_total',
+    'Redis values read in the legacy JSON format, by store',
+    ['store']
+)
+
+# Preprocesado de notas de voz: bytes recibidos vs subidos a transcripción
+AUDIO_PREP_BYTES = Counter(
+    'agent_orchestrator_audio_prep_bytes_total',
+    'Voice note bytes received (raw) and uploaded for transcription (uploaded)',
+    ['kind']
+)
+
+AUDIO_PREP_LATENCY = Histogram(
+    'agent_orchestrator_audio_prep_seconds',
+    'Local audio preprocessing time (decode, VAD trim, re-encode, chunking)',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+
+# Transcripción de notas de voz por motor (openai, local) y resultado (ok, empty, error)
+TRANSCRIPTION_COUNT = Counter(
+    'agent_orchestrator_transcription_total',
+    'Voice note transcriptions by engine and result',
+    ['engine', 'result']
+)
+
+TRANSCRIPTION_LATENCY = Histogram(
+    'agent_orchestrator_transcription_seconds',
+    'Voice note transcription latency by engine',
+    ['engine'],
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 12, 20, 30)
+)
+
+# Imágenes: bytes recibidos vs enviados al modelo de visión; OCR por nivel (local, vision) y resultado
+IMAGE_PREP_BYTES = Counter(
+    'agent_orchestrator_image_prep_bytes_total',
+    'Image bytes received (raw) and sent to the vision model (uploaded)',
+    ['kind']
+)
+
+OCR_COUNT = Counter(
+    'agent_orchestrator_ocr_total',
+    'Image OCR attempts by tier (local, vision) and result (ok, escalated, empty, error)',
+    ['tier', 'result']
+)
+
+OCR_LATENCY = Histogram(
+    'agent_orchestrator_ocr_seconds',
+    'Image OCR latency by tier',
+    ['tier'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 12, 20)
+)
+
+# Lag del event loop (app/profiling.py) y requests por encima de SLOW_REQUEST_SECONDS
+EVENT_LOOP_LAG = Histogram(
+    'agent_orchestrator_event_loop_lag_seconds',
+    'Event loop scheduling delay',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+)
+
+SLOW_REQUEST_COUNT = Counter(
+    'agent_orchestrator_slow_requests_total',
+    'Requests slower than SLOW_REQUEST_SECONDS',
+    ['endpoint']
+)
+
+# Escalados al modelo más capaz (cascada de modelos)
+MODEL_ESCALATION_COUNT = Counter(
+    'agent_orchestrator_model_escalation_total',
+    'Total number of calls escalated from the cheap model to the escalation model',
+    ['stage', 'reason']
+)
+
+# Métricas de caché de embeddings
+EMBEDDING_CACHE_COUNT = Counter(
+    'agent_orchestrator_embedding_cache_total',
+    'Embedding cache lookups by result (memory_hit, redis_hit, miss)',
+    ['result']
+)
+
+EMBEDDING_LATENCY = Histogram(
+    'agent_orchestrator_embedding_duration_seconds',
+    'Remote embedding call latency in seconds',
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 1, 2, 5)
+)
+
+EMBEDDING_LATENCY_SAVED = Counter(
+    'agent_orchestrator_embedding_latency_saved_seconds_total',
+    'Estimated remote embedding latency saved by cache hits'
+)
+
+# Métricas de caché de recuperación (RAG)
+RETRIEVAL_CACHE_COUNT = Counter(
+    'agent_orchestrator_retrieval_cache_total',
+    'Retrieval cache lookups by result (memory_hit, redis_hit, miss)',
+    ['result']
+)
+
+RAG_CONTEXT_TOKENS_TRIMMED = Counter(
+    'agent_orchestrator_rag_context_tokens_trimmed_total',
+    'Estimated RAG context tokens removed by dedupe and budget trimming'
+)
+
+# Métricas de caché WooCommerce
+WOO_CACHE_COUNT = Counter(
+    'agent_orchestrator_woo_cache_total',
+    'WooCommerce read-through cache lookups',
+    ['kind', 'result']
+)
+
 # Active sessions gauge
 ACTIVE_SESSIONS = Gauge(
     'agent_orchestrator_active_sessions',
@@ -82,18 +271,105 @@ def increment_agent_request_count(agent_name: str, status: str = "success"):
 def observe_agent_latency(agent_name: str, duration: float):
     AGENT_LATENCY.labels(agent_name=agent_name).observe(duration)
 
-def increment_llm_tokens(token_type: str, model: str, count: int):
-    LLM_TOKEN_COUNT.labels(token_type=token_type, model=model).inc(count)
+def increment_llm_tokens(token_type: str, model: str, count: int, stage: str = "default"):
+    LLM_TOKEN_COUNT.labels(token_type=token_type, model=model, stage=stage).inc(count)
 
 def increment_llm_request_count(model: str, status: str = "success"):
     LLM_REQUEST_COUNT.labels(model=model, status=status).inc()
 
+def observe_llm_queue_wait(priority: str, duration: float):
+    LLM_QUEUE_WAIT.labels(priority=priority).observe(duration)
+
+def increment_llm_rate_limited(priority: str):
+    LLM_RATE_LIMITED_COUNT.labels(priority=priority).inc()
+
 def increment_intent_count(intent: str):
     INTENT_COUNT.labels(intent=intent).inc()
 
 def increment_guardrail_count(result: str):
     GUARDRAIL_COUNT.labels(result=result).inc()
 
+def observe_intent_batch_size(size: int):
+    INTENT_BATCH_SIZE.observe(size)
+
+def increment_intent_batch_fallback(reason: str):
+    INTENT_BATCH_FALLBACK_COUNT.labels(reason=reason).inc()
+
+def increment_intent_knn(result: str):
+    INTENT_KNN_COUNT.labels(result=result).inc()
+
+def increment_flow_event(event: str):
+    FLOW_EVENT_COUNT.labels(event=event).inc()
+
+def increment_outbound_delivery(kind: str, result: str):
+    OUTBOUND_DELIVERY_COUNT.labels(kind=kind, result=result).inc()
+
+def set_outbound_queue_depth(depth: int):
+    OUTBOUND_QUEUE_DEPTH.set(depth)
+
+def increment_deadline_exceeded(stage: str):
+    DEADLINE_EXCEEDED_COUNT.labels(stage=stage).inc()
+
+def increment_request_cancelled(stage: str):
+    REQUEST_CANCELLED_COUNT.labels(stage=stage).inc()
+
+def increment_session_lock(result: str):
+    SESSION_LOCK_COUNT.labels(result=result).inc()
+
+def observe_session_lock_wait(duration: float):
+    SESSION_LOCK_WAIT.observe(duration)
+
+def increment_codec_legacy_read(store: str):
+    CODEC_LEGACY_READ_COUNT.labels(store=store).inc()
+
+def add_audio_prep_bytes(kind: str, n: int):
+    AUDIO_PREP_BYTES.labels(kind=kind).inc(n)
+
+def observe_audio_prep(duration: float):
+    AUDIO_PREP_LATENCY.observe(duration)
+
+def increment_transcription(engine: str, result: str):
+    TRANSCRIPTION_COUNT.labels(engine=engine, result=result).inc()
+
+def observe_transcription_latency(engine: str, duration: float):
+    TRANSCRIPTION_LATENCY.labels(engine=engine).observe(duration)
+
+def add_image_prep_bytes(kind: str, n: int):
+    IMAGE_PREP_BYTES.labels(kind=kind).inc(n)
+
+def increment_ocr(tier: str, result: str):
+    OCR_COUNT.labels(tier=tier, result=result).inc()
+
+def observe_ocr_latency(tier: str, duration: float):
+    OCR_LATENCY.labels(tier=tier).observe(duration)
+
+def observe_event_loop_lag(lag: float):
+    EVENT_LOOP_LAG.observe(lag)
+
+def increment_slow_request(endpoint: str):
+    SLOW_REQUEST_COUNT.labels(endpoint=endpoint).inc()
+
+def increment_model_escalation(stage: str, reason: str):
+    MODEL_ESCALATION_COUNT.labels(stage=stage, reason=reason).inc()
+
+def increment_embedding_cache(result: str):
+    EMBEDDING_CACHE_COUNT.labels(result=result).inc()
+
+def observe_embedding_latency(duration: float):
+    EMBEDDING_LATENCY.observe(duration)
+
+def add_embedding_latency_saved(seconds: float):
+    EMBEDDING_LATENCY_SAVED.inc(seconds)
+
+def increment_retrieval_cache(result: str):
+    RETRIEVAL_CACHE_COUNT.labels(result=result).inc()
+
+def add_rag_context_tokens_trimmed(count: int):
+    RAG_CONTEXT_TOKENS_TRIMMED.inc(count)
+
+def increment_woo_cache(kind: str, result: str):
+    WOO_CACHE_COUNT.labels(kind=kind, result=result).inc()
+
 def session_started():
     ACTIVE_SESSIONS.inc()
 
@@ -0,0 +1,177 @@
+"""
+OCR de imágenes en dos niveles.
+
+1. Local (Tesseract vía pytesseract) para imágenes con pinta de documento:
+   capturas de pantalla, comprobantes de pago, tickets. Corre en un pool de
+   OCR_WORKERS hilos (cada llamada es un proceso tesseract, así que los hilos
+   no compiten por el GIL y el pool acota la CPU usada).
+2. Modelo de visión (OCR_MODEL) con la imagen reescalada (app/image_prep.py):
+   para fotos, o cuando el OCR local sale con confianza media baja
+   (< OCR_MIN_CONFIDENCE) o con muy pocas palabras.
+
+Sin pytesseract/tesseract, o con OCR_LOCAL_ENABLED=false, todo va al modelo de visión.
+"""
+
+import base64
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.image_prep import IMAGE_DETAIL, open_image, prepare_image, vision_tokens
+from app.metrics.prometheus_metrics import increment_ocr, observe_ocr_latency
+
+try:
+    import pytesseract
+except Exception:
+    pytesseract = None  # runtime import guard
+
+load_dotenv()
+OCR_LOCAL_ENABLED = os.getenv("OCR_LOCAL_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_LANG = os.getenv("OCR_LANG", "spa+eng")
+# Confianza media por palabra (0-100) y palabras mínimas para aceptar el OCR local
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "75"))
+OCR_MIN_WORDS = int(os.getenv("OCR_MIN_WORDS", "4"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "10"))
+
+EMPTY_OCR = "Error: No se pudo extraer texto de la imagen. Intente con una imagen más clara."
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_tesseract_ok: Optional[bool] = None
+
+
+def local_ocr_available() -> bool:
+    global _tesseract_ok
+    if _tesseract_ok is None:
+        _tesseract_ok = pytesseract is not None and shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+        if OCR_LOCAL_ENABLED and not _tesseract_ok:
+            print("[WARN] Tesseract no disponible; el OCR va directo al modelo de visión")
+    return OCR_LOCAL_ENABLED and _tesseract_ok
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+        return _pool
+
+
+def looks_text_dense(image: Any) -> bool:
+    """
+    Heurística barata de "documento": fondo plano claro u oscuro dominante,
+    pocos tonos medios y bastantes bordes (trazos de texto). Las fotos no pasan.
+    """
+    from PIL import ImageFilter
+
+    gray = image.convert("L")
+    gray.thumbnail((400, 400))
+    total = float(gray.width * gray.height) or 1.0
+    hist = gray.histogram()
+    light = sum(hist[200:]) / total
+    dark = sum(hist[:60]) / total
+    edges = sum(gray.filter(ImageFilter.FIND_EDGES).histogram()[40:]) / total
+    return max(light, dark) > 0.45 and (1.0 - light - dark) < 0.35 and edges > 0.02
+
+
+def _tesseract(image: Any) -> Tuple[str, float, int]:
+    """(texto por líneas, confianza media ponderada por largo, palabras)."""
+    data = pytesseract.image_to_data(
+        image.convert("L"), lang=OCR_LANG, output_type=pytesseract.Output.DICT, timeout=OCR_TIMEOUT,
+    )
+    lines, weighted, chars = {}, 0.0, 0
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        weighted += conf * len(word)
+        chars += len(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    words = sum(len(w) for w in lines.values())
+    return text, (weighted / chars if chars else 0.0), words
+
+
+def local_ocr(image: Any) -> Tuple[str, float, int]:
+    return _get_pool().submit(_tesseract, image).result(timeout=OCR_TIMEOUT + 1)
+
+
+def _vision_ocr(image_data: bytes, mimetype: str, model: str, est_tokens: int) -> str:
+    import openai  # import diferido (arranque rápido)
+    from app.llm_scheduler import get_scheduler
+
+    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    data_url = f"data:{mimetype};base64,{base64.b64encode(image_data).decode('ascii')}"
+    image_url = {"url": data_url}
+    if IMAGE_DETAIL in ("low", "high"):
+        image_url["detail"] = IMAGE_DETAIL
+    response = get_scheduler().run(
+        lambda: client.chat.completions.create(
+            model=model,  # OCR_MODEL (gpt-4o para mejor visión)
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Extrae el texto de esta imagen usando OCR."},
+                        {"type": "image_url", "image_url": image_url}
+                    ]
+                }
+            ],
+            max_tokens=500
+        ),
+        "media", est_tokens=est_tokens, model=model,
+    )
+    return response.choices[0].message.content
+
+
+def extract_text(image_data: bytes, mimetype: str, model: str = "gpt-4o-mini") -> str:
+    """Texto de la imagen: OCR local si es un documento legible, si no el modelo de visión."""
+    image = open_image(image_data)
+    if image is not None and local_ocr_available() and looks_text_dense(image):
+        start = time.perf_counter()
+        try:
+            text, confidence, words = local_ocr(image)
+            observe_ocr_latency("local", time.perf_counter() - start)
+            if confidence >= OCR_MIN_CONFIDENCE and words >= OCR_MIN_WORDS:
+                increment_ocr("local", "ok")
+                print(f"[INFO] OCR local ({words} palabras, confianza {confidence:.0f}): '{text[:100]}'")
+                return text
+            increment_ocr("local", "escalated")
+            print(f"[INFO] OCR local insuficiente ({words} palabras, confianza {confidence:.0f}); se usa {model}")
+        except Exception as e:
+            increment_ocr("local", "error")
+            print(f"[WARN] OCR local falló ({e}); se usa {model}")
+
+    prepared = prepare_image(image_data, mimetype, image)
+    # Se reserva en el bucket TPM lo que la imagen cuesta de verdad (+ prompt y respuesta)
+    est_tokens = (vision_tokens(prepared.width, prepared.height, model) if prepared.width else 1500) + 600
+    start = time.perf_counter()
+    try:
+        extracted = _vision_ocr(prepared.data, prepared.mimetype, model, est_tokens)
+    except Exception as e:
+        increment_ocr("vision", "error")
+        print(f"[WARN] Error en OCR con {model}: {e}")
+        return f"Error en OCR: {e}"
+    observe_ocr_latency("vision", time.perf_counter() - start)
+    if not extracted or not extracted.strip():
+        increment_ocr("vision", "empty")
+        return EMPTY_OCR
+    increment_ocr("vision", "ok")
+    print(f"[INFO] OCR {model} ({prepared.raw_bytes} -> {len(prepared.data)} bytes): '{extracted[:100]}'")
+    return extracted
+
+
+def shutdown_ocr():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
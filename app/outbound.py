@@ -0,0 +1,384 @@
+"""
+Entrega saliente fiable: webhook del bot (incoming/outgoing) y etiquetas de Chatwoot.
+
+- `enqueue` nunca espera: el job entra en una cola acotada y la respuesta al
+  usuario sigue. Si la cola está llena o el dispatcher no arrancó, el job va
+  al spill, que se escribe en un hilo propio (Redis/disco no frenan el loop).
+- `conversation_id` responde solo desde memoria; los workers la calientan
+  desde Redis al procesar los jobs de la sesión (el incoming llega antes que
+  la respuesta).
+- Una cola por worker; los jobs de una misma sesión van siempre al mismo
+  worker, así el `incoming` se entrega antes que sus `outgoing`.
+- Reintentos con backoff exponencial + jitter ante 429/5xx/errores de red.
+  Agotados los intentos, el job va al spill (lista Redis `outbound:spill`, o
+  un JSONL en disco sin Redis) y se reencola periódicamente, hasta
+  OUTBOUND_SPILL_MAX_ROUNDS veces; después queda en `outbound:dead` (o
+  dead.jsonl) para revisarlo a mano.
+- Lotes: si el receptor los acepta (OUTBOUND_BATCH_MAX > 1), los webhooks
+  consecutivos de un worker se envían como una lista JSON en un solo POST.
+  Un `outgoing` cuya sesión tiene el `incoming` en el mismo lote (sin
+  conversation_id aún) abre un POST nuevo tras el del incoming.
+- `drain` (shutdown) entrega lo pendiente hasta OUTBOUND_DRAIN_TIMEOUT y
+  manda el resto al spill.
+"""
+
+import asyncio
+import json
+import os
+import random
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from app.cache import LRUCache, get_redis
+from app.chatwoot_client import label_request
+from app.metrics.prometheus_metrics import increment_outbound_delivery, set_outbound_queue_depth
+
+load_dotenv()
+CHATWOOT_BOT_WEBHOOK_URL = os.getenv("CHATWOOT_BOT_WEBHOOK_URL", "https://NNNNNNNNNNNN.com/webhook/chatwood-bot")
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000"))
+OUTBOUND_TIMEOUT = float(os.getenv("OUTBOUND_TIMEOUT", "5"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+OUTBOUND_BATCH_MAX = int(os.getenv("OUTBOUND_BATCH_MAX", "1"))
+OUTBOUND_SPILL_DIR = os.getenv("OUTBOUND_SPILL_DIR", "data/outbound")
+OUTBOUND_SPILL_RETRY_SECONDS = float(os.getenv("OUTBOUND_SPILL_RETRY_SECONDS", "30"))
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "10"))
+OUTBOUND_SPILL_MAX_ROUNDS = int(os.getenv("OUTBOUND_SPILL_MAX_ROUNDS", "10"))
+
+_SPILL_KEY = "outbound:spill"
+_DEAD_KEY = "outbound:dead"
+_CONVERSATION_TTL = 7 * 24 * 3600
+
+
+class _Retryable(Exception):
+    pass
+
+
+class OutboundDispatcher:
+    def __init__(self, workers: int = OUTBOUND_WORKERS, queue_size: int = OUTBOUND_QUEUE_SIZE):
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._http: Optional[httpx.AsyncClient] = None
+        self._running = False
+        # session_id -> conversation_id devuelto por el webhook incoming
+        self._conversations = LRUCache(maxsize=20000, ttl=_CONVERSATION_TTL)
+        # Un solo hilo: los spills se escriben en orden y sin bloquear a quien encola
+        self._spill_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbound-spill")
+
+    # ---------- ciclo de vida ----------
+    async def start(self):
+        if self._running:
+            return
+        self._http = httpx.AsyncClient(
+            timeout=OUTBOUND_TIMEOUT,
+            limits=httpx.Limits(max_connections=len(self._queues) * 2, max_keepalive_connections=len(self._queues) * 2),
+        )
+        self._running = True
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        self._tasks.append(asyncio.create_task(self._replay_spill_loop()))
+
+    async def drain(self, timeout: float = OUTBOUND_DRAIN_TIMEOUT):
+        """Deja de aceptar jobs, entrega lo pendiente y manda el resto al spill."""
+        if not self._running:
+            return
+        self._running = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            print("[WARN] Drenado de la cola saliente incompleto; el resto va al spill.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for q in self._queues:
+            while not q.empty():
+                self._spill_later(q.get_nowait())
+        # Barrera: todo lo encolado al hilo de spill quedó escrito
+        await asyncio.wrap_future(self._spill_pool.submit(lambda: None))
+        await self._http.aclose()
+
+    # ---------- encolado ----------
+    def enqueue(self, kind: str, session_id: str, payload: Dict[str, Any]) -> bool:
+        """Encola sin esperar. False si el job fue directo al spill."""
+        job = {"kind": kind, "session_id": session_id, "payload": payload, "attempts": 0}
+        return self._put(job)
+
+    def _put(self, job: Dict[str, Any]) -> bool:
+        if not self._running:
+            self._spill_later(job)
+            return False
+        q = self._queues[zlib.crc32(str(job["session_id"]).encode("utf-8")) % len(self._queues)]
+        try:
+            q.put_nowait(job)
+        except asyncio.QueueFull:
+            self._spill_later(job)
+            return False
+        set_outbound_queue_depth(sum(x.qsize() for x in self._queues))
+        return True
+
+    def conversation_id(self, session_id: str) -> Optional[str]:
+        """conversation_id de Chatwoot ya resuelto para la sesión, solo de memoria (camino de la respuesta)."""
+        return self._conversations.get(session_id)
+
+    def _redis_conversation(self, session_id: str) -> Optional[str]:
+        client = get_redis()
+        if client is not None:
+            try:
+                raw = client.get(f"convid:{session_id}")
+                if raw:
+                    return raw.decode("utf-8") if isinstance(raw, bytes) else str(raw)
+            except Exception as e:
+                print(f"[WARN] Error leyendo conversation_id: {e}")
+        return None
+
+    async def _resolve_conversation(self, session_id: str) -> Optional[str]:
+        """Desde los workers: memoria o Redis (en un hilo); calienta la memoria para `conversation_id`."""
+        cached = self._conversations.get(session_id)
+        if cached:
+            return cached
+        value = await asyncio.to_thread(self._redis_conversation, session_id)
+        if value:
+            self._conversations.set(session_id, value)
+        return value
+
+    def _redis_remember(self, session_id: str, conversation_id: str):
+        client = get_redis()
+        if client is not None:
+            try:
+                client.set(f"convid:{session_id}", conversation_id, ex=_CONVERSATION_TTL)
+            except Exception as e:
+                print(f"[WARN] Error guardando conversation_id: {e}")
+
+    async def _remember_conversation(self, session_id: str, conversation_id: str):
+        self._conversations.set(session_id, conversation_id)
+        await asyncio.to_thread(self._redis_remember, session_id, conversation_id)
+
+    # ---------- workers ----------
+    async def _worker(self, q: asyncio.Queue):
+        while True:
+            job = await q.get()
+            batch = [job]
+            # Lote de webhooks consecutivos (solo si el receptor acepta listas)
+            while job["kind"] == "webhook" and len(batch) < OUTBOUND_BATCH_MAX and not q.empty():
+                nxt = q.get_nowait()
+                batch.append(nxt)
+                if nxt["kind"] != "webhook":
+                    break
+            try:
+                await self._deliver(batch)
+            except asyncio.CancelledError:
+                # Shutdown con el lote en vuelo: que no se pierda
+                for j in batch:
+                    if not j.get("delivered"):
+                        self._spill_later(j)
+                raise
+            finally:
+                for _ in batch:
+                    q.task_done()
+                set_outbound_queue_depth(sum(x.qsize() for x in self._queues))
+
+    async def _deliver(self, batch: List[Dict[str, Any]]):
+        webhooks = [j for j in batch if j["kind"] == "webhook"]
+        others = [j for j in batch if j["kind"] != "webhook"]
+        groups = ([webhooks] if webhooks else []) + [[j] for j in others]
+        for group in groups:
+            for attempt in range(OUTBOUND_MAX_ATTEMPTS):
+                try:
+                    await self._send(group)
+                    for j in group:
+                        increment_outbound_delivery(j["kind"], "delivered")
+                    break
+                except _Retryable as e:
+                    # Los sub-lotes ya entregados no se reenvían
+                    group = [j for j in group if not j.pop("delivered", False)]
+                    for j in group:
+                        j["attempts"] += 1
+                        increment_outbound_delivery(j["kind"], "retried")
+                    if attempt == OUTBOUND_MAX_ATTEMPTS - 1:
+                        print(f"[WARN] Entrega saliente agotó reintentos ({e}); al spill.")
+                        for j in group:
+                            self._spill_later(j)
+                        break
+                    delay = min(30.0, 0.5 * 2 ** attempt)
+                    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                except Exception as e:
+                    print(f"[WARN] Entrega saliente descartada: {e}")
+                    for j in group:
+                        increment_outbound_delivery(j["kind"], "dropped")
+                    break
+
+    async def _post(self, url: str, **kwargs) -> httpx.Response:
+        try:
+            resp = await self._http.post(url, **kwargs)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            raise _Retryable(str(e))
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise _Retryable(f"HTTP {resp.status_code} en {url}")
+        if resp.status_code >= 400:
+            raise RuntimeError(f"HTTP {resp.status_code} en {url}: {resp.text[:200]}")
+        return resp
+
+    async def _send(self, group: List[Dict[str, Any]]):
+        if group[0]["kind"] == "label":
+            job = group[0]
+            conversation_id = await self._resolve_conversation(job["session_id"]) or job["session_id"]
+            url, headers, body = label_request(conversation_id, job["payload"]["label"])
+            await self._post(url, headers=headers, json=body)
+            return
+
+        # conversation_id resuelto una vez por sesión para todo el lote
+        resolved: Dict[str, Optional[str]] = {}
+        chunk: List[Dict[str, Any]] = []
+        awaiting = set()
+        for job in group:
+            sid = job["session_id"]
+            if job["payload"].get("type") == "outgoing" and sid in awaiting:
+                # Su incoming va en este mismo POST: el outgoing espera a que devuelva el conversation_id
+                await self._send_webhooks(chunk, resolved)
+                chunk, awaiting = [], set()
+            chunk.append(job)
+            if job["payload"].get("type") == "incoming":
+                awaiting.add(sid)
+        if chunk:
+            await self._send_webhooks(chunk, resolved)
+
+    async def _send_webhooks(self, jobs: List[Dict[str, Any]], resolved: Dict[str, Optional[str]]):
+        bodies = []
+        for job in jobs:
+            body = dict(job["payload"])
+            sid = job["session_id"]
+            if sid not in resolved:
+                # También para el incoming: deja la memoria caliente para la respuesta del turno
+                resolved[sid] = await self._resolve_conversation(sid)
+            if body.get("type") == "outgoing":
+                # El incoming de la sesión ya se entregó (mismo worker, FIFO)
+                body["conversation_id"] = resolved[sid] or sid
+            bodies.append(body)
+        resp = await self._post(CHATWOOT_BOT_WEBHOOK_URL, json=bodies if len(bodies) > 1 else bodies[0])
+        for job in jobs:
+            job["delivered"] = True
+        incoming = [i for i, job in enumerate(jobs) if job["payload"].get("type") == "incoming"]
+        if not incoming or resp.status_code != 200:
+            return
+        try:
+            data = resp.json()
+        except ValueError as e:
+            print(f"[WARN] Error parsing webhook json: {e}")
+            return
+        # Lote: una respuesta por body (si el receptor la devuelve); un único incoming: el dict
+        if isinstance(data, list) and len(data) == len(jobs):
+            answers = [(i, data[i]) for i in incoming]
+        elif isinstance(data, dict) and len(incoming) == 1:
+            answers = [(incoming[0], data)]
+        else:
+            answers = []
+        for i, item in answers:
+            val = (item.get("conversation_id") or item.get("id")) if isinstance(item, dict) else None
+            if val:
+                sid = jobs[i]["session_id"]
+                resolved[sid] = str(val)
+                await self._remember_conversation(sid, str(val))
+
+    # ---------- spill ----------
+    def _spill_later(self, job: Dict[str, Any]) -> Future:
+        """Spill sin esperar: Redis o disco en el hilo de spill."""
+        return self._spill_pool.submit(self._spill_safe, job)
+
+    def _spill_safe(self, job: Dict[str, Any]):
+        try:
+            self._spill(job)
+        except Exception as e:
+            print(f"[ERROR] Job saliente perdido ({job['kind']}, sesión {job['session_id']}): no se pudo escribir el spill: {e}")
+
+    def _spill(self, job: Dict[str, Any]):
+        increment_outbound_delivery(job["kind"], "spilled")
+        self._persist(_SPILL_KEY, "spill.jsonl", job)
+
+    def _dead_letter(self, job: Dict[str, Any]):
+        increment_outbound_delivery(job["kind"], "dead")
+        print(f"[WARN] Entrega saliente ({job['kind']}, sesión {job['session_id']}) sin éxito tras "
+              f"{OUTBOUND_SPILL_MAX_ROUNDS} rondas de spill; a {_DEAD_KEY}.")
+        self._persist(_DEAD_KEY, "dead.jsonl", job)
+
+    def _persist(self, key: str, filename: str, job: Dict[str, Any]):
+        raw = json.dumps(job, ensure_ascii=False)
+        client = get_redis()
+        if client is not None:
+            try:
+                client.rpush(key, raw)
+                return
+            except Exception as e:
+                print(f"[WARN] Spill a Redis falló ({e}); usando disco.")
+        os.makedirs(OUTBOUND_SPILL_DIR, exist_ok=True)
+        with open(os.path.join(OUTBOUND_SPILL_DIR, filename), "a", encoding="utf-8") as fh:
+            fh.write(raw + "\n")
+
+    def _take_spilled(self, limit: int) -> List[Dict[str, Any]]:
+        jobs: List[Dict[str, Any]] = []
+        client = get_redis()
+        if client is not None:
+            try:
+                for _ in range(limit):
+                    raw = client.lpop(_SPILL_KEY)
+                    if raw is None:
+                        break
+                    jobs.append(json.loads(raw))
+            except Exception as e:
+                print(f"[WARN] Error leyendo spill de Redis: {e}")
+        path = os.path.join(OUTBOUND_SPILL_DIR, "spill.jsonl")
+        if len(jobs) < limit and os.path.exists(path):
+            taken = path + ".replay"
+            os.replace(path, taken)
+            with open(taken, encoding="utf-8") as fh:
+                lines = [line for line in fh if line.strip()]
+            room = limit - len(jobs)
+            jobs.extend(json.loads(line) for line in lines[:room])
+            if lines[room:]:
+                # El resto vuelve al spill (detrás de lo que se haya agregado mientras tanto)
+                with open(path, "a", encoding="utf-8") as fh:
+                    fh.writelines(lines[room:])
+            os.remove(taken)
+        return jobs
+
+    async def _replay_spill_loop(self):
+        while True:
+            await asyncio.sleep(OUTBOUND_SPILL_RETRY_SECONDS)
+            free = sum(q.maxsize - q.qsize() for q in self._queues) // 2
+            if free <= 0:
+                continue
+            jobs = await asyncio.to_thread(self._take_spilled, free)
+            for job in jobs:
+                job["spill_rounds"] = job.get("spill_rounds", 0) + 1
+                if job["spill_rounds"] > OUTBOUND_SPILL_MAX_ROUNDS:
+                    await asyncio.to_thread(self._dead_letter, job)
+                    continue
+                job["attempts"] = 0
+                self._put(job)
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+def get_outbound() -> OutboundDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+
+def enqueue_webhook(session_id: str, message: str, msg_type: str, user: Optional[str] = None) -> bool:
+    """Notificación al webhook del bot (incoming/outgoing), sin esperar la entrega."""
+    return get_outbound().enqueue("webhook", session_id, {
+        "user": user or "unknown",
+        "mensaje": message,
+        "type": msg_type,
+        "conversation_id": session_id,
+    })
+
+
+def enqueue_label(session_id: str, label: str) -> bool:
+    """Etiqueta de Chatwoot para la conversación de la sesión, sin esperar la entrega."""
+    return get_outbound().enqueue("label", session_id, {"label": label})
@@ -0,0 +1,211 @@
+"""
+Diagnóstico de latencia en producción.
+
+- `SamplingProfiler`: perfilador por muestreo (hilo aparte que cada
+  `interval` lee `sys._current_frames()`): ve el event loop y los hilos del
+  executor (nodos síncronos del grafo, OCR, transcripción...) sin
+  instrumentar nada. Devuelve stacks colapsados (`hilo;f1 (file:line);f2 ... N`),
+  el formato de flamegraph.pl / speedscope / inferno. Sirve /debug/profile.
+- `LoopLagMonitor`: tarea que duerme LOOP_LAG_INTERVAL y mide cuánto tarde
+  despierta (= cuánto estuvo bloqueado el loop). Guarda las muestras recientes.
+- Registro de requests lentos: los requests de /webhook que superan
+  SLOW_REQUEST_SECONDS quedan (los últimos SLOW_REQUEST_KEEP) con el desglose
+  por nodo (etapas del deadline) y el lag del loop mientras duraron. Sirve /debug/slow.
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import increment_slow_request, observe_event_loop_lag
+
+load_dotenv()
+# Sin token los endpoints /debug/* no existen (404)
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+DEBUG_TOKEN_HEADER = "X-Debug-Token"
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "100"))
+
+# Hojas de stack de hilos ociosos (loop esperando I/O, workers sin trabajo)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+    ("process.py", "_wait_for_updates"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Un perfil a la vez: muestrear todos los hilos cuesta GIL, no conviene superponerlos."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.counts: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not SamplingProfiler._lock.acquire(blocking=False):
+            raise ProfilerBusy("Ya hay un perfil en curso")
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            SamplingProfiler._lock.release()
+        return self.collapsed()
+
+    def _run(self):
+        own = threading.get_ident()
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self._add(names.get(ident, f"thread-{ident}"), frame)
+            self.samples += 1
+            next_at += self.interval
+            self._stop.wait(max(0.0, next_at - time.perf_counter()))
+
+    def _add(self, thread_name: str, frame):
+        leaf = frame.f_code
+        if not self.include_idle and (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.counts[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.counts.items()))
+
+
+async def profile(seconds: float, interval_ms: float = PROFILE_INTERVAL_MS, include_idle: bool = False) -> Tuple[str, int]:
+    """Perfila el proceso `seconds` segundos; devuelve (stacks colapsados, muestras). ProfilerBusy si hay otro."""
+    profiler = SamplingProfiler(max(interval_ms, 1.0) / 1000.0, include_idle)
+    profiler.start()
+    try:
+        await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+    finally:
+        collapsed = await asyncio.to_thread(profiler.stop)
+    return collapsed, profiler.samples
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, keep_seconds: float = 600.0):
+        self.interval = interval
+        # (monotonic del despertar, lag en segundos)
+        self.samples: Deque[Tuple[float, float]] = collections.deque(maxlen=max(1, int(keep_seconds / interval)))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.samples.append((now, lag))
+            observe_event_loop_lag(lag)
+
+    def window(self, start: float, end: float) -> Dict[str, Any]:
+        """Lag del loop entre `start` y `end` (monotonic); incluye la muestra que cierra la ventana."""
+        lags = [lag for at, lag in list(self.samples) if start <= at <= end + self.interval]
+        if not lags:
+            return {"samples": 0, "max_ms": None, "mean_ms": None}
+        return {"samples": len(lags), "max_ms": round(max(lags) * 1000, 1), "mean_ms": round(sum(lags) / len(lags) * 1000, 1)}
+
+
+_loop_lag = LoopLagMonitor()
+_slow_requests: Deque[Dict[str, Any]] = collections.deque(maxlen=SLOW_REQUEST_KEEP)
+
+
+def start_loop_lag_monitor():
+    _loop_lag.start()
+
+
+async def stop_loop_lag_monitor():
+    await _loop_lag.stop()
+
+
+def record_request(endpoint: str, session_id: str, deadline: Any, status: int):
+    """
+    Al terminar un request: si superó SLOW_REQUEST_SECONDS, guarda su desglose.
+    Corre en el `finally` de los endpoints: nunca lanza (el diagnóstico no tumba la respuesta).
+    """
+    try:
+        _record_request(endpoint, session_id, deadline, status)
+    except Exception as e:
+        print(f"[WARN] No se pudo registrar el request lento de {endpoint}: {e}")
+
+
+def _record_request(endpoint: str, session_id: str, deadline: Any, status: int):
+    end = time.monotonic()
+    elapsed = end - deadline.started_at
+    if elapsed < SLOW_REQUEST_SECONDS:
+        return
+    from app.traffic_capture import hash_session
+
+    increment_slow_request(endpoint)
+    entry = {
+        "ts": round(time.time(), 3),
+        "endpoint": endpoint,
+        "session": hash_session(session_id),
+        "status": status,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "stages": deadline.stage_timings(end),
+        "loop_lag": _loop_lag.window(deadline.started_at, end),
+    }
+    _slow_requests.append(entry)
+    details = []
+    if entry["stages"]:
+        slowest = max(entry["stages"], key=lambda s: s["ms"])
+        details.append(f"etapa más lenta: {slowest['stage']} {slowest['ms']:.0f} ms")
+    lag = entry["loop_lag"]["max_ms"]
+    # Sin muestras (monitor apagado o request más corto que el intervalo) no hay lag que informar
+    details.append(f"lag máx. del loop {lag} ms" if lag is not None else "sin muestras de lag del loop")
+    print(f"[WARN] Request lento en {endpoint}: {entry['elapsed_ms']:.0f} ms ({', '.join(details)})")
+
+
+def slow_requests() -> List[Dict[str, Any]]:
+    """Requests lentos recientes, el más nuevo primero."""
+    return list(reversed(_slow_requests))
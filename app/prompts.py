@@ -15,8 +15,10 @@ def agent_prompt(name: str):
         ("human", "{input}")
     ])
 
-ROUTER_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
+# Layout pensado para el caché de prefijos del proveedor: primero el bloque
+# estático (idéntico en cada llamada), después lo variable (resumen global,
+# contexto de la sesión) y al final el mensaje del usuario.
+ROUTER_INSTRUCTIONS = """
 Eres un agente clasificador de intenciones para un asistente virtual de una tienda online.
 
 Tu tarea es analizar el mensaje del cliente y clasificarlo en UNA de las siguientes intenciones:
@@ -64,7 +66,11 @@ Tu tarea es analizar el mensaje del cliente y clasificarlo en UNA de las siguien
 IMPORTANTE:
 - Responde solo con la intención elegida, sin comillas ni formato JSON.
 - No incluyas texto adicional, explicaciones ni comentarios.
-"""),
+"""
+
+ROUTER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", ROUTER_INSTRUCTIONS),
     MessagesPlaceholder("summary_context"),
+    MessagesPlaceholder("conversation_context", optional=True),
     ("human", "{input}")
 ])
@@ -1,15 +1,13 @@
 import os
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from langchain_openai import OpenAIEmbeddings
 from langchain_qdrant import Qdrant
+from app.vector.embedding_cache import get_embeddings
 
 load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
 
-EMB = OpenAIEmbeddings()
-
 def _client() -> QdrantClient:
     return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
 
@@ -22,7 +20,8 @@ def get_qdrant_collection(name: str) -> Qdrant:
     return Qdrant(
         client=client,
         collection_name=name,
-        embeddings=EMB,
+        # Embeddings con caché LRU + Redis (se crean en el primer uso)
+        embeddings=get_embeddings(),
     )
 
 def products_retriever():
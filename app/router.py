@@ -1,18 +1,25 @@
 
-from typing import Tuple, Callable, Dict, Any
+from typing import Tuple, Callable, Dict, Any, List, Optional
 from langchain_openai import ChatOpenAI
-from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 from app.prompts import ROUTER_PROMPT
-from app.memory import make_global_summary_memory
+from app.memory import make_global_summary_memory, save_summary_context
 
-def make_router(llm: ChatOpenAI) -> Tuple[Any, Any, Callable[[Dict[str, Any]], Dict[str, Any]]]:
-    summary = make_global_summary_memory(llm)
+def _context_messages(inputs: Any) -> List[SystemMessage]:
+    """Contexto de la sesión como mensaje aparte, después del prefijo estático del prompt."""
+    context = inputs.get("context", "") if isinstance(inputs, dict) else ""
+    return [SystemMessage(content=f"Contexto de la conversación:\n{context}")] if context else []
+
+def make_router(llm: ChatOpenAI, summary_llm: Optional[ChatOpenAI] = None) -> Tuple[Any, Any, Callable[[Dict[str, Any]], Dict[str, Any]]]:
+    summary = make_global_summary_memory(summary_llm or llm)
 
     chain = (
         {
             "summary_context": RunnableLambda(lambda x: summary.load_memory_variables({}).get("summary_context", [])),
-            "input": RunnablePassthrough(),
+            "conversation_context": RunnableLambda(_context_messages),
+            "input": RunnableLambda(lambda x: x.get("input", "") if isinstance(x, dict) else x),
         }
         | ROUTER_PROMPT
         | llm
@@ -20,7 +27,7 @@ def make_router(llm: ChatOpenAI) -> Tuple[Any, Any, Callable[[Dict[str, Any]], D
     )
 
     def with_memory(inputs: Dict[str, Any]):
-        summary.save_context({"input": inputs.get("input","")}, {"output": inputs.get("output","")})
+        save_summary_context(summary, inputs.get("input",""), inputs.get("output",""))
         return inputs
 
     return chain, summary, with_memory
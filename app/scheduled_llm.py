@@ -0,0 +1,100 @@
+"""ChatOpenAI que pasa cada llamada por el scheduler global de LLM (app/llm_scheduler.py)."""
+
+import time
+from typing import Any, List, Optional
+
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+
+from app.deadline import current_deadline
+from app.llm_scheduler import get_scheduler
+from app.traffic_capture import record_downstream, replay_headers
+from app.token_accounting import count_tokens, record_usage, usage_from_llm_output, usage_from_metadata
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    # Clase de prioridad en el scheduler: interactive | media | background
+    llm_priority: str = "interactive"
+    # Etapa del grafo para la contabilidad de tokens (router, guardrail, summary...)
+    llm_stage: str = "default"
+
+    def _est_tokens(self, messages: List[BaseMessage]) -> int:
+        prompt = sum(count_tokens(str(m.content), self.model_name) for m in messages)
+        return prompt + (self.max_tokens or 256)
+
+    def _call_kwargs(self, kwargs: dict) -> dict:
+        """Con deadline de request activo, el timeout de la llamada es el tiempo restante."""
+        headers = replay_headers(self.llm_stage)
+        if headers:
+            kwargs = {**kwargs, "extra_headers": headers}
+        deadline = current_deadline()
+        if deadline is None:
+            return kwargs
+        return {**kwargs, "timeout": deadline.timeout(self.request_timeout if isinstance(self.request_timeout, (int, float)) else None)}
+
+    def _capture(self, content: Any, additional_kwargs: Optional[dict], start: float):
+        """Respuesta del modelo a la captura de tráfico (si hay) para que el stub del replay la repita."""
+        response = {"content": content}
+        if additional_kwargs and additional_kwargs.get("tool_calls"):
+            response["tool_calls"] = additional_kwargs["tool_calls"]
+        record_downstream("llm", self.llm_stage, time.perf_counter() - start, response)
+
+    def _record(self, result, start: float):
+        record_usage(self.llm_stage, self.model_name, *usage_from_llm_output(result.llm_output))
+        if result.generations:
+            message = result.generations[0].message
+            self._capture(message.content, message.additional_kwargs, start)
+        return result
+
+    def _record_chunk(self, chunk):
+        usage = getattr(chunk.message, "usage_metadata", None)
+        if usage:
+            record_usage(self.llm_stage, self.model_name, *usage_from_metadata(usage))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        parent = super(ScheduledChatOpenAI, self)
+        start = [0.0]
+
+        def call():
+            start[0] = time.perf_counter()
+            return parent._generate(messages, stop=stop, run_manager=run_manager, **self._call_kwargs(kwargs))
+
+        result = get_scheduler().run(call, self.llm_priority, self._est_tokens(messages), self.model_name)
+        return self._record(result, start[0])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        parent = super(ScheduledChatOpenAI, self)
+        start = [0.0]
+
+        def call():
+            # La latencia grabada excluye la espera en el scheduler
+            start[0] = time.perf_counter()
+            return parent._agenerate(messages, stop=stop, run_manager=run_manager, **self._call_kwargs(kwargs))
+
+        result = await get_scheduler().arun(call, self.llm_priority, self._est_tokens(messages), self.model_name)
+        return self._record(result, start[0])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        with get_scheduler().slot(self.llm_priority, self._est_tokens(messages)):
+            start, parts = time.perf_counter(), []
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **self._call_kwargs(kwargs)):
+                self._record_chunk(chunk)
+                parts.append(chunk.message.content)
+                yield chunk
+            self._capture("".join(p for p in parts if isinstance(p, str)), None, start)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        async with get_scheduler().aslot(self.llm_priority, self._est_tokens(messages)):
+            start, parts = time.perf_counter(), []
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **self._call_kwargs(kwargs)):
+                self._record_chunk(chunk)
+                parts.append(chunk.message.content)
+                yield chunk
+            self._capture("".join(p for p in parts if isinstance(p, str)), None, start)
+
+
+def with_priority(llm: Any, priority: str) -> Any:
+    """Copia del LLM con otra clase de prioridad (p. ej. `background` para resúmenes)."""
+    if isinstance(llm, ScheduledChatOpenAI) and llm.llm_priority != priority:
+        return llm.copy(update={"llm_priority": priority})
+    return llm
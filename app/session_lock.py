@@ -0,0 +1,263 @@
+"""
+Lease distribuido por sesión para correr varias réplicas detrás del balanceador.
+
+Dos mensajes del mismo cliente pueden llegar a réplicas distintas a la vez;
+el turno completo (historial, flujo, grafo, resumen) se serializa con un lease
+en Redis:
+
+- `sesslock:{session_id}` = "<owner>:<token>" con PX SESSION_LEASE_TTL_MS; se
+  adquiere con SET NX en un script Lua que además incrementa el fencing token
+  monotónico `sessfence:{session_id}`.
+- Mientras dura el turno, una tarea renueva el lease cada TTL/3. Si la
+  renovación falla (pausa larga, Redis caído) el lease se marca perdido.
+- Escrituras protegidas (historial en app/memory.py): `fenced_lpush` solo
+  escribe si `sesslock:` todavía guarda nuestro owner:token, en el mismo script
+  Lua. Una réplica que perdió el lease no puede pisar a la que lo tomó después.
+- Sin Redis (una sola réplica) se usa un asyncio.Lock por sesión en proceso.
+
+El lease del request en curso viaja en un contextvar (como el deadline), así
+`get_message_history` lo encuentra sin cambiar firmas.
+"""
+
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from app.cache import get_redis
+from app.metrics.prometheus_metrics import increment_session_lock, observe_session_lock_wait
+
+load_dotenv()
+SESSION_LOCK_ENABLED = os.getenv("SESSION_LOCK_ENABLED", "true").lower() in ("1", "true", "yes")
+SESSION_LEASE_TTL_MS = int(os.getenv("SESSION_LEASE_TTL_MS", "10000"))
+# Espera máxima por el lease (acotada además por el deadline del request)
+SESSION_LOCK_WAIT_SECONDS = float(os.getenv("SESSION_LOCK_WAIT_SECONDS", "10"))
+
+_ACQUIRE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+return token
+"""
+
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_FENCED_LPUSH_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('LPUSH', KEYS[2], ARGV[2])
+if tonumber(ARGV[3]) > 0 then redis.call('EXPIRE', KEYS[2], ARGV[3]) end
+return 1
+"""
+
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SessionBusy(Exception):
+    """No se obtuvo el lease de la sesión dentro del tiempo de espera."""
+
+
+class LeaseLost(Exception):
+    """Escritura rechazada: otra réplica tiene ahora el lease (fencing)."""
+
+
+def _decode(value: Any) -> Any:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class SessionLease:
+    def __init__(self, session_id: str, ttl_ms: int = SESSION_LEASE_TTL_MS):
+        self.session_id = session_id
+        self.ttl_ms = ttl_ms
+        self.owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex[:8]}"
+        self.token: Optional[int] = None
+        self.lost = False
+
+    @property
+    def key(self) -> str:
+        return f"sesslock:{self.session_id}"
+
+    @property
+    def fence_key(self) -> str:
+        return f"sessfence:{self.session_id}"
+
+    @property
+    def value(self) -> str:
+        return f"{self.owner}:{self.token}"
+
+    def try_acquire(self, client) -> bool:
+        token = client.register_script(_ACQUIRE_LUA)(keys=[self.key, self.fence_key], args=[self.owner, self.ttl_ms])
+        if not token:
+            return False
+        self.token = int(token)
+        self.lost = False
+        return True
+
+    def acquire(self, client, wait: float = SESSION_LOCK_WAIT_SECONDS) -> bool:
+        """Variante síncrona (scripts, workers): reintenta con backoff hasta `wait` segundos."""
+        end = time.monotonic() + wait
+        delay = 0.02
+        while not self.try_acquire(client):
+            if time.monotonic() + delay > end:
+                return False
+            time.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 0.2)
+        return True
+
+    async def acquire_async(self, client, wait: float = SESSION_LOCK_WAIT_SECONDS) -> bool:
+        """Cada intento es un round-trip síncrono a Redis: va en un hilo, no en el loop."""
+        end = time.monotonic() + wait
+        delay = 0.02
+        while not await asyncio.to_thread(self.try_acquire, client):
+            if time.monotonic() + delay > end:
+                return False
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 0.2)
+        return True
+
+    def renew(self, client) -> bool:
+        ok = bool(client.register_script(_RENEW_LUA)(keys=[self.key], args=[self.value, self.ttl_ms]))
+        if not ok:
+            self.lost = True
+        return ok
+
+    def release(self, client) -> bool:
+        if self.token is None:
+            return False
+        return bool(client.register_script(_RELEASE_LUA)(keys=[self.key], args=[self.value]))
+
+    def fenced_lpush(self, client, key: str, value: str, ttl: int = 0):
+        """LPUSH atómico solo si seguimos teniendo el lease; si no, LeaseLost."""
+        ok = client.register_script(_FENCED_LPUSH_LUA)(keys=[self.key, key], args=[self.value, value, int(ttl or 0)])
+        if not ok:
+            self.lost = True
+            increment_session_lock("fenced")
+            raise LeaseLost(f"Lease de la sesión '{self.session_id}' perdido (token {self.token})")
+
+    def holder(self, client) -> Optional[str]:
+        return _decode(client.get(self.key))
+
+
+_current: ContextVar[Optional[SessionLease]] = ContextVar("session_lease", default=None)
+
+
+def current_lease(session_id: Optional[str] = None) -> Optional[SessionLease]:
+    """Lease del request en curso (si es de `session_id`, cuando se indica)."""
+    lease = _current.get()
+    if lease is None or (session_id is not None and lease.session_id != session_id):
+        return None
+    return lease
+
+
+async def _renew_loop(client, lease: SessionLease):
+    interval = lease.ttl_ms / 3000.0
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            ok = await asyncio.to_thread(lease.renew, client)
+        except Exception as e:
+            print(f"[WARN] Error renovando lease de sesión: {e}")
+            ok = False
+        if not ok:
+            increment_session_lock("lost")
+            print(f"[WARN] Lease de la sesión '{lease.session_id}' perdido; sus escrituras se rechazarán")
+            return
+
+
+async def _acquire(lease: SessionLease, client, wait: float) -> bool:
+    if await asyncio.to_thread(lease.try_acquire, client):
+        return True
+    increment_session_lock("contended")
+    return await lease.acquire_async(client, wait)
+
+
+def _release_abandoned(future: "asyncio.Future", lease: SessionLease, client):
+    if future.cancelled() or future.exception() is not None or not future.result():
+        return
+    asyncio.get_running_loop().run_in_executor(None, lease.release, client)
+
+
+# Fallback sin Redis: un lock por sesión en proceso (se libera solo al quedar sin uso)
+_local_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+@asynccontextmanager
+async def session_lease(session_id: str, deadline=None, ttl_ms: int = SESSION_LEASE_TTL_MS):
+    """
+    Serializa el turno de una sesión entre réplicas. Lanza SessionBusy si no
+    obtiene el lease en SESSION_LOCK_WAIT_SECONDS (o antes de que venza el deadline).
+    """
+    if not SESSION_LOCK_ENABLED or not session_id:
+        yield None
+        return
+    wait = SESSION_LOCK_WAIT_SECONDS if deadline is None else min(SESSION_LOCK_WAIT_SECONDS, max(0.0, deadline.remaining()))
+    start = time.monotonic()
+    client = get_redis()
+    if client is None:
+        lock = _local_locks.get(session_id)
+        if lock is None:
+            lock = _local_locks[session_id] = asyncio.Lock()
+        try:
+            await asyncio.wait_for(lock.acquire(), wait)
+        except asyncio.TimeoutError:
+            increment_session_lock("busy")
+            raise SessionBusy(session_id)
+        observe_session_lock_wait(time.monotonic() - start)
+        try:
+            yield None
+        finally:
+            lock.release()
+        return
+
+    lease = SessionLease(session_id, ttl_ms)
+    acquiring = asyncio.ensure_future(_acquire(lease, client, wait))
+    try:
+        acquired = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # El intento en curso puede obtener el lease después de la cancelación: liberarlo entonces
+        acquiring.add_done_callback(lambda f: _release_abandoned(f, lease, client))
+        raise
+    except Exception as e:
+        # Redis falló a mitad: mejor atender sin lease que no atender
+        print(f"[WARN] Lease de sesión no disponible ({e}); se continúa sin lock")
+        acquired = None
+    if acquired is None:
+        yield None
+        return
+    if not acquired:
+        increment_session_lock("busy")
+        raise SessionBusy(session_id)
+    increment_session_lock("acquired")
+    observe_session_lock_wait(time.monotonic() - start)
+
+    token = _current.set(lease)
+    renewer = asyncio.create_task(_renew_loop(client, lease))
+    try:
+        yield lease
+    finally:
+        renewer.cancel()
+        _current.reset(token)
+        try:
+            # Aunque el request se cancele aquí, el hilo termina de liberar el lease
+            await asyncio.to_thread(lease.release, client)
+        except Exception as e:
+            print(f"[WARN] Error liberando lease de sesión: {e}")
@@ -0,0 +1,74 @@
+"""Segmentación de respuestas en mensajes de tamaño WhatsApp para entrega incremental."""
+
+import os
+import re
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# Tamaño objetivo de cada mensaje enviado al cliente (WhatsApp admite hasta 4096)
+STREAM_SEGMENT_MAX_CHARS = int(os.getenv("STREAM_SEGMENT_MAX_CHARS", "700"))
+# No se emite un segmento más corto que esto salvo al final de la respuesta
+STREAM_SEGMENT_MIN_CHARS = int(os.getenv("STREAM_SEGMENT_MIN_CHARS", "120"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…:])\s+")
+
+
+def _cut_point(text: str, limit: int) -> int:
+    """Mejor punto de corte <= limit: párrafo, luego fin de frase, luego espacio."""
+    window = text[:limit]
+    for sep in ("\n\n", "\n"):
+        pos = window.rfind(sep)
+        if pos >= limit // 3:
+            return pos + len(sep)
+    ends = [m.end() for m in _SENTENCE_END.finditer(window)]
+    if ends and ends[-1] >= limit // 3:
+        return ends[-1]
+    pos = window.rfind(" ")
+    return pos + 1 if pos > 0 else limit
+
+
+def split_segments(text: str, max_chars: int = STREAM_SEGMENT_MAX_CHARS) -> List[str]:
+    """Divide una respuesta completa en segmentos <= max_chars sin partir frases."""
+    text = (text or "").strip()
+    segments = []
+    while len(text) > max_chars:
+        cut = _cut_point(text, max_chars)
+        segments.append(text[:cut].strip())
+        text = text[cut:].lstrip()
+    if text:
+        segments.append(text)
+    return segments
+
+
+class SegmentStreamer:
+    """Acumula texto incremental (tokens) y devuelve segmentos completos en cuanto existen."""
+
+    def __init__(self, min_chars: int = STREAM_SEGMENT_MIN_CHARS, max_chars: int = STREAM_SEGMENT_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self._buffer += chunk or ""
+        out = []
+        while True:
+            if len(self._buffer) >= self.max_chars:
+                cut = _cut_point(self._buffer, self.max_chars)
+            else:
+                # Corte temprano en un salto de párrafo una vez alcanzado el mínimo
+                pos = self._buffer.rfind("\n\n")
+                if pos < self.min_chars:
+                    break
+                cut = pos + 2
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:].lstrip()
+            if segment:
+                out.append(segment)
+        return out
+
+    def flush(self) -> List[str]:
+        rest = split_segments(self._buffer, self.max_chars)
+        self._buffer = ""
+        return rest
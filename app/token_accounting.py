@@ -0,0 +1,85 @@
+"""
+Conteo de tokens con tokenizer cacheado y registro de uso por etapa.
+
+- `count_tokens` usa tiktoken (encoding por modelo, cacheado) y recurre a
+  ~4 caracteres/token si tiktoken no está disponible.
+- `record_usage` publica tokens de prompt/completion/cached por etapa en
+  `LLM_TOKEN_COUNT`, a partir del uso que devuelve el proveedor.
+"""
+
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from app.llm_utils import DEFAULT_MODEL
+from app.metrics.prometheus_metrics import increment_llm_tokens
+
+_CHARS_PER_TOKEN = 4
+_FALLBACK_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model: str = DEFAULT_MODEL) -> Optional[Any]:
+    """Encoding de tiktoken para `model` (se carga una vez por modelo)."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(_FALLBACK_ENCODING)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Tokens de `text`. Cacheado: los prefijos estáticos de los prompts se cuentan una vez."""
+    if not text:
+        return 0
+    enc = get_encoding(model)
+    if enc is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """Recorta `text` a `max_tokens` tokens (en límite de palabra si es posible)."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    enc = get_encoding(model)
+    if enc is None:
+        cut = text[: max_tokens * _CHARS_PER_TOKEN]
+    else:
+        cut = enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+    space = cut.rfind(" ")
+    return (cut[:space] if space > len(cut) // 2 else cut).rstrip() + "…"
+
+
+def usage_from_llm_output(llm_output: Optional[dict]) -> Tuple[int, int, int]:
+    """(prompt, completion, cached) desde `ChatResult.llm_output["token_usage"]` de OpenAI."""
+    usage = (llm_output or {}).get("token_usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return (
+        int(usage.get("prompt_tokens") or 0),
+        int(usage.get("completion_tokens") or 0),
+        int(details.get("cached_tokens") or 0),
+    )
+
+
+def usage_from_metadata(usage_metadata: Optional[dict]) -> Tuple[int, int, int]:
+    """(prompt, completion, cached) desde `AIMessage.usage_metadata` (streaming con stream_usage)."""
+    usage = usage_metadata or {}
+    details = usage.get("input_token_details") or {}
+    return (
+        int(usage.get("input_tokens") or 0),
+        int(usage.get("output_tokens") or 0),
+        int(details.get("cache_read") or 0),
+    )
+
+
+def record_usage(stage: str, model: str, prompt: int, completion: int, cached: int = 0):
+    if prompt:
+        increment_llm_tokens("prompt", model, prompt, stage)
+    if completion:
+        increment_llm_tokens("completion", model, completion, stage)
+    if cached:
+        increment_llm_tokens("cached", model, cached, stage)
@@ -4,9 +4,13 @@ Cada tool maneja una intención específica: productos, pedidos, pagos, etc.
 """
 
 from langchain.tools import BaseTool
-import httpx, os
+import asyncio, httpx, os, re, time
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+from app.deadline import DeadlineExceeded
+from app.traffic_capture import record_downstream, replay_headers
+
 load_dotenv()
 AGENT_PRODUCTS_URL = os.getenv("AGENT_PRODUCTS_URL", "http://agent_product:8000")
 AGENT_SALUDOS_URL = os.getenv("AGENT_SALUDOS_URL", "http://agent_saludos:8000")
@@ -15,11 +19,96 @@ AGENT_OTROS_URL = os.getenv("AGENT_OTROS_URL", "http://agent_otros:8000")
 AGENT_PEDIDOS_URL = os.getenv("AGENT_PEDIDOS_URL", "http://agent_pedidos:8000")
 AGENT_PEDIDOS_MCP_URL = os.getenv("AGENT_PEDIDOS_MCP_URL", os.getenv("MCP_URL", "http://mcp-woo:8000/mcp"))
 
+
+def _call_budget(timeout: float, deadline=None):
+    """(timeout, headers) de la llamada a un agente: acotado por el deadline del request, que viaja en cabecera."""
+    if deadline is None:
+        return timeout, {}
+    return deadline.timeout(timeout), deadline.headers()
+
+
+# "pedido 1234", "orden #1234", "#1234", o solo el número (respuesta a "¿cuál es tu número de pedido?")
+_ORDER_ID_RE = re.compile(
+    r"(?:\b(?:pedido|orden|order|compra)\s*(?:n[úu]mero|nro\.?|n[º°]|no\.?)?\s*#?\s*|#\s*)(\d{2,10})\b",
+    re.IGNORECASE,
+)
+_ONLY_ID_RE = re.compile(r"^\s*#?\s*(\d{2,10})\s*$")
+_STATUS_WORDS_RE = re.compile(r"\b(estado|d[óo]nde|lleg|seguimiento|env[íi]o|enviad|despach|status)", re.IGNORECASE)
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_ORDER_STATUS_ES = {
+    "pending": "pendiente de pago",
+    "processing": "en preparación",
+    "on-hold": "en espera de confirmación del pago",
+    "completed": "completado (ya fue enviado)",
+    "cancelled": "cancelado",
+    "refunded": "reembolsado",
+    "failed": "con un pago fallido",
+}
+
+
+def find_order_id(text: str) -> "int | None":
+    match = _ORDER_ID_RE.search(text or "") or _ONLY_ID_RE.match(text or "")
+    return int(match.group(1)) if match else None
+
+
+def _digits(value) -> str:
+    return re.sub(r"\D", "", str(value or ""))
+
+
+def _owns_order(order: dict, text: str, session_id: str = None) -> bool:
+    """El pedido es de quien pregunta: teléfono de la sesión (WhatsApp) o el correo de la compra en el mensaje."""
+    billing = order.get("billing") or {}
+    phone, session = _digits(billing.get("phone")), _digits(session_id)
+    if len(phone) >= 8 and len(session) >= 8 and phone[-8:] == session[-8:]:
+        return True
+    email = (billing.get("email") or "").lower()
+    return bool(email) and email in {m.lower() for m in _EMAIL_RE.findall(text or "")}
+
+
+async def order_status_reply(text: str, session_id: str = None, deadline=None) -> "str | None":
+    """
+    Estado de un pedido mencionado en el mensaje, desde la caché read-through de
+    WooCommerce (app/tools/woo_async.py). None si no hay número de pedido o
+    WooCommerce no está configurado: el llamador sigue con su camino habitual.
+    """
+    from app.tools.woo_async import WOO_TIMEOUT, get_async_woo, woo_configured
+
+    order_id = find_order_id(text)
+    if order_id is None or not woo_configured():
+        return None
+    timeout, _ = _call_budget(WOO_TIMEOUT, deadline)
+    try:
+        order = await asyncio.wait_for(get_async_woo().get_order(order_id), timeout)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 404:
+            raise
+        order = None
+    if not order or not _owns_order(order, text, session_id):
+        # Inexistente o ajeno: misma respuesta, no se revela si el pedido existe
+        if _EMAIL_RE.search(text or ""):
+            return f"No encontré un pedido #{order_id} asociado a ese correo. ¿Podrías revisar los datos?"
+        return f"Para consultar el pedido #{order_id}, indícame el correo con el que hiciste la compra."
+    status = _ORDER_STATUS_ES.get(order.get("status"), order.get("status") or "sin estado")
+    return f"Tu pedido #{order_id} está {status}."
+
+
+async def _post_agent(url: str, payload: dict, timeout: float, headers: dict) -> dict:
+    """POST a un agente; la respuesta queda en la captura de tráfico (si hay) para el replay."""
+    headers = {**headers, **replay_headers()}
+    start = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(url, json=payload, headers=headers, timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+    record_downstream("agent", urlparse(url).path, time.perf_counter() - start, data)
+    return data
+
+
 class ProductsTool(BaseTool):
     name: str = "products_search"
     description: str = "Busca y consulta productos disponibles. Úsalo para preguntas sobre catálogo, precios o disponibilidad de productos."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         # Include the MCP URL inside the text so the pedidos agent's LLM sees it,
         # and also include the field for completeness.
         payload = {"text": f"{query}\n\nMCP_URL: {AGENT_PEDIDOS_MCP_URL}", "mcp_url": AGENT_PEDIDOS_MCP_URL}
@@ -29,134 +118,129 @@ class ProductsTool(BaseTool):
             payload["context_summary"] = context_summary
         # Do NOT send MCP API key from the orchestrator; the pedidos agent should
         # read its own `MCP_API_KEY` from its environment for security.
-        async with httpx.AsyncClient() as client:
-            try:
-                resp = await client.post(
-                    f"{AGENT_PRODUCTS_URL}/products_agent_search",
-                    json=payload,
-                    timeout=60.0
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return data.get("result", "No se encontraron productos.")
-            except Exception as e:
-                print(f"[ERROR] Failed to connect to products agent: {e}")
-                return f"Error conectando con agente productos: {e}"
+        timeout, headers = _call_budget(60.0, deadline)
+        try:
+            data = await _post_agent(f"{AGENT_PRODUCTS_URL}/products_agent_search", payload, timeout, headers)
+            return data.get("result", "No se encontraron productos.")
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to products agent: {e}")
+            return f"Error conectando con agente productos: {e}"
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 class OrdersTool(BaseTool):
     name: str = "orders_management"
     description: str = "Maneja pedidos y órdenes. Úsalo para crear, consultar o gestionar pedidos."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         payload = {"text": query}
         if session_id:
             payload["session_id"] = session_id
         if context_summary:
             payload["context_summary"] = context_summary
-        async with httpx.AsyncClient() as client:
+        # Consulta de estado con número de pedido: sale de la caché de WooCommerce, sin pasar por el agente
+        if _STATUS_WORDS_RE.search(query or ""):
             try:
-                resp = await client.post(
-                    f"{AGENT_PEDIDOS_URL}/products_agent_search",
-                    json=payload,
-                    timeout=15.0,
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return data.get("result", "No response from orders agent.")
+                reply = await order_status_reply(query, session_id, deadline)
+                if reply is not None:
+                    return reply
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"[ERROR] Failed to connect to orders agent: {e}")
-                return f"Error conectando con agente pedidos: {e}"
+                print(f"[WARN] Consulta de estado de pedido falló ({e}); se pregunta al agente de pedidos")
+        timeout, headers = _call_budget(15.0, deadline)
+        try:
+            data = await _post_agent(f"{AGENT_PEDIDOS_URL}/products_agent_search", payload, timeout, headers)
+            return data.get("result", "No response from orders agent.")
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to orders agent: {e}")
+            return f"Error conectando con agente pedidos: {e}"
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 class KnowledgeTool(BaseTool):
     name: str = "general_queries"
     description: str = "Maneja consultas generales como tallas, envíos, tienda física, etc."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         payload = {"text": query}
         if session_id:
             payload["session_id"] = session_id
         if context_summary:
             payload["context_summary"] = context_summary
-        async with httpx.AsyncClient() as client:
-            try:
-                resp = await client.post(
-                    f"{AGENT_OTROS_URL}/knowledge_agent_search",
-                    json=payload,
-                    timeout=10.0
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return data.get("result", "No se encontraron respuestas.")
-            except Exception as e:
-                print(f"[ERROR] Failed to connect to otros agent: {e}")
-                return f"Error conectando con agente otros: {e}"
+        timeout, headers = _call_budget(10.0, deadline)
+        try:
+            data = await _post_agent(f"{AGENT_OTROS_URL}/knowledge_agent_search", payload, timeout, headers)
+            return data.get("result", "No se encontraron respuestas.")
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to otros agent: {e}")
+            return f"Error conectando con agente otros: {e}"
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 class GreetingTool(BaseTool):
     name: str = "greetings"
     description: str = "Maneja saludos y conversaciones iniciales."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         payload = {"text": query}
         if session_id:
             payload["session_id"] = session_id
         if context_summary:
             payload["context_summary"] = context_summary
-        async with httpx.AsyncClient() as client:
-            try:
-                resp = await client.post(
-                    f"{AGENT_SALUDOS_URL}/greeting_agent",
-                    json=payload,
-                    timeout=10.0
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return data.get("result", "No se encontraron saludos.")
-            except Exception as e:
-                print(f"[ERROR] Failed to connect to Greetings agent: {e}")
-                return f"Error conectando con agente saludos: {e}"
+        timeout, headers = _call_budget(10.0, deadline)
+        try:
+            data = await _post_agent(f"{AGENT_SALUDOS_URL}/greeting_agent", payload, timeout, headers)
+            return data.get("result", "No se encontraron saludos.")
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to Greetings agent: {e}")
+            return f"Error conectando con agente saludos: {e}"
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 class TrackingTool(BaseTool):
     name: str = "order_tracking"
     description: str = "Maneja seguimiento de pedidos."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
+        try:
+            reply = await order_status_reply(query, session_id, deadline)
+            if reply is not None:
+                return reply
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[WARN] Consulta de estado de pedido falló: {e}")
+            return "No pude consultar el pedido en este momento. Por favor intenta de nuevo en unos minutos."
         return "Si quieres revisar un pedido, por favor proporciona el número de pedido o el correo asociado."
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 class HumanTool(BaseTool):
     name: str = "human_transfer"
     description: str = "Transfiere a un humano cuando el usuario lo solicita o hay problemas."
 
-    async def _arun(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    async def _arun(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         return "Te transferiré a un agente humano. Por favor espera un momento."
 
-    def _run(self, query: str, session_id: str = None, context_summary: str = None) -> str:
+    def _run(self, query: str, session_id: str = None, context_summary: str = None, deadline=None) -> str:
         import asyncio
-        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary))
+        return asyncio.run(self._arun(query, session_id=session_id, context_summary=context_summary, deadline=deadline))
 
 
 # Instancias de tools
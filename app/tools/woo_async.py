@@ -0,0 +1,252 @@
+"""
+Cliente WooCommerce asíncrono sobre un pool httpx compartido.
+
+- Reintentos con backoff exponencial + jitter (respeta Retry-After en 429/503).
+- Lecturas por lote concurrentes (`include=` en trozos de 100 ids).
+- Caché read-through para productos (TTL largo) y pedidos (TTL corto),
+  invalidada/actualizada por los webhooks de WooCommerce.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import random
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from langchain.tools import tool
+
+from app.cache import LRUCache, get_redis
+from app.codec import decode, encode
+from app.metrics.prometheus_metrics import increment_woo_cache
+
+load_dotenv()
+WOO_ORDER_TTL = int(os.getenv("WOO_ORDER_TTL", "30"))
+WOO_PRODUCT_TTL = int(os.getenv("WOO_PRODUCT_TTL", "600"))
+WOO_MAX_CONNECTIONS = int(os.getenv("WOO_MAX_CONNECTIONS", "20"))
+WOO_TIMEOUT = float(os.getenv("WOO_TIMEOUT", "10"))
+WOO_MAX_RETRIES = int(os.getenv("WOO_MAX_RETRIES", "3"))
+WC_WEBHOOK_SECRET = os.getenv("WC_WEBHOOK_SECRET", "")
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+_BATCH = 100  # máximo per_page de la API de WooCommerce
+_TTL = {"order": WOO_ORDER_TTL, "product": WOO_PRODUCT_TTL}
+
+
+class AsyncWooClient:
+    def __init__(self, url: str, consumer_key: str, consumer_secret: str):
+        self.base_url = url.rstrip("/") + "/wp-json/wc/v3/"
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            auth=(consumer_key, consumer_secret),
+            timeout=WOO_TIMEOUT,
+            limits=httpx.Limits(max_connections=WOO_MAX_CONNECTIONS, max_keepalive_connections=WOO_MAX_CONNECTIONS),
+        )
+        self._cache = {kind: LRUCache(maxsize=5000, ttl=ttl) for kind, ttl in _TTL.items()}
+
+    @classmethod
+    def from_env(cls) -> "AsyncWooClient":
+        url = os.getenv("WC_URL")
+        key = os.getenv("WC_KEY")
+        secret = os.getenv("WC_SECRET")
+        if not url or not key or not secret:
+            raise RuntimeError("WC_URL, WC_KEY y WC_SECRET deben estar configurados en el entorno.")
+        return cls(url, key, secret)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    # ---------- HTTP con reintentos ----------
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        last_error: Optional[Exception] = None
+        for attempt in range(WOO_MAX_RETRIES + 1):
+            try:
+                resp = await self._http.request(method, path, **kwargs)
+                if resp.status_code not in _RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp.json()
+                last_error = RuntimeError(f"WooCommerce {resp.status_code} en {path}")
+                retry_after = resp.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else None
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                last_error = e
+                delay = None
+            if attempt == WOO_MAX_RETRIES:
+                break
+            delay = delay if delay is not None else min(8.0, 0.25 * 2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        raise RuntimeError(f"Error consultando WooCommerce ({path}): {last_error}")
+
+    # ---------- caché ----------
+    # La memoria se lee en el loop; Redis (cliente síncrono) va en un hilo para no frenar el loop.
+    def _redis_get(self, kind: str, obj_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        client = get_redis()
+        if client is None or not obj_ids:
+            return {}
+        try:
+            raw = client.mget([f"woo:{kind}:{obj_id}" for obj_id in obj_ids])
+            return {obj_id: decode(r, "woo") for obj_id, r in zip(obj_ids, raw) if r}
+        except Exception as e:
+            print(f"[WARN] Error leyendo caché WooCommerce: {e}")
+            return {}
+
+    def _redis_put(self, kind: str, objs: List[Dict[str, Any]]):
+        client = get_redis()
+        if client is None or not objs:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for obj in objs:
+                pipe.set(f"woo:{kind}:{int(obj['id'])}", encode(obj), ex=_TTL[kind])
+            pipe.execute()
+        except Exception as e:
+            print(f"[WARN] Error guardando caché WooCommerce: {e}")
+
+    async def _cache_get_many(self, kind: str, obj_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        found: Dict[int, Dict[str, Any]] = {}
+        for obj_id in obj_ids:
+            value = self._cache[kind].get(obj_id)
+            if value is not None:
+                increment_woo_cache(kind, "memory_hit")
+                found[obj_id] = value
+        missing = [obj_id for obj_id in obj_ids if obj_id not in found]
+        if missing:
+            remote = await asyncio.to_thread(self._redis_get, kind, missing)
+            for obj_id in missing:
+                value = remote.get(obj_id)
+                if value is not None:
+                    self._cache[kind].set(obj_id, value)
+                    increment_woo_cache(kind, "redis_hit")
+                    found[obj_id] = value
+                else:
+                    increment_woo_cache(kind, "miss")
+        return found
+
+    async def _cache_put_many(self, kind: str, objs: List[Dict[str, Any]]):
+        for obj in objs:
+            self._cache[kind].set(int(obj["id"]), obj)
+        await asyncio.to_thread(self._redis_put, kind, objs)
+
+    def cache_put(self, kind: str, obj: Dict[str, Any]):
+        """Versión síncrona (webhooks, que ya corren fuera del loop)."""
+        self._cache[kind].set(int(obj["id"]), obj)
+        self._redis_put(kind, [obj])
+
+    def invalidate(self, kind: str, obj_id: int):
+        self._cache[kind].delete(int(obj_id))
+        client = get_redis()
+        if client is not None:
+            try:
+                client.delete(f"woo:{kind}:{int(obj_id)}")
+            except Exception as e:
+                print(f"[WARN] Error invalidando caché WooCommerce: {e}")
+
+    # ---------- lecturas ----------
+    async def _get_many(self, kind: str, endpoint: str, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        found = await self._cache_get_many(kind, ids)
+        missing = [obj_id for obj_id in ids if obj_id not in found]
+        if missing:
+            chunks = [missing[i:i + _BATCH] for i in range(0, len(missing), _BATCH)]
+            results = await asyncio.gather(*[
+                self._request("GET", endpoint, params={"include": ",".join(map(str, chunk)), "per_page": len(chunk)})
+                for chunk in chunks
+            ])
+            fetched = [obj for items in results for obj in items]
+            await self._cache_put_many(kind, fetched)
+            for obj in fetched:
+                found[int(obj["id"])] = obj
+        return found
+
+    async def _get_one(self, kind: str, endpoint: str, obj_id: int) -> Optional[Dict[str, Any]]:
+        cached = (await self._cache_get_many(kind, [int(obj_id)])).get(int(obj_id))
+        if cached is not None:
+            return cached
+        obj = await self._request("GET", f"{endpoint}/{int(obj_id)}")
+        await self._cache_put_many(kind, [obj])
+        return obj
+
+    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return await self._get_one("order", "orders", order_id)
+
+    async def get_product(self, product_id: int) -> Optional[Dict[str, Any]]:
+        return await self._get_one("product", "products", product_id)
+
+    async def get_orders(self, order_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        return await self._get_many("order", "orders", order_ids)
+
+    async def get_products(self, product_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        return await self._get_many("product", "products", product_ids)
+
+    async def create_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        order = await self._request("POST", "orders", json=order_data)
+        await self._cache_put_many("order", [order])
+        return order
+
+
+_client: Optional[AsyncWooClient] = None
+
+
+def woo_configured() -> bool:
+    return all(os.getenv(name) for name in ("WC_URL", "WC_KEY", "WC_SECRET"))
+
+
+def get_async_woo() -> AsyncWooClient:
+    """Cliente compartido por proceso (un único pool de conexiones)."""
+    global _client
+    if _client is None:
+        _client = AsyncWooClient.from_env()
+    return _client
+
+
+async def close_async_woo():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# ==========================
+# Webhooks de WooCommerce
+# ==========================
+def verify_webhook_signature(body: bytes, signature: Optional[str]) -> bool:
+    """X-WC-Webhook-Signature = base64(HMAC-SHA256(secret, body)). Sin WC_WEBHOOK_SECRET no se acepta nada."""
+    if not WC_WEBHOOK_SECRET or not signature:
+        return False
+    digest = hmac.new(WC_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode("ascii"), signature)
+
+
+def handle_webhook(topic: str, payload: Dict[str, Any]) -> str:
+    """
+    Aplica un webhook (`order.updated`, `product.deleted`, ...) a la caché.
+    Creaciones/actualizaciones traen el recurso completo: se escribe en caché
+    (write-through); borrados lo invalidan. Bloqueante (Redis): llamar fuera del loop.
+    """
+    kind, _, action = (topic or "").partition(".")
+    if kind not in _TTL or "id" not in payload:
+        return "ignored"
+    client = get_async_woo()
+    if action in ("created", "updated", "restored") and payload.get("status") != "trash":
+        client.cache_put(kind, payload)
+        return "updated"
+    client.invalidate(kind, payload["id"])
+    return "invalidated"
+
+
+# ==========================
+# Tools asíncronas para el grafo
+# ==========================
+@tool
+async def woo_get_order(order_id: int) -> Dict[str, Any]:
+    """Recupera un pedido de WooCommerce por ID (estado, items, envío)."""
+    return await get_async_woo().get_order(order_id)
+
+
+@tool
+async def woo_get_product(product_id: int) -> Dict[str, Any]:
+    """Recupera un producto de WooCommerce por ID (precio, stock, atributos)."""
+    return await get_async_woo().get_product(product_id)
@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 
 try:
@@ -38,6 +38,42 @@ class WooClient:
         if not url or not key or not secret:
             raise RuntimeError("WC_URL, WC_KEY y WC_SECRET deben estar configurados en el entorno.")
         return cls(url=url, consumer_key=key, consumer_secret=secret)
+
+    def list_products(
+        self,
+        page: int = 1,
+        per_page: int = 100,
+        modified_after: Optional[str] = None,
+        status: str = "any",
+        fields: Optional[List[str]] = None,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Lista una página de productos. Retorna (productos, total_de_páginas).
+        `modified_after` es ISO8601 en GMT (requiere WooCommerce >= 5.8).
+        """
+        params: Dict[str, Any] = {"page": page, "per_page": per_page, "status": status, "orderby": "id", "order": "asc"}
+        if modified_after:
+            params["modified_after"] = modified_after
+            params["dates_are_gmt"] = "true"
+        if fields:
+            params["_fields"] = ",".join(fields)
+        try:
+            resp = self.client.get("products", params=params)
+            resp.raise_for_status()
+            total_pages = int(resp.headers.get("X-WP-TotalPages", "1") or 1)
+            return resp.json(), total_pages
+        except Exception as e:
+            raise RuntimeError(f"Error listando productos (página {page}): {e}")
+
+    def iter_products(self, per_page: int = 100, **kwargs) -> Iterator[List[Dict[str, Any]]]:
+        """Itera página a página sobre los productos (streaming, sin cargar todo el catálogo)."""
+        page, total_pages = 1, 1
+        while page <= total_pages:
+            items, total_pages = self.list_products(page=page, per_page=per_page, **kwargs)
+            if not items:
+                break
+            yield items
+            page += 1
+
     @tool
     def create_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
         """Crea una orden en WooCommerce. order_data debe seguir la API de WC.
@@ -0,0 +1,290 @@
+"""
+Captura de tráfico de /webhook para reproducirlo después (scripts/replay_traffic.py).
+
+Con CAPTURE_ENABLED cada request (muestreado con CAPTURE_SAMPLE_RATE) se
+escribe como una línea JSON en CAPTURE_DIR/capture-*.jsonl (rotando al pasar
+CAPTURE_MAX_FILE_MB), ya saneado:
+- session_id -> HMAC-SHA256 con CAPTURE_SALT (estable: la misma sesión
+  conserva el mismo id entre requests, pero no es reversible). Sin
+  CAPTURE_SALT se genera una sal aleatoria y se persiste en CAPTURE_DIR/.salt:
+  nunca se hashea con sal vacía (un id de WhatsApp se recuperaría por fuerza bruta),
+- emails y números largos (del texto y de las respuestas grabadas) -> marcadores,
+- media -> sha256 + tamaño + mimetype (los bytes solo se guardan, en
+  CAPTURE_DIR/media/<sha256>, si CAPTURE_MEDIA=true),
+- marca de llegada (epoch) y latencia total,
+- respuestas downstream (agentes HTTP y LLM) con su latencia, en orden, para
+  que los stubs del replay las devuelvan igual.
+
+La captura del request en curso viaja en un contextvar (como el deadline y el
+lease), así los agentes y el LLM la encuentran sin cambiar firmas.
+
+Con REPLAY_MODE (solo en la instancia local del replay) el id de la cabecera
+X-Replay-Id se reenvía a agentes y LLM (X-Replay-Id / X-Replay-Stage), y los
+stubs responden lo grabado para ese request.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() in ("1", "true", "yes")
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "data/capture")
+CAPTURE_MAX_FILE_MB = float(os.getenv("CAPTURE_MAX_FILE_MB", "50"))
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
+CAPTURE_MEDIA = os.getenv("CAPTURE_MEDIA", "false").lower() in ("1", "true", "yes")
+REPLAY_MODE = os.getenv("REPLAY_MODE", "false").lower() in ("1", "true", "yes")
+REPLAY_HEADER = "X-Replay-Id"
+REPLAY_STAGE_HEADER = "X-Replay-Stage"
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+_LONG_NUMBER_RE = re.compile(r"\d[\d .-]{5,}\d")
+
+
+_salt: Optional[bytes] = None
+_salt_lock = threading.Lock()
+
+
+def _load_salt() -> bytes:
+    """CAPTURE_SALT, o la sal persistida en CAPTURE_DIR/.salt (se crea la primera vez)."""
+    if CAPTURE_SALT:
+        return CAPTURE_SALT.encode("utf-8")
+    path = os.path.join(CAPTURE_DIR, ".salt")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            salt = f.read().strip()
+        if salt:
+            return salt.encode("utf-8")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"[WARN] No se pudo leer {path}: {e}")
+    salt = secrets.token_hex(32)
+    try:
+        os.makedirs(CAPTURE_DIR, exist_ok=True)
+        # O_EXCL: si otro worker la creó primero, se usa la suya
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(salt)
+        print(f"[INFO] CAPTURE_SALT vacío: sal aleatoria generada en {path}")
+    except FileExistsError:
+        with open(path, "r", encoding="utf-8") as f:
+            salt = f.read().strip() or salt
+    except OSError as e:
+        # Sin disco: la sal vive solo en este proceso (ids estables hasta reiniciar)
+        print(f"[WARN] No se pudo persistir la sal en {path} ({e}); se usa una sal solo en memoria")
+    return salt.encode("utf-8")
+
+
+def hash_session(session_id: str) -> str:
+    global _salt
+    if _salt is None:
+        with _salt_lock:
+            if _salt is None:
+                _salt = _load_salt()
+    return hmac.new(_salt, session_id.encode("utf-8"), hashlib.sha256).hexdigest()[:24]
+
+
+def redact(text: Optional[str]) -> Optional[str]:
+    """Emails -> user@example.com; números largos (teléfonos, documentos, tarjetas) -> ceros del mismo largo."""
+    if not text:
+        return text
+    text = _EMAIL_RE.sub("user@example.com", text)
+    return _LONG_NUMBER_RE.sub(lambda m: re.sub(r"\d", "0", m.group(0)), text)
+
+
+def _redact_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {k: _redact_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(v) for v in value]
+    return value
+
+
+class Capture:
+    def __init__(self, endpoint: str, session_id: str, replay_id: Optional[str] = None, recording: bool = True):
+        self.id = uuid.uuid4().hex
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        self.endpoint = endpoint
+        self.session = hash_session(session_id)
+        # Request que se está reproduciendo (REPLAY_MODE); se reenvía a los stubs
+        self.replay_id = replay_id
+        self.recording = recording
+        self.request: Dict[str, Any] = {}
+        self.downstream: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, target: str, latency: float, response: Any):
+        with self._lock:
+            self.downstream.append({"kind": kind, "target": target, "latency": round(latency, 4), "response": response})
+
+    def to_dict(self, status: int) -> Dict[str, Any]:
+        return {
+            "v": 1,
+            "id": self.id,
+            "ts": round(self.ts, 4),
+            "endpoint": self.endpoint,
+            "session": self.session,
+            **self.request,
+            "status": status,
+            "latency": round(time.perf_counter() - self.start, 4),
+            "downstream": self.downstream,
+        }
+
+
+_current: ContextVar[Optional[Capture]] = ContextVar("traffic_capture", default=None)
+
+
+def current_capture() -> Optional[Capture]:
+    return _current.get()
+
+
+def start_capture(request: Any, msg: Any, media: Optional[bytes]):
+    """
+    Abre la captura del request (si está habilitada y cae en la muestra, o si es
+    un replay). Devuelve (captura, token del contextvar) o (None, None).
+    """
+    replay_id = request.headers.get(REPLAY_HEADER) if REPLAY_MODE else None
+    recording = CAPTURE_ENABLED and random.random() < CAPTURE_SAMPLE_RATE
+    if not recording and not replay_id:
+        return None, None
+    capture = Capture(request.url.path, msg.session_id, replay_id, recording)
+    if recording:
+        query = {k: v for k, v in request.query_params.items()}
+        capture.request = {"query": query, "mimetype": msg.mimetype, "filename_ext": os.path.splitext(msg.filename or "")[1]}
+        if media is not None:
+            capture.request["media"] = _media_ref(media, msg.mimetype)
+        elif msg.media_url:
+            capture.request["media"] = {"url_host": _host(msg.media_url), "mimetype": msg.mimetype}
+        elif msg.mimetype == "text" or msg.mimetype.startswith("text/"):
+            capture.request["text"] = redact(msg.text)
+        else:
+            # Media en base64 dentro del JSON (formato anterior)
+            capture.request["media"] = {"base64_chars": len(msg.text or ""), "mimetype": msg.mimetype}
+    return capture, _current.set(capture)
+
+
+def set_processed_text(capture: Optional[Capture], processed_text: str):
+    """Texto resultante de transcripción/OCR: el replay lo envía si no tiene los bytes del media."""
+    if capture is not None and capture.recording and "media" in capture.request:
+        capture.request["processed_text"] = redact(processed_text)
+
+
+def _media_ref(media: bytes, mimetype: str) -> Dict[str, Any]:
+    digest = hashlib.sha256(media).hexdigest()
+    if CAPTURE_MEDIA:
+        path = os.path.join(CAPTURE_DIR, "media", digest)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(media)
+            except OSError as e:
+                print(f"[WARN] No se pudo guardar el media capturado: {e}")
+    return {"sha256": digest, "bytes": len(media), "mimetype": mimetype}
+
+
+def _host(url: str) -> str:
+    from urllib.parse import urlparse
+
+    return urlparse(url).hostname or ""
+
+
+def record_downstream(kind: str, target: str, latency: float, response: Any):
+    """Respuesta de un agente (`kind="agent"`, target = path) o del LLM (`kind="llm"`, target = etapa)."""
+    capture = _current.get()
+    if capture is not None and capture.recording:
+        capture.add(kind, target, latency, _redact_value(response))
+
+
+def replay_headers(stage: Optional[str] = None) -> Dict[str, str]:
+    """Cabeceras para que los stubs del replay identifiquen el request (vacío fuera de REPLAY_MODE)."""
+    capture = _current.get()
+    if capture is None or not capture.replay_id:
+        return {}
+    headers = {REPLAY_HEADER: capture.replay_id}
+    if stage:
+        headers[REPLAY_STAGE_HEADER] = stage
+    return headers
+
+
+class _RotatingWriter:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self._size = 0
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None or self._size >= self.max_bytes:
+                if self._file is not None:
+                    self._file.close()
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line.encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_writer: Optional[_RotatingWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _RotatingWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _RotatingWriter(CAPTURE_DIR, int(CAPTURE_MAX_FILE_MB * 1024 * 1024))
+        return _writer
+
+
+def finish_capture(capture: Optional[Capture], token, status: int):
+    """Cierra la captura: resetea el contextvar y escribe la línea (si se está grabando)."""
+    if capture is None:
+        return
+    if token is not None:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Se cerró desde otro contexto (generador del stream): basta con no dejarla activa
+            _current.set(None)
+    if not capture.recording:
+        return
+    try:
+        _get_writer().write(capture.to_dict(status))
+    except Exception as e:
+        print(f"[WARN] No se pudo escribir la captura de tráfico: {e}")
+
+
+def close_capture():
+    if _writer is not None:
+        _writer.close()
@@ -0,0 +1,288 @@
+"""
+Motores de transcripción de notas de voz.
+
+- `openai`: Whisper por API; sube el audio preprocesado (app/audio_prep.py),
+  troceado y en paralelo si es largo.
+- `local`: faster-whisper (CTranslate2, int8) en CPU dentro de un pool de
+  procesos; cada proceso carga el modelo una vez y lo mantiene residente.
+  Sin red si LOCAL_WHISPER_MODEL apunta a un directorio local.
+- `auto`: local para notas cortas (voz <= TRANSCRIPTION_LOCAL_MAX_SECONDS),
+  OpenAI para el resto o si el motor local no está disponible.
+
+Si el motor elegido falla y TRANSCRIPTION_FALLBACK está activo, se reintenta
+con OpenAI. Se pueden registrar otros motores con `register_engine`.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.audio_prep import AUDIO_PARALLEL, TrimmedAudio, prepare_audio, trim_audio
+from app.metrics.prometheus_metrics import increment_transcription, observe_transcription_latency
+
+load_dotenv()
+TRANSCRIPTION_ENGINE = os.getenv("TRANSCRIPTION_ENGINE", "openai").lower()
+TRANSCRIPTION_LOCAL_MAX_SECONDS = float(os.getenv("TRANSCRIPTION_LOCAL_MAX_SECONDS", "30"))
+TRANSCRIPTION_FALLBACK = os.getenv("TRANSCRIPTION_FALLBACK", "true").lower() in ("1", "true", "yes")
+TRANSCRIPTION_LANGUAGE = os.getenv("TRANSCRIPTION_LANGUAGE", "es") or None
+OPENAI_TRANSCRIPTION_MODEL = os.getenv("OPENAI_TRANSCRIPTION_MODEL", "whisper-1")
+# Nombre de modelo (se descarga una vez) o ruta a un modelo CTranslate2 convertido (offline)
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", "1"))
+# Por defecto: los núcleos repartidos entre los workers
+LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS") or max(1, (os.cpu_count() or 2) // max(1, LOCAL_WHISPER_WORKERS)))
+LOCAL_WHISPER_BEAM_SIZE = int(os.getenv("LOCAL_WHISPER_BEAM_SIZE", "1"))
+LOCAL_WHISPER_TIMEOUT = float(os.getenv("LOCAL_WHISPER_TIMEOUT", "30"))
+
+EMPTY_TRANSCRIPT = "Error: No se pudo transcribir el audio. Intente nuevamente."
+NO_SPEECH = "Error: No se detectó voz en el audio. Intente nuevamente."
+
+
+class TranscriptionEngine:
+    """Interfaz de un motor: `transcribe` devuelve el texto o lanza excepción."""
+
+    name = ""
+
+    def available(self) -> bool:
+        return True
+
+    def warm_up(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def transcribe(self, data: bytes, filename: str, trimmed: Optional[TrimmedAudio]) -> str:
+        raise NotImplementedError
+
+
+class OpenAIEngine(TranscriptionEngine):
+    name = "openai"
+
+    def transcribe(self, data: bytes, filename: str, trimmed: Optional[TrimmedAudio]) -> str:
+        import openai  # import diferido (arranque rápido)
+        from app.llm_scheduler import get_scheduler
+
+        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Recorte de silencios, mono 16 kHz, Opus compacto y trozos (o el original si no se puede)
+        prepared = prepare_audio(data, filename, trimmed)
+
+        def _transcribe_chunk(chunk):
+            chunk_data, name = chunk
+
+            def _call():
+                # Los bytes se suben directamente (sin copia a archivo temporal)
+                return client.audio.transcriptions.create(
+                    model=OPENAI_TRANSCRIPTION_MODEL,
+                    file=(name, chunk_data),
+                    language=TRANSCRIPTION_LANGUAGE or openai.NOT_GIVEN,
+                    response_format="text"
+                )
+
+            # ~1 token por cada 100 bytes de audio como estimación para el bucket TPM
+            return get_scheduler().run(_call, "media", est_tokens=max(1, len(chunk_data) // 100), model=OPENAI_TRANSCRIPTION_MODEL)
+
+        if len(prepared.chunks) == 1:
+            transcript = _transcribe_chunk(prepared.chunks[0])
+        else:
+            import contextvars
+            from concurrent.futures import ThreadPoolExecutor
+
+            # Trozos en paralelo; cada hilo hereda el contexto del request (contextvars)
+            with ThreadPoolExecutor(max_workers=max(1, min(AUDIO_PARALLEL, len(prepared.chunks)))) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, _transcribe_chunk, c) for c in prepared.chunks]
+                parts = [f.result() for f in futures]
+            transcript = " ".join(p.strip() for p in parts if p and p.strip())
+        print(f"[INFO] Audio: {prepared.raw_bytes} -> {prepared.uploaded_bytes} bytes subidos en {len(prepared.chunks)} trozo(s)")
+        return transcript
+
+
+# ---------- motor local (procesos worker) ----------
+_worker_model = None
+
+
+def _init_worker(model: str, compute_type: str, cpu_threads: int):
+    global _worker_model
+    from faster_whisper import WhisperModel
+
+    _worker_model = WhisperModel(model, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+
+def _worker_ready() -> bool:
+    return _worker_model is not None
+
+
+def _worker_transcribe(audio, language: Optional[str], beam_size: int) -> str:
+    # `audio`: float32 mono 16 kHz, o bytes de un archivo (faster-whisper lo decodifica con PyAV)
+    if isinstance(audio, (bytes, bytearray)):
+        audio = io.BytesIO(audio)
+    segments, _info = _worker_model.transcribe(
+        audio, language=language, beam_size=beam_size, condition_on_previous_text=False,
+    )
+    return " ".join(s.text.strip() for s in segments).strip()
+
+
+class LocalWhisperEngine(TranscriptionEngine):
+    name = "local"
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._installed: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._installed is None:
+            import importlib.util
+
+            self._installed = importlib.util.find_spec("faster_whisper") is not None
+            if not self._installed:
+                print("[WARN] faster-whisper no está instalado; motor de transcripción local no disponible")
+        return self._installed
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: no heredar hilos/sockets del servidor; el modelo se carga en el initializer
+                self._pool = ProcessPoolExecutor(
+                    max_workers=LOCAL_WHISPER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_CPU_THREADS),
+                )
+            return self._pool
+
+    def warm_up(self):
+        """Arranca los workers y carga el modelo antes del primer request."""
+        if not self.available():
+            return
+        pool = self._get_pool()
+        futures = [pool.submit(_worker_ready) for _ in range(LOCAL_WHISPER_WORKERS)]
+        try:
+            for f in futures:
+                f.result()
+        except BrokenProcessPool as e:
+            # El modelo no carga (ruta inválida, sin red para descargarlo): no reintentar en cada nota
+            print(f"[WARN] No se pudo cargar el modelo local '{LOCAL_WHISPER_MODEL}' ({e}); motor local deshabilitado")
+            self._installed = False
+            self.shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _recycle(self, pool: ProcessPoolExecutor):
+        """
+        Mata los workers de `pool` y lo descarta: un job vencido no se puede
+        cancelar y seguiría ocupando el worker (y CPU) hasta terminar. Los demás
+        jobs de ese pool fallan con BrokenProcessPool y caen a OpenAI.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # Sin API pública para terminar workers antes de 3.14
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                process.terminate()
+            except Exception as e:
+                print(f"[WARN] No se pudo terminar un worker de transcripción: {e}")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def transcribe(self, data: bytes, filename: str, trimmed: Optional[TrimmedAudio]) -> str:
+        audio = data if trimmed is None else trimmed.pcm.astype("float32") / 32768.0
+        pool = self._get_pool()
+        try:
+            future = pool.submit(_worker_transcribe, audio, TRANSCRIPTION_LANGUAGE, LOCAL_WHISPER_BEAM_SIZE)
+            return future.result(timeout=LOCAL_WHISPER_TIMEOUT)
+        except FutureTimeout:
+            # El próximo request levanta un pool nuevo (y vuelve a cargar el modelo)
+            print(f"[WARN] Transcripción local superó {LOCAL_WHISPER_TIMEOUT}s; se reinicia el pool de workers")
+            self._recycle(pool)
+            raise
+        except BrokenProcessPool:
+            # Un worker murió (OOM, crash nativo): el próximo request levanta un pool nuevo
+            self._recycle(pool)
+            raise
+
+
+_ENGINES: Dict[str, TranscriptionEngine] = {}
+
+
+def register_engine(engine: TranscriptionEngine):
+    _ENGINES[engine.name] = engine
+
+
+def get_engine(name: str) -> Optional[TranscriptionEngine]:
+    return _ENGINES.get(name)
+
+
+register_engine(OpenAIEngine())
+register_engine(LocalWhisperEngine())
+
+
+def select_engine(trimmed: Optional[TrimmedAudio], mode: Optional[str] = None) -> TranscriptionEngine:
+    """Motor para este audio según TRANSCRIPTION_ENGINE (openai | local | auto)."""
+    mode = (mode or TRANSCRIPTION_ENGINE).lower()
+    if mode == "auto":
+        local = get_engine("local")
+        if trimmed is not None and trimmed.speech_seconds <= TRANSCRIPTION_LOCAL_MAX_SECONDS and local.available():
+            return local
+        return get_engine("openai")
+    engine = get_engine(mode)
+    if engine is None or not engine.available():
+        print(f"[WARN] Motor de transcripción '{mode}' no disponible; se usa openai")
+        return get_engine("openai")
+    return engine
+
+
+def transcribe(data: bytes, filename: str = "audio.ogg", engine: Optional[str] = None) -> str:
+    """Transcribe una nota de voz; devuelve el texto o un mensaje de error (como el resto de media_utils)."""
+    trimmed = trim_audio(data)
+    if trimmed is not None and len(trimmed.pcm) == 0:
+        print("[INFO] Nota de voz sin habla detectada")
+        return NO_SPEECH
+    chosen = select_engine(trimmed, engine)
+    candidates: List[TranscriptionEngine] = [chosen]
+    if TRANSCRIPTION_FALLBACK and chosen.name != "openai":
+        candidates.append(get_engine("openai"))
+
+    last_error: Optional[Exception] = None
+    for candidate in candidates:
+        start = time.perf_counter()
+        try:
+            transcript = candidate.transcribe(data, filename, trimmed)
+        except Exception as e:
+            increment_transcription(candidate.name, "error")
+            print(f"[WARN] Transcripción con '{candidate.name}' falló: {e}")
+            last_error = e
+            continue
+        observe_transcription_latency(candidate.name, time.perf_counter() - start)
+        if not transcript or not transcript.strip():
+            increment_transcription(candidate.name, "empty")
+            return EMPTY_TRANSCRIPT
+        increment_transcription(candidate.name, "ok")
+        seconds = f"{trimmed.speech_seconds:.1f}s de voz" if trimmed is not None else f"{len(data)} bytes"
+        print(f"[INFO] Transcripción ({candidate.name}, {seconds}): '{transcript[:100]}'")
+        return transcript.strip()
+    return f"Error en transcripción: {last_error}"
+
+
+def warm_up_transcription():
+    """Carga el modelo local si el despliegue lo usa (local/auto)."""
+    if TRANSCRIPTION_ENGINE in ("local", "auto"):
+        get_engine("local").warm_up()
+
+
+def shutdown_transcription():
+    for engine in _ENGINES.values():
+        engine.shutdown()
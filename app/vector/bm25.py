@@ -0,0 +1,200 @@
+"""
+Índice léxico BM25 local sobre los documentos de una colección Qdrant.
+
+Se construye a partir del payload que guarda langchain_qdrant
+(`page_content` + `metadata`) y se persiste como JSON comprimido en
+BM25_INDEX_DIR para poder recargarlo sin volver a recorrer Qdrant.
+"""
+
+import gzip
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.vector.embedding_cache import normalize_query
+
+load_dotenv()
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "data/bm25")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_SKU_RE = re.compile(r"^(?=.*\d)(?=.*[a-z])[a-z0-9][a-z0-9_./-]{2,}$|^\d{4,}$")
+
+# Palabras vacías frecuentes en consultas de WhatsApp (no aportan al ranking)
+STOPWORDS = {
+    "de", "la", "el", "los", "las", "un", "una", "unos", "unas", "y", "o", "en",
+    "para", "por", "con", "del", "al", "que", "me", "mi", "tienen", "tienes",
+    "quiero", "busco", "hay", "es", "se", "lo", "su", "sus", "a",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalizados; los códigos compuestos (p. ej. SKU `zp-038`) se
+    conservan enteros y además partidos en sus componentes."""
+    tokens = []
+    for tok in _TOKEN_RE.findall(normalize_query(text)):
+        if tok in STOPWORDS:
+            continue
+        tokens.append(tok)
+        if any(sep in tok for sep in "-_./"):
+            tokens.extend(p for p in re.split(r"[-_./]", tok) if p and p not in STOPWORDS)
+    return tokens
+
+
+def looks_like_sku(token: str) -> bool:
+    return bool(_SKU_RE.match(token))
+
+
+class BM25Index:
+    """Índice invertido BM25 (Okapi) en memoria."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Dict[str, Any]] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_len: List[int] = []
+        self.avgdl = 0.0
+        self.sku_map: Dict[str, List[int]] = defaultdict(list)
+
+    def add(self, doc_id: Any, page_content: str, metadata: Optional[Dict[str, Any]] = None):
+        idx = len(self.docs)
+        metadata = metadata or {}
+        self.docs.append({"id": doc_id, "page_content": page_content, "metadata": metadata})
+        tokens = tokenize(page_content)
+        # Campos estructurados con peso extra: SKU, nombre, atributos
+        for field in ("sku", "name", "categories", "attributes"):
+            value = metadata.get(field)
+            if value:
+                tokens.extend(tokenize(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)))
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings[term].append((idx, tf))
+        sku = metadata.get("sku")
+        if sku:
+            self.sku_map[normalize_query(str(sku))].append(idx)
+
+    def finalize(self):
+        self.avgdl = (sum(self.doc_len) / len(self.doc_len)) if self.doc_len else 0.0
+
+    def idf(self, term: str) -> float:
+        n = len(self.postings.get(term, ()))
+        N = len(self.docs)
+        return math.log(1 + (N - n + 0.5) / (n + 0.5))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf(term)
+            for idx, tf in plist:
+                dl = self.doc_len[idx]
+                denom = tf + self.k1 * (1 - self.b + self.b * dl / (self.avgdl or 1))
+                scores[idx] += idf * tf * (self.k1 + 1) / denom
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def sku_matches(self, query: str) -> List[int]:
+        """Documentos cuyo SKU aparece literalmente en la consulta."""
+        hits: List[int] = []
+        for tok in _TOKEN_RE.findall(normalize_query(query)):
+            if looks_like_sku(tok):
+                hits.extend(self.sku_map.get(tok, []))
+        return list(dict.fromkeys(hits))
+
+    def __len__(self):
+        return len(self.docs)
+
+    # ---------- persistencia ----------
+    def save(self, path: str):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Temporal único por proceso: dos builds a la vez no se pisan el archivo a medio escribir
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as raw:
+            tmp = raw.name
+        try:
+            with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+                json.dump({"k1": self.k1, "b": self.b, "docs": self.docs}, fh, ensure_ascii=False)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            data = json.load(fh)
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        for d in data["docs"]:
+            index.add(d["id"], d["page_content"], d.get("metadata"))
+        index.finalize()
+        return index
+
+
+def index_path(collection: str) -> str:
+    return os.path.join(BM25_INDEX_DIR, f"{collection}.json.gz")
+
+
+def build_from_qdrant(client, collection: str, batch_size: int = 256) -> BM25Index:
+    """Recorre la colección con `scroll` (sin vectores) y construye el índice."""
+    index = BM25Index()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        for p in points:
+            payload = p.payload or {}
+            index.add(p.id, payload.get("page_content", ""), payload.get("metadata") or {})
+        if offset is None:
+            break
+    index.finalize()
+    return index
+
+
+def build_and_save(client, collection: str) -> BM25Index:
+    index = build_from_qdrant(client, collection)
+    index.save(index_path(collection))
+    print(f"[INFO] Índice BM25 '{collection}' guardado con {len(index)} documentos en {index_path(collection)}")
+    return index
+
+
+_loaded: Dict[str, Tuple[float, BM25Index]] = {}
+_load_lock = threading.Lock()
+
+
+def get_bm25_index(collection: str) -> Optional[BM25Index]:
+    """
+    Devuelve el índice cargado en memoria para la colección, o None si aún no
+    se ha construido. Si el archivo cambia en disco (refresh), se recarga.
+    """
+    path = index_path(collection)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _loaded.get(collection)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _load_lock:
+        cached = _loaded.get(collection)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            index = BM25Index.load(path)
+        except Exception as e:
+            print(f"[WARN] No se pudo cargar índice BM25 '{collection}': {e}")
+            return cached[1] if cached else None
+        _loaded[collection] = (mtime, index)
+        return index
@@ -0,0 +1,62 @@
+"""
+Presupuesto de contexto para RAG: deduplica chunks casi idénticos y recorta
+el texto combinado a un máximo de tokens antes de enviarlo al LLM.
+"""
+
+import os
+from typing import List, Sequence, Set
+
+from dotenv import load_dotenv
+
+from app.metrics.prometheus_metrics import add_rag_context_tokens_trimmed
+from app.token_accounting import count_tokens, truncate_to_tokens
+from app.vector.embedding_cache import normalize_query
+
+load_dotenv()
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "1200"))
+RAG_DOC_MAX_TOKENS = int(os.getenv("RAG_DOC_MAX_TOKENS", "400"))
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.85"))
+
+def _shingles(text: str, n: int = 3) -> Set[str]:
+    words = normalize_query(text).split()
+    if len(words) < n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def dedupe_texts(texts: Sequence[str], threshold: float = RAG_DEDUP_THRESHOLD) -> List[str]:
+    """Elimina textos cuya similitud de Jaccard (3-shingles) con uno previo supera el umbral."""
+    kept: List[str] = []
+    kept_shingles: List[Set[str]] = []
+    for text in texts:
+        sh = _shingles(text)
+        duplicate = False
+        for other in kept_shingles:
+            union = len(sh | other)
+            if union and len(sh & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(text)
+            kept_shingles.append(sh)
+    return kept
+
+
+def build_context(
+    texts: Sequence[str],
+    max_tokens: int = RAG_CONTEXT_MAX_TOKENS,
+    doc_max_tokens: int = RAG_DOC_MAX_TOKENS,
+) -> str:
+    """Deduplica, recorta cada documento y corta el total al presupuesto de tokens."""
+    original = sum(count_tokens(t) for t in texts)
+    parts: List[str] = []
+    used = 0
+    for text in dedupe_texts([t for t in texts if t and t.strip()]):
+        remaining = max_tokens - used
+        if remaining <= 0:
+            break
+        piece = truncate_to_tokens(text.strip(), min(doc_max_tokens, remaining))
+        parts.append(piece)
+        used += count_tokens(piece)
+    add_rag_context_tokens_trimmed(max(original - used, 0))
+    return "\n\n".join(parts)
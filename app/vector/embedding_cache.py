@@ -0,0 +1,250 @@
+"""
+Caché de embeddings de consultas en dos niveles delante de OpenAIEmbeddings.
+
+- Nivel 1: LRU en proceso, clave = (modelo, texto normalizado). Guarda arrays
+  float32 (12 KB por vector de 3072 dims, no ~50 KB de una lista de floats).
+- Nivel 2: Redis compartido entre workers/réplicas (vectores float32 en binario).
+- Los misses que llegan a la vez desde varios hilos se agrupan en una sola
+  llamada `embed_documents` (ventana de EMBEDDING_BATCH_WAIT_MS). Las llamadas
+  las hace un hilo dedicado: los llamadores solo encolan y esperan su vector.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from app.cache import LRUCache, get_redis
+from app.metrics.prometheus_metrics import (
+    increment_embedding_cache, observe_embedding_latency, add_embedding_latency_saved
+)
+
+load_dotenv()
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "5000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", "64"))
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza una consulta: minúsculas, sin tildes y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+class _Pending:
+    __slots__ = ("text", "event", "vector", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.event = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+class CachedEmbeddings(Embeddings):
+    """Envuelve un objeto Embeddings de LangChain añadiendo caché LRU + Redis."""
+
+    def __init__(self, inner: Embeddings, model: Optional[str] = None):
+        self.inner = inner
+        self.model = model or getattr(inner, "model", None) or type(inner).__name__
+        self._lru = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending: Dict[str, _Pending] = {}
+        self._flusher: Optional[threading.Thread] = None
+        # Latencia media de una llamada remota por texto (para estimar tiempo ahorrado)
+        self._avg_call_s = 0.0
+        self._stats = {"memory_hit": 0, "redis_hit": 0, "miss": 0}
+
+    # ---------- claves y niveles ----------
+    def _key(self, text: str) -> str:
+        norm = normalize_query(text)
+        return hashlib.sha1(f"{self.model}\x00{norm}".encode("utf-8")).hexdigest()
+
+    def _redis_get(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        client = get_redis()
+        if client is None or not keys:
+            return [None] * len(keys)
+        try:
+            raw = client.mget([f"emb:{k}" for k in keys])
+        except Exception as e:
+            print(f"[WARN] Error leyendo embeddings de Redis: {e}")
+            return [None] * len(keys)
+        return [np.frombuffer(r, dtype=np.float32) if r else None for r in raw]
+
+    def _redis_set(self, items: Dict[str, np.ndarray]):
+        client = get_redis()
+        if client is None or not items:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for k, vec in items.items():
+                pipe.set(f"emb:{k}", vec.tobytes(), ex=EMBEDDING_CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"[WARN] Error guardando embeddings en Redis: {e}")
+
+    def _hit(self, tier: str):
+        self._stats[tier] += 1
+        increment_embedding_cache(tier)
+        if self._avg_call_s:
+            add_embedding_latency_saved(self._avg_call_s)
+
+    def _lookup(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = [self._lru.get(k) for k in keys]
+        for v in found:
+            if v is not None:
+                self._hit("memory_hit")
+        missing_idx = [i for i, v in enumerate(found) if v is None]
+        if missing_idx:
+            remote = self._redis_get([keys[i] for i in missing_idx])
+            for i, vec in zip(missing_idx, remote):
+                if vec is not None:
+                    found[i] = vec
+                    self._lru.set(keys[i], vec)
+                    self._hit("redis_hit")
+        return found
+
+    def _embed_remote(self, texts: List[str]) -> List[List[float]]:
+        start = time.time()
+        vectors = self.inner.embed_documents(texts)
+        duration = time.time() - start
+        observe_embedding_latency(duration)
+        per_text = duration / max(len(texts), 1)
+        self._avg_call_s = per_text if not self._avg_call_s else 0.9 * self._avg_call_s + 0.1 * per_text
+        self._stats["miss"] += len(texts)
+        for _ in texts:
+            increment_embedding_cache("miss")
+        return vectors
+
+    def _store(self, items: Dict[str, List[float]]):
+        arrays = {k: np.asarray(vec, dtype=np.float32) for k, vec in items.items()}
+        for k, vec in arrays.items():
+            self._lru.set(k, vec)
+        self._redis_set(arrays)
+
+    # ---------- batching de misses concurrentes ----------
+    def _embed_batched(self, key: str, text: str) -> List[float]:
+        """Registra el miss en la ventana actual y espera a que el hilo de lotes lo resuelva."""
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = _Pending(text)
+                self._pending[key] = pending
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(target=self._flush_loop, name="embedding-batcher", daemon=True)
+                    self._flusher.start()
+                self._cond.notify()
+
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _flush_loop(self):
+        """
+        Hilo de lotes: al llegar el primer miss espera EMBEDDING_BATCH_WAIT_MS y
+        hace una llamada con hasta EMBEDDING_BATCH_MAX textos. Lo que se acumuló
+        mientras tanto sale en la siguiente vuelta sin volver a esperar.
+        """
+        idle = True
+        while True:
+            with self._cond:
+                while not self._pending:
+                    idle = True
+                    self._cond.wait()
+            if idle:
+                time.sleep(EMBEDDING_BATCH_WAIT_MS / 1000.0)
+                idle = False
+            with self._lock:
+                batch = dict(list(self._pending.items())[:EMBEDDING_BATCH_MAX])
+                for k in batch:
+                    del self._pending[k]
+            self._flush(batch)
+
+    def _flush(self, batch: Dict[str, _Pending]):
+        keys = list(batch.keys())
+        try:
+            vectors = self._embed_remote([batch[k].text for k in keys])
+            self._store(dict(zip(keys, vectors)))
+            for k, vec in zip(keys, vectors):
+                batch[k].vector = vec
+        except BaseException as e:
+            for p in batch.values():
+                p.error = e
+        finally:
+            for p in batch.values():
+                p.event.set()
+
+    # ---------- interfaz Embeddings ----------
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._lookup([key])[0]
+        if vec is not None:
+            return vec.tolist()
+        return self._embed_batched(key, text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+        missing = {}
+        for i, v in enumerate(found):
+            if v is None:
+                missing.setdefault(keys[i], texts[i])
+        if missing:
+            vectors = self._embed_remote(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            return [v.tolist() if v is not None else computed[k] for k, v in zip(keys, found)]
+        return [v.tolist() for v in found]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._hit("memory_hit")
+            return vec.tolist()
+        return await asyncio.to_thread(self.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    def stats(self) -> Dict[str, float]:
+        """Tasa de aciertos y tiempo estimado ahorrado en llamadas de embedding."""
+        hits = self._stats["memory_hit"] + self._stats["redis_hit"]
+        total = hits + self._stats["miss"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "avg_call_seconds": round(self._avg_call_s, 4),
+            "estimated_seconds_saved": round(hits * self._avg_call_s, 3),
+        }
+
+
+_embeddings: Optional[CachedEmbeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Instancia compartida de embeddings con caché (una por proceso)."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                from langchain_openai import OpenAIEmbeddings
+                _embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    return _embeddings
+
+
+def embedding_cache_stats() -> Dict[str, float]:
+    """Estadísticas de la caché si ya fue inicializada (no fuerza su creación)."""
+    return _embeddings.stats() if _embeddings is not None else {}
@@ -0,0 +1,96 @@
+"""
+Retriever híbrido léxico (BM25 local) + vectorial (Qdrant) con fusión RRF.
+
+- Si la consulta contiene un SKU que existe en el índice, se responde solo
+  con BM25 (sin llamada de embedding ni round-trip a Qdrant).
+- En otro caso, BM25 y la búsqueda densa se ejecutan en paralelo y los
+  rankings se combinan con Reciprocal Rank Fusion.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from app.vector.bm25 import BM25Index, get_bm25_index
+
+load_dotenv()
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_WORKERS", "8")), thread_name_prefix="hybrid")
+
+
+def _doc_key(doc: Document) -> str:
+    """Identidad de un documento: id del punto Qdrant si está, si no hash del texto."""
+    meta = doc.metadata or {}
+    if meta.get("_id") is not None:
+        return str(meta["_id"])
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def rrf_fuse(rankings: Sequence[Sequence[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """Reciprocal Rank Fusion: score(d) = sum(1 / (rrf_k + rank))."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
+
+
+def _bm25_docs(index: BM25Index, idxs: Sequence[int]) -> List[Document]:
+    out = []
+    for i in idxs:
+        d = index.docs[i]
+        meta = dict(d["metadata"])
+        meta.setdefault("_id", d["id"])
+        out.append(Document(page_content=d["page_content"], metadata=meta))
+    return out
+
+
+class HybridRetriever:
+    """Retriever híbrido sobre una colección; `vectorstore` es un Qdrant de LangChain."""
+
+    def __init__(self, collection: str, vectorstore: Any, k: int = 5, fetch_k: int = HYBRID_FETCH_K):
+        self.collection = collection
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = max(fetch_k, k)
+
+    def lexical_only(self, query: str) -> List[Document]:
+        """Respuesta puramente léxica si la consulta trae un SKU conocido, si no []."""
+        index = get_bm25_index(self.collection)
+        if index is None:
+            return []
+        return _bm25_docs(index, index.sku_matches(query)[: self.k])
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        index = get_bm25_index(self.collection)
+        if index is None:
+            # Sin índice construido: comportamiento original (solo denso)
+            return self.vectorstore.similarity_search(query, k=self.k)
+
+        sku_hits = index.sku_matches(query)
+        if sku_hits:
+            print(f"[DEBUG] Hybrid: SKU exacto en '{query}', sin embedding")
+            return _bm25_docs(index, sku_hits[: self.k])
+
+        dense_future = _executor.submit(self.vectorstore.similarity_search, query, k=self.fetch_k)
+        lexical = _bm25_docs(index, [i for i, _ in index.search(query, k=self.fetch_k)])
+        try:
+            dense = dense_future.result()
+        except Exception as e:
+            print(f"[WARN] Búsqueda vectorial falló, usando solo BM25: {e}")
+            return lexical[: self.k]
+        return rrf_fuse([lexical, dense], k=self.k)
+
+    # Alias con la interfaz moderna de retrievers de LangChain
+    def invoke(self, query: str) -> List[Document]:
+        return self.get_relevant_documents(query)
@@ -0,0 +1,405 @@
+"""
+Ingesta del catálogo de WooCommerce hacia una colección Qdrant (por defecto `catalog_kb`).
+
+Pipeline en streaming (memoria acotada):
+    páginas WooCommerce (prefetch en paralelo)
+      -> producto a documentos (texto + metadata, troceado)
+      -> lotes de embeddings con concurrencia acotada
+      -> upsert por lotes en Qdrant
+
+Soporta sincronización incremental (solo productos modificados desde el último
+checkpoint) y eliminación de productos retirados (no publicados o borrados).
+Una pasada completa borra además todo punto que no re-emitió.
+"""
+
+import html
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from qdrant_client.http import models as rest
+
+from app.tools.woocommerce import WooClient
+
+load_dotenv()
+INGEST_CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", "data/ingest")
+INGEST_CHUNK_CHARS = int(os.getenv("INGEST_CHUNK_CHARS", "1500"))
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "150"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "128"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+INGEST_FETCH_CONCURRENCY = int(os.getenv("INGEST_FETCH_CONCURRENCY", "4"))
+
+# Namespace fijo: el id de cada punto es determinista (producto + nº de chunk)
+_POINT_NS = uuid.UUID("6f1c2b1e-8a43-4c55-9d0e-2f3b7a9c1d10")
+_TAG_RE = re.compile(r"<[^>]+>")
+_PUBLISHED = "publish"
+
+
+def point_id(product_id: int, chunk: int) -> str:
+    return str(uuid.uuid5(_POINT_NS, f"{product_id}:{chunk}"))
+
+
+def _strip_html(text: str) -> str:
+    return " ".join(html.unescape(_TAG_RE.sub(" ", text or "")).split())
+
+
+def _chunks(text: str, size: int = INGEST_CHUNK_CHARS, overlap: int = INGEST_CHUNK_OVERLAP) -> List[str]:
+    if len(text) <= size:
+        return [text]
+    out, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        # Cortar en un espacio para no partir palabras
+        if end < len(text):
+            cut = text.rfind(" ", start + size // 2, end)
+            end = cut if cut > 0 else end
+        out.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return out
+
+
+def product_to_documents(product: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Convierte un producto WooCommerce en [(point_id, texto, metadata)]."""
+    pid = int(product["id"])
+    name = product.get("name", "")
+    sku = product.get("sku") or ""
+    categories = ", ".join(c.get("name", "") for c in product.get("categories", []))
+    attributes = "; ".join(
+        f"{a.get('name')}: {', '.join(a.get('options', []))}" for a in product.get("attributes", [])
+    )
+    header = "\n".join(line for line in (
+        f"Producto: {name}",
+        f"SKU: {sku}" if sku else "",
+        f"Precio: {product.get('price')}" if product.get("price") else "",
+        f"Categorías: {categories}" if categories else "",
+        f"Atributos: {attributes}" if attributes else "",
+        f"Stock: {product.get('stock_status')}" if product.get("stock_status") else "",
+    ) if line)
+    body = _strip_html(product.get("short_description", "")) + " " + _strip_html(product.get("description", ""))
+    metadata = {
+        "product_id": pid,
+        "name": name,
+        "sku": sku,
+        "categories": categories,
+        "attributes": attributes,
+        "price": product.get("price"),
+        "stock_status": product.get("stock_status"),
+        "permalink": product.get("permalink"),
+        "date_modified_gmt": product.get("date_modified_gmt"),
+    }
+    docs = []
+    # Cada chunk lleva la cabecera para ser autocontenido en el RAG
+    for i, chunk in enumerate(_chunks(body.strip()) if body.strip() else [""]):
+        text = f"{header}\nDescripción: {chunk}" if chunk else header
+        docs.append((point_id(pid, i), text, {**metadata, "chunk": i}))
+    return docs
+
+
+@dataclass
+class IngestStats:
+    products: int = 0
+    chunks: int = 0
+    deleted_products: int = 0
+    deleted_chunks: int = 0
+    batches: int = 0
+    started_at: float = field(default_factory=time.time)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        return {
+            "products": self.products,
+            "chunks": self.chunks,
+            "deleted_products": self.deleted_products,
+            "deleted_chunks": self.deleted_chunks,
+            "batches": self.batches,
+            "seconds": round(elapsed, 2),
+            "products_per_second": round(self.products / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+# ==========================
+# Checkpoint
+# ==========================
+def checkpoint_path(collection: str) -> str:
+    return os.path.join(INGEST_CHECKPOINT_DIR, f"{collection}.checkpoint.json")
+
+
+def load_checkpoint(collection: str) -> Dict[str, Any]:
+    try:
+        with open(checkpoint_path(collection), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(collection: str, data: Dict[str, Any]):
+    path = checkpoint_path(collection)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+# ==========================
+# Pipeline
+# ==========================
+class CatalogIngestor:
+    def __init__(
+        self,
+        woo: WooClient,
+        client,
+        embeddings,
+        collection: str = "catalog_kb",
+        batch_size: int = INGEST_EMBED_BATCH,
+        concurrency: int = INGEST_CONCURRENCY,
+        fetch_concurrency: int = INGEST_FETCH_CONCURRENCY,
+    ):
+        self.woo = woo
+        self.client = client
+        self.embeddings = embeddings
+        self.collection = collection
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.fetch_concurrency = fetch_concurrency
+        self.stats = IngestStats()
+        # Ids emitidos en una pasada completa: lo que no esté aquí sobra en la colección
+        self.emitted: Set[str] = set()
+        self._collection_ready = False
+        self._ready_lock = threading.Lock()
+        # Limita lotes en vuelo: como mucho 2 por worker en memoria
+        self._inflight = threading.BoundedSemaphore(concurrency * 2)
+
+    # ---------- lectura ----------
+    def _pages(self, **kwargs) -> Iterator[List[Dict[str, Any]]]:
+        """Páginas de productos en orden, con prefetch de hasta `fetch_concurrency` páginas."""
+        first, total_pages = self.woo.list_products(page=1, **kwargs)
+        yield first
+        if total_pages <= 1:
+            return
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency, thread_name_prefix="woo-page") as pool:
+            window: List[Future] = []
+            next_page = 2
+            while next_page <= total_pages or window:
+                while next_page <= total_pages and len(window) < self.fetch_concurrency:
+                    window.append(pool.submit(self.woo.list_products, page=next_page, **kwargs))
+                    next_page += 1
+                items, _ = window.pop(0).result()
+                yield items
+
+    # ---------- escritura ----------
+    def _ensure_collection(self, vector_size: int):
+        if self._collection_ready:
+            return
+        with self._ready_lock:
+            if self._collection_ready:
+                return
+            if not self.client.collection_exists(self.collection):
+                print(f"[INFO] Creando colección '{self.collection}' (dim={vector_size})")
+                self.client.create_collection(
+                    collection_name=self.collection,
+                    vectors_config=rest.VectorParams(size=vector_size, distance=rest.Distance.COSINE),
+                )
+            # Índice de payload para filtrar/borrar por producto rápidamente
+            try:
+                self.client.create_payload_index(
+                    self.collection, field_name="metadata.product_id", field_schema=rest.PayloadSchemaType.INTEGER
+                )
+            except Exception:
+                pass
+            self._collection_ready = True
+
+    def _embed_and_upsert(self, batch: List[Tuple[str, str, Dict[str, Any]]], wait: bool = False):
+        try:
+            vectors = self.embeddings.embed_documents([text for _, text, _ in batch])
+            self._ensure_collection(len(vectors[0]))
+            points = [
+                rest.PointStruct(id=pid, vector=vec, payload={"page_content": text, "metadata": meta})
+                for (pid, text, meta), vec in zip(batch, vectors)
+            ]
+            self.client.upsert(collection_name=self.collection, points=points, wait=wait)
+            self.stats.batches += 1
+        finally:
+            self._inflight.release()
+
+    def delete_products(self, product_ids: List[int]):
+        if not product_ids:
+            return
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=rest.FilterSelector(filter=rest.Filter(must=[
+                rest.FieldCondition(key="metadata.product_id", match=rest.MatchAny(any=product_ids))
+            ])),
+        )
+        self.stats.deleted_products += len(product_ids)
+
+    def _delete_stale_chunks(self, product_id: int, n_chunks: int):
+        """Borra chunks sobrantes si la descripción de un producto se acortó."""
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=rest.FilterSelector(filter=rest.Filter(must=[
+                rest.FieldCondition(key="metadata.product_id", match=rest.MatchValue(value=product_id)),
+                rest.FieldCondition(key="metadata.chunk", range=rest.Range(gte=n_chunks)),
+            ])),
+            wait=False,
+        )
+
+    # ---------- orquestación ----------
+    def run(self, modified_after: Optional[str] = None) -> Tuple[IngestStats, Optional[str]]:
+        """
+        Sincroniza productos. Con `modified_after` solo procesa los modificados
+        después de esa fecha. Retorna (estadísticas, máxima date_modified_gmt vista).
+        """
+        incremental = modified_after is not None
+        max_modified = modified_after
+        buffer: List[Tuple[str, str, Dict[str, Any]]] = []
+        futures: List[Future] = []
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingest") as pool:
+            def flush():
+                nonlocal buffer
+                if not buffer:
+                    return
+                self._inflight.acquire()
+                futures.append(pool.submit(self._embed_and_upsert, buffer))
+                buffer = []
+
+            for page in self._pages(modified_after=modified_after, status="any"):
+                to_delete = []
+                for product in page:
+                    modified = product.get("date_modified_gmt")
+                    if modified and (max_modified is None or modified > max_modified):
+                        max_modified = modified
+                    if product.get("status") != _PUBLISHED:
+                        to_delete.append(int(product["id"]))
+                        continue
+                    docs = product_to_documents(product)
+                    if incremental:
+                        self._delete_stale_chunks(int(product["id"]), len(docs))
+                    else:
+                        self.emitted.update(doc[0] for doc in docs)
+                    self.stats.products += 1
+                    self.stats.chunks += len(docs)
+                    for doc in docs:
+                        # Se vacía antes de agregar: el último lote siempre queda para el final
+                        if len(buffer) >= self.batch_size:
+                            flush()
+                        buffer.append(doc)
+                self.delete_products(to_delete)
+                # Liberar referencias a lotes terminados y propagar errores pronto
+                done = [f for f in futures if f.done()]
+                for f in done:
+                    f.result()
+                    futures.remove(f)
+                print(f"[INFO] Ingesta '{self.collection}': {self.stats.products} productos, {self.stats.chunks} chunks")
+            for f in futures:
+                f.result()
+        if buffer:
+            # Último lote con wait=True, después de todos los demás: Qdrant aplica las
+            # actualizaciones en orden, así que al volver todo lo anterior ya es visible
+            # para los scrolls que siguen (limpieza, BM25)
+            self._inflight.acquire()
+            self._embed_and_upsert(buffer, wait=True)
+        return self.stats, max_modified
+
+    def delete_unseen(self) -> int:
+        """
+        Tras una pasada completa: borra todo punto que no se re-emitió (productos
+        borrados o despublicados, chunks de descripciones que se acortaron, ids de
+        ingestas viejas).
+        """
+        if not self.emitted:
+            # Una pasada que no emitió nada (Woo vacío o mal configurado) no vacía la colección
+            print(f"[WARN] Pasada completa sin productos; no se limpia '{self.collection}'")
+            return 0
+        stale: List[Any] = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection, limit=1000, offset=offset,
+                with_payload=False, with_vectors=False,
+            )
+            stale.extend(p.id for p in points if str(p.id) not in self.emitted)
+            if offset is None:
+                break
+        for i in range(0, len(stale), 500):
+            self.client.delete(
+                collection_name=self.collection,
+                points_selector=rest.PointIdsList(points=stale[i:i + 500]),
+            )
+        self.stats.deleted_chunks += len(stale)
+        print(f"[INFO] Limpieza '{self.collection}': {len(stale)} chunks que ya no están en el catálogo eliminados")
+        return len(stale)
+
+    def prune(self) -> int:
+        """Elimina de Qdrant los productos que ya no existen en WooCommerce."""
+        live: Set[int] = set()
+        for page in self._pages(status="publish", fields=["id"]):
+            live.update(int(p["id"]) for p in page)
+        indexed: Set[int] = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection, limit=1000, offset=offset,
+                with_payload=["metadata.product_id"], with_vectors=False,
+            )
+            for p in points:
+                pid = ((p.payload or {}).get("metadata") or {}).get("product_id")
+                if pid is not None:
+                    indexed.add(int(pid))
+            if offset is None:
+                break
+        removed = sorted(indexed - live)
+        for i in range(0, len(removed), 500):
+            self.delete_products(removed[i:i + 500])
+        print(f"[INFO] Prune '{self.collection}': {len(removed)} productos eliminados")
+        return len(removed)
+
+
+def sync_catalog(
+    collection: str = "catalog_kb",
+    full: bool = False,
+    prune: bool = False,
+    rebuild_bm25: bool = True,
+    **kwargs,
+) -> Dict[str, Any]:
+    """Punto de entrada: sincroniza WooCommerce -> Qdrant y actualiza el checkpoint."""
+    from app.vector.vector import _client
+    from app.vector.embedding_cache import get_embeddings
+
+    client = _client()
+    # Los documentos se embeben sin pasar por la caché de consultas
+    ingestor = CatalogIngestor(WooClient.from_env(), client, get_embeddings().inner, collection=collection, **kwargs)
+
+    checkpoint = {} if full else load_checkpoint(collection)
+    modified_after = checkpoint.get("last_modified_gmt")
+    print(f"[INFO] Sincronizando '{collection}' ({'incremental desde ' + modified_after if modified_after else 'completa'})")
+
+    stats, max_modified = ingestor.run(modified_after=modified_after)
+    if modified_after is None and ingestor.client.collection_exists(collection):
+        # Pasada completa (--full o sin checkpoint): fuera todo lo que no se re-emitió
+        ingestor.delete_unseen()
+    elif prune:
+        ingestor.prune()
+
+    save_checkpoint(collection, {"last_modified_gmt": max_modified, "last_run": time.time()})
+
+    from app.vector.retrieval_cache import bump_collection_version
+    try:
+        if rebuild_bm25:
+            from app.vector.bm25 import build_and_save
+            build_and_save(client, collection)
+    finally:
+        # Invalida la caché de recuperación (y los snapshots locales) recién con el BM25 nuevo en disco:
+        # antes, un lector cachearía resultados del índice viejo bajo la versión nueva
+        bump_collection_version(collection)
+    return stats.summary()
@@ -0,0 +1,200 @@
+"""
+Índice vectorial en proceso para colecciones pequeñas (p. ej. other_kb).
+
+La colección se copia de Qdrant (vectores + payloads) a un archivo NumPy en
+LOCAL_INDEX_DIR que se abre con memory-map; la búsqueda es top-k por fuerza
+bruta vectorizada, sin ida y vuelta de red. Colecciones con más de
+LOCAL_INDEX_MAX_POINTS puntos (catalog_kb) siguen en Qdrant.
+
+El snapshot guarda la versión de colección (`kbver:`) con la que se tomó: al
+incrementarse, el siguiente uso lo regenera. La versión la incrementa
+`sync_catalog` (catalog_kb) y `scripts/build_bm25_index.py` para cualquier
+colección: other_kb se carga fuera de este repo y ese script es el paso de
+refresco tras cargarla.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from app.vector.embedding_cache import get_embeddings
+from app.vector.retrieval_cache import get_collection_version
+
+load_dotenv()
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/local_index")
+LOCAL_INDEX_MAX_POINTS = int(os.getenv("LOCAL_INDEX_MAX_POINTS", "5000"))
+
+_SCROLL_PAGE = 256
+
+
+def _paths(collection: str, directory: str = LOCAL_INDEX_DIR) -> Tuple[str, str]:
+    base = os.path.join(directory, collection)
+    return base + ".npy", base + ".json"
+
+
+def _point_vector(vector: Any) -> List[float]:
+    # Colecciones con vectores con nombre devuelven un dict {nombre: vector}
+    if isinstance(vector, dict):
+        vector = next(iter(vector.values()))
+    return vector
+
+
+class LocalVectorIndex:
+    """Matriz normalizada + payloads; expone `similarity_search` como el vectorstore Qdrant."""
+
+    def __init__(self, vectors, payloads: List[Dict[str, Any]], version: int = 0):
+        self.vectors = vectors
+        self.payloads = payloads
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.payloads)
+
+    def search_by_vector(self, vector, k: int = 5) -> List[Tuple[Document, float]]:
+        import numpy as np
+
+        if not self.payloads:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        sims = self.vectors @ q
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        results = []
+        for i in top:
+            payload = self.payloads[i]
+            doc = Document(page_content=payload.get("page_content") or "", metadata=payload.get("metadata") or {})
+            results.append((doc, float(sims[i])))
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        return self.search_by_vector(get_embeddings().embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 5, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def as_retriever(self, search_kwargs: Optional[Dict[str, Any]] = None) -> "LocalRetriever":
+        return LocalRetriever(self, k=(search_kwargs or {}).get("k", 5))
+
+    @classmethod
+    def load(cls, collection: str, directory: str = LOCAL_INDEX_DIR) -> "LocalVectorIndex":
+        import numpy as np
+
+        vec_path, meta_path = _paths(collection, directory)
+        with open(meta_path, encoding="utf-8") as fh:
+            meta = json.load(fh)
+        return cls(np.load(vec_path, mmap_mode="r"), meta["payloads"], int(meta.get("version", 0)))
+
+
+class LocalRetriever:
+    def __init__(self, index: LocalVectorIndex, k: int = 5):
+        self.index = index
+        self.k = k
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        return self.index.similarity_search(query, k=self.k)
+
+    def invoke(self, query: str) -> List[Document]:
+        return self.get_relevant_documents(query)
+
+
+def snapshot_collection(client, collection: str, version: int, directory: str = LOCAL_INDEX_DIR) -> Optional[int]:
+    """
+    Copia vectores y payloads de Qdrant al archivo local. Devuelve el número de
+    puntos, o None si la colección supera LOCAL_INDEX_MAX_POINTS.
+    """
+    import numpy as np
+
+    total = client.count(collection_name=collection, exact=True).count
+    if total > LOCAL_INDEX_MAX_POINTS:
+        return None
+    vectors: List[List[float]] = []
+    payloads: List[Dict[str, Any]] = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection, limit=_SCROLL_PAGE, offset=offset,
+            with_payload=True, with_vectors=True,
+        )
+        for p in points:
+            vectors.append(_point_vector(p.vector))
+            payloads.append(p.payload or {})
+        if offset is None:
+            break
+
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    if len(matrix):
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+    os.makedirs(directory, exist_ok=True)
+    vec_path, meta_path = _paths(collection, directory)
+    # Temporales únicos por proceso (varios workers pueden regenerar a la vez); el .json va
+    # último: un lector que ve la versión nueva encuentra ya la matriz que le corresponde
+    _atomic_write(vec_path, lambda fh: np.save(fh, matrix))
+    _atomic_write(meta_path, lambda fh: fh.write(json.dumps({"version": version, "payloads": payloads}, ensure_ascii=False).encode("utf-8")))
+    return len(payloads)
+
+
+def _atomic_write(path: str, write):
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as fh:
+        tmp = fh.name
+        try:
+            write(fh)
+        except BaseException:
+            fh.close()
+            os.unlink(tmp)
+            raise
+    os.replace(tmp, path)
+
+
+_loaded: Dict[str, LocalVectorIndex] = {}
+# Colecciones que van a Qdrant (demasiado grandes o snapshot fallido), por versión:
+# no se reintenta hasta la siguiente ingesta
+_use_qdrant: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def get_local_index(collection: str) -> Optional[LocalVectorIndex]:
+    """
+    Índice en proceso para la colección si es pequeña, o None para usar Qdrant.
+    Carga el snapshot de disco o lo regenera si su versión quedó atrás.
+    """
+    if not LOCAL_INDEX_ENABLED:
+        return None
+    version = get_collection_version(collection)
+    index = _loaded.get(collection)
+    if index is not None and index.version == version:
+        return index
+    if _use_qdrant.get(collection) == version:
+        return None
+    with _lock:
+        index = _loaded.get(collection)
+        if index is not None and index.version == version:
+            return index
+        try:
+            index = LocalVectorIndex.load(collection)
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is None or index.version != version:
+            try:
+                from app.vector.vector import _client
+
+                if snapshot_collection(_client(), collection, version) is None:
+                    _use_qdrant[collection] = version
+                    _loaded.pop(collection, None)
+                    return None
+                index = LocalVectorIndex.load(collection)
+                print(f"[INFO] Índice local de '{collection}' regenerado ({len(index)} puntos, versión {version})")
+            except Exception as e:
+                print(f"[WARN] No se pudo crear índice local de '{collection}': {e}; usando Qdrant")
+                _use_qdrant[collection] = version
+                return None
+        _loaded[collection] = index
+        return index
@@ -0,0 +1,102 @@
+"""
+Caché de resultados de recuperación (top-k) por colección.
+
+Clave: (colección, versión de colección, k, texto normalizado). La versión de
+colección se incrementa en cada ingesta (`bump_collection_version`), de modo
+que todos los resultados anteriores quedan invalidados sin borrar claves.
+"""
+
+import hashlib
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from app.cache import LRUCache, get_redis
+from app.codec import decode, encode
+from app.metrics.prometheus_metrics import increment_retrieval_cache
+from app.vector.embedding_cache import normalize_query
+
+load_dotenv()
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000"))
+# Cada cuánto se relee la versión de colección desde Redis
+_VERSION_REFRESH_SECONDS = 5.0
+
+_lru = LRUCache(maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+_versions: Dict[str, Tuple[int, float]] = {}
+
+
+def get_collection_version(collection: str) -> int:
+    cached = _versions.get(collection)
+    if cached and time.monotonic() - cached[1] < _VERSION_REFRESH_SECONDS:
+        return cached[0]
+    version = cached[0] if cached else 0
+    client = get_redis()
+    if client is not None:
+        try:
+            version = int(client.get(f"kbver:{collection}") or 0)
+        except Exception as e:
+            print(f"[WARN] No se pudo leer versión de colección '{collection}': {e}")
+    _versions[collection] = (version, time.monotonic())
+    return version
+
+
+def bump_collection_version(collection: str) -> int:
+    """Invalida la caché de la colección en todos los procesos (vía Redis)."""
+    version = get_collection_version(collection) + 1
+    client = get_redis()
+    if client is not None:
+        try:
+            version = int(client.incr(f"kbver:{collection}"))
+        except Exception as e:
+            print(f"[WARN] No se pudo incrementar versión de colección '{collection}': {e}")
+    _versions[collection] = (version, time.monotonic())
+    _lru.clear()
+    return version
+
+
+def _key(collection: str, query: str, k: int) -> str:
+    digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+    return f"ret:{collection}:v{get_collection_version(collection)}:{k}:{digest}"
+
+
+def _encode(docs: List[Document]) -> bytes:
+    return encode([{"page_content": d.page_content, "metadata": d.metadata} for d in docs])
+
+
+def _decode(raw: bytes) -> List[Document]:
+    return [Document(page_content=d["page_content"], metadata=d.get("metadata") or {}) for d in decode(raw, "retrieval")]
+
+
+def cached_retrieve(collection: str, query: str, k: int, fetch: Callable[[str], List[Document]]) -> List[Document]:
+    """Read-through: LRU local -> Redis -> `fetch(query)` (Qdrant/híbrido)."""
+    key = _key(collection, query, k)
+    docs = _lru.get(key)
+    if docs is not None:
+        increment_retrieval_cache("memory_hit")
+        return docs
+
+    client = get_redis()
+    if client is not None:
+        try:
+            raw = client.get(key)
+            if raw:
+                docs = _decode(raw)
+                _lru.set(key, docs)
+                increment_retrieval_cache("redis_hit")
+                return docs
+        except Exception as e:
+            print(f"[WARN] Error leyendo caché de recuperación: {e}")
+
+    increment_retrieval_cache("miss")
+    docs = fetch(query)
+    _lru.set(key, docs)
+    if client is not None:
+        try:
+            client.set(key, _encode(docs), ex=RETRIEVAL_CACHE_TTL)
+        except Exception as e:
+            print(f"[WARN] Error guardando caché de recuperación: {e}")
+    return docs
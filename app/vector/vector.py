@@ -3,8 +3,12 @@ import os
 from typing import List
 
 from qdrant_client import QdrantClient
-from langchain_openai import OpenAIEmbeddings
 from langchain_qdrant import Qdrant
+from app.vector.embedding_cache import get_embeddings
+from app.vector.hybrid import HybridRetriever
+from app.vector.local_index import get_local_index
+from app.vector.retrieval_cache import cached_retrieve
+from app.vector.context import build_context
 from langchain.tools import Tool
 
 # ==============
@@ -15,8 +19,6 @@ load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
 
-EMB = OpenAIEmbeddings()
-
 def _client() -> QdrantClient:
     return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
 
@@ -29,18 +31,30 @@ def get_qdrant_collection(name: str) -> Qdrant:
     return Qdrant(
         client=client,
         collection_name=name,
-        embeddings=EMB,
+        # Embeddings con caché LRU + Redis (se crean en el primer uso)
+        embeddings=get_embeddings(),
     )
 
+def dense_store(name: str):
+    """
+    Búsqueda densa para la colección: índice en proceso si es pequeña
+    (<= LOCAL_INDEX_MAX_POINTS), si no el vectorstore Qdrant.
+    """
+    return get_local_index(name) or get_qdrant_collection(name)
+
 # ===================
 # Retrievers por KB
 # ===================
 def products_retriever(k: int = 5):
-    vs = get_qdrant_collection("catalog_kb")
+    vs = dense_store("catalog_kb")
     return vs.as_retriever(search_kwargs={"k": k})
 
+def products_hybrid_retriever(k: int = 5) -> HybridRetriever:
+    """BM25 local + vectorial con RRF; si no hay índice BM25 cae a solo denso."""
+    return HybridRetriever("catalog_kb", dense_store("catalog_kb"), k=k)
+
 def other_retriever(k: int = 5):
-    vs = get_qdrant_collection("other_kb")
+    vs = dense_store("other_kb")
     return vs.as_retriever(search_kwargs={"k": k})
 
 # ==========================
@@ -49,15 +63,16 @@ def other_retriever(k: int = 5):
 def _combine_docs_text(docs: List) -> str:
     if not docs:
         return "No se encontraron resultados relevantes."
-    return "\n\n".join(getattr(d, "page_content", str(d)) for d in docs)
+    # Deduplica chunks casi idénticos y recorta al presupuesto de tokens del prompt
+    return build_context([getattr(d, "page_content", str(d)) for d in docs])
 
 def get_products_rag(query: str) -> str:
     """
     Recupera información relevante del vectorstore 'catalog_kb' (productos)
-    para la consulta dada y devuelve un texto combinado.
+    con búsqueda híbrida BM25 + vectorial y devuelve un texto combinado.
     """
-    retriever = products_retriever(k=5)
-    results = retriever.get_relevant_documents(query)
+    # El retriever (y su cliente Qdrant) solo se construye si hay miss de caché
+    results = cached_retrieve("catalog_kb", query, 5, lambda q: products_hybrid_retriever(k=5).get_relevant_documents(q))
     return _combine_docs_text(results)
 
 def get_other_rag(query: str) -> str:
@@ -65,8 +80,7 @@ def get_other_rag(query: str) -> str:
     Recupera información relevante del vectorstore 'other_kb' (otros temas)
     para la consulta dada y devuelve un texto combinado.
     """
-    retriever = other_retriever(k=5)
-    results = retriever.get_relevant_documents(query)
+    results = cached_retrieve("other_kb", query, 5, lambda q: other_retriever(k=5).get_relevant_documents(q))
     return _combine_docs_text(results)
 
 # ======================
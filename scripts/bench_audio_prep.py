@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesado de notas de voz (app/audio_prep.py).
+
+Para cada audio mide bytes recibidos vs bytes subidos, duración original vs
+voz recortada, trozos y tiempo de preprocesado. Con --transcribe además mide
+el tiempo extremo a extremo de la transcripción con y sin preprocesado
+(llamadas reales a Whisper).
+
+Sin --fixtures genera notas sintéticas tipo WhatsApp (OGG/Opus estéreo 48 kHz,
+64 kbps, con silencio al principio y al final) en bench/audio/.
+
+Uso:
+    python scripts/bench_audio_prep.py
+    python scripts/bench_audio_prep.py --fixtures bench/audio --transcribe
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+
+import app.audio_prep as audio_prep  # noqa: E402
+from app.audio_prep import _ffmpeg, ffmpeg_path, prepare_audio  # noqa: E402
+
+# (nombre, segundos de silencio inicial, segundos de "voz", segundos de silencio final)
+SYNTHETIC = [
+    ("corta", 1.5, 6, 2.0),
+    ("media", 2.0, 35, 3.0),
+    ("larga", 1.0, 150, 4.0),
+]
+_RATE = 48000
+
+
+def _fake_speech(seconds: float, rng) -> np.ndarray:
+    """Ráfagas de tonos modulados con pausas cortas (silabeo) + ruido de fondo."""
+    t = np.arange(int(seconds * _RATE)) / _RATE
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    voice = sum(np.sin(2 * np.pi * k * np.cumsum(pitch) / _RATE) / k for k in (1, 2, 3))
+    envelope = (np.sin(2 * np.pi * 3.5 * t) > -0.3) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.4 * t) ** 2)
+    return 0.3 * voice * envelope + 0.003 * rng.standard_normal(len(t))
+
+
+def generate_fixtures(out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(7)
+    for name, head, speech, tail in SYNTHETIC:
+        path = os.path.join(out_dir, f"{name}.ogg")
+        if os.path.exists(path):
+            continue
+        noise = lambda s: 0.003 * rng.standard_normal(int(s * _RATE))  # noqa: E731
+        mono = np.concatenate([noise(head), _fake_speech(speech, rng), noise(tail)])
+        stereo = np.repeat(np.clip(mono, -1, 1)[:, None], 2, axis=1)
+        pcm = (stereo * 32767).astype(np.int16).tobytes()
+        data = _ffmpeg(["-f", "s16le", "-ar", str(_RATE), "-ac", "2", "-i", "pipe:0",
+                        "-c:a", "libopus", "-b:a", "64k", "-f", "ogg", "pipe:1"], pcm)
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"Fixture generado: {path} ({len(data)} bytes)")
+
+
+def _transcribe_seconds(data: bytes, name: str, prep: bool, repeat: int) -> float:
+    from app.transcription import transcribe
+
+    audio_prep.AUDIO_PREP_ENABLED = prep
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transcribe(data, name, engine="openai")
+        times.append(time.perf_counter() - start)
+    audio_prep.AUDIO_PREP_ENABLED = True
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=None, help="Directorio con audios (.ogg/.opus/.mp3/.m4a/.wav)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--transcribe", action="store_true", help="Medir también la transcripción real (Whisper)")
+    args = parser.parse_args()
+
+    if ffmpeg_path() is None:
+        print("❌ ffmpeg no disponible (FFMPEG_BIN)")
+        sys.exit(1)
+    fixtures_dir = args.fixtures
+    if fixtures_dir is None:
+        fixtures_dir = "bench/audio"
+        generate_fixtures(fixtures_dir)
+    paths = sorted(p for ext in ("ogg", "opus", "mp3", "m4a", "wav") for p in glob.glob(os.path.join(fixtures_dir, f"*.{ext}")))
+    if not paths:
+        print(f"❌ Sin audios en {fixtures_dir}")
+        sys.exit(1)
+
+    header = f"{'audio':<16}{'dur(s)':>8}{'voz(s)':>8}{'bytes':>10}{'subidos':>10}{'ahorro':>8}{'trozos':>7}{'prep(ms)':>10}"
+    if args.transcribe:
+        header += f"{'e2e sin(s)':>12}{'e2e con(s)':>12}"
+    print(header)
+    total_raw = total_up = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(path)
+        prep_times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            prepared = prepare_audio(data, name)
+            prep_times.append(time.perf_counter() - start)
+        total_raw += prepared.raw_bytes
+        total_up += prepared.uploaded_bytes
+        saved = 1 - prepared.uploaded_bytes / prepared.raw_bytes if prepared.raw_bytes else 0.0
+        line = (f"{name:<16}{prepared.original_seconds:>8.1f}{prepared.speech_seconds:>8.1f}{prepared.raw_bytes:>10}"
+                f"{prepared.uploaded_bytes:>10}{saved:>8.0%}{len(prepared.chunks):>7}{statistics.median(prep_times) * 1000:>10.0f}")
+        if args.transcribe:
+            line += f"{_transcribe_seconds(data, name, False, args.repeat):>12.2f}{_transcribe_seconds(data, name, True, args.repeat):>12.2f}"
+        print(line)
+    if total_raw:
+        print(f"\nTotal: {total_raw} -> {total_up} bytes subidos ({1 - total_up / total_raw:.0%} menos)")
+
+
+if __name__ == "__main__":
+    main()
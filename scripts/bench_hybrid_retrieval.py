@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark de calidad + latencia: denso vs BM25 vs híbrido sobre catalog_kb.
+
+El archivo de consultas es JSONL con una consulta etiquetada por línea:
+    {"query": "zapatos negros talla 38", "relevant": ["ZP-038-NEG"]}
+`relevant` contiene SKUs o ids de producto/punto considerados correctos.
+
+Uso:
+    python scripts/bench_hybrid_retrieval.py --queries bench/queries.jsonl --k 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.vector.vector import get_qdrant_collection  # noqa: E402
+from app.vector.bm25 import get_bm25_index  # noqa: E402
+from app.vector.hybrid import HybridRetriever, _bm25_docs  # noqa: E402
+
+
+def _ids(doc):
+    meta = doc.metadata or {}
+    return {str(v) for v in (meta.get("sku"), meta.get("product_id"), meta.get("_id")) if v is not None}
+
+
+def _score(docs, relevant):
+    relevant = {str(r) for r in relevant}
+    for rank, d in enumerate(docs, start=1):
+        if _ids(d) & relevant:
+            return 1.0, 1.0 / rank
+    return 0.0, 0.0
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", required=True)
+    parser.add_argument("--collection", default="catalog_kb")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.queries, encoding="utf-8") as fh:
+        queries = [json.loads(line) for line in fh if line.strip()]
+
+    index = get_bm25_index(args.collection)
+    if index is None:
+        print("❌ No hay índice BM25; ejecuta primero scripts/build_bm25_index.py")
+        sys.exit(1)
+
+    vs = get_qdrant_collection(args.collection)
+    hybrid = HybridRetriever(args.collection, vs, k=args.k)
+    engines = {
+        "dense": lambda q: vs.similarity_search(q, k=args.k),
+        "bm25": lambda q: _bm25_docs(index, [i for i, _ in index.search(q, k=args.k)]),
+        "hybrid": hybrid.get_relevant_documents,
+    }
+
+    print(f"Consultas: {len(queries)} | k={args.k} | docs en índice: {len(index)}\n")
+    print(f"{'engine':<8} {'recall@k':>9} {'MRR':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, fn in engines.items():
+        hits, rr, lat = [], [], []
+        for item in queries:
+            start = time.perf_counter()
+            docs = fn(item["query"])
+            lat.append(time.perf_counter() - start)
+            h, r = _score(docs, item.get("relevant", []))
+            hits.append(h)
+            rr.append(r)
+        print(f"{name:<8} {statistics.mean(hits):>9.3f} {statistics.mean(rr):>7.3f} "
+              f"{_pct(lat, 0.5):>8.1f} {_pct(lat, 0.95):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pipeline de imágenes (app/image_prep.py + app/ocr.py).
+
+Antes: toda imagen va tal cual al modelo de visión.
+Después: documentos legibles se resuelven con OCR local; el resto va al
+modelo de visión reescalada y en JPEG.
+
+Por imagen mide bytes enviados, nivel elegido (local / vision), confianza y
+latencia del OCR local, tokens de imagen y costo de entrada estimado. Con
+--vision además mide la latencia real antes/después (llamadas al modelo).
+
+Sin --fixtures genera imágenes sintéticas (comprobante fotografiado, captura
+de pantalla, foto de producto) en bench/images/.
+
+Uso:
+    python scripts/bench_image_ocr.py
+    python scripts/bench_image_ocr.py --fixtures bench/images --vision --price-per-mtok 0.15
+"""
+
+import argparse
+import glob
+import mimetypes
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from app.image_prep import open_image, prepare_image, vision_tokens  # noqa: E402
+from app.ocr import OCR_MIN_CONFIDENCE, OCR_MIN_WORDS, _vision_ocr, extract_text, local_ocr, local_ocr_available, looks_text_dense  # noqa: E402
+
+RECEIPT_LINES = [
+    "COMPROBANTE DE TRANSFERENCIA",
+    "Fecha: 12/03/2025 14:32",
+    "Operacion N° 48213377",
+    "Origen: Cuenta corriente ****4821",
+    "Destino: Tienda Online SpA",
+    "Monto: $ 45.990",
+    "Estado: Aprobada",
+]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def generate_fixtures(out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(3)
+
+    path = os.path.join(out_dir, "comprobante.jpg")
+    if not os.path.exists(path):
+        img = Image.new("RGB", (2448, 3264), (246, 244, 238))
+        draw = ImageDraw.Draw(img)
+        for i, line in enumerate(RECEIPT_LINES):
+            draw.text((180, 400 + i * 170), line, fill=(25, 25, 25), font=_font(90))
+        noisy = np.clip(np.asarray(img, dtype=np.int16) + rng.normal(0, 6, (3264, 2448, 1)), 0, 255).astype(np.uint8)
+        Image.fromarray(noisy).save(path, quality=92)
+
+    path = os.path.join(out_dir, "captura.png")
+    if not os.path.exists(path):
+        img = Image.new("RGB", (1170, 2532), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for i in range(14):
+            y = 200 + i * 160
+            draw.rounded_rectangle((60, y, 1000, y + 120), radius=30, fill=(230, 236, 243))
+            draw.text((100, y + 35), f"Hola, quiero saber el estado del pedido 10{i:02d}", fill=(20, 20, 20), font=_font(44))
+        img.save(path)
+
+    path = os.path.join(out_dir, "producto.jpg")
+    if not os.path.exists(path):
+        y, x = np.mgrid[0:4000, 0:3000]
+        base = np.stack([120 + 80 * np.sin(x / 400), 90 + 60 * np.cos(y / 500), 140 + 50 * np.sin((x + y) / 700)], axis=-1)
+        photo = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+        Image.fromarray(photo).save(path, quality=90)
+
+
+def _median_seconds(fn, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=None, help="Directorio con imágenes (.jpg/.jpeg/.png/.webp)")
+    parser.add_argument("--model", default=os.getenv("OCR_MODEL", "gpt-4o-mini"))
+    parser.add_argument("--price-per-mtok", type=float, default=0.15, help="USD por millón de tokens de entrada del modelo")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--vision", action="store_true", help="Medir también la latencia real del modelo de visión")
+    args = parser.parse_args()
+
+    fixtures_dir = args.fixtures
+    if fixtures_dir is None:
+        fixtures_dir = "bench/images"
+        generate_fixtures(fixtures_dir)
+    paths = sorted(p for ext in ("jpg", "jpeg", "png", "webp") for p in glob.glob(os.path.join(fixtures_dir, f"*.{ext}")))
+    if not paths:
+        print(f"❌ Sin imágenes en {fixtures_dir}")
+        sys.exit(1)
+    if not local_ocr_available():
+        print("⚠️  Tesseract no disponible: todas las imágenes irán al modelo de visión")
+
+    header = f"{'imagen':<18}{'bytes':>10}{'enviados':>10}{'nivel':>8}{'conf':>6}{'local(ms)':>10}{'tokens antes':>14}{'después':>9}"
+    if args.vision:
+        header += f"{'antes(s)':>10}{'después(s)':>11}"
+    print(header)
+    totals = {"raw": 0, "sent": 0, "tokens_before": 0, "tokens_after": 0}
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or "image/jpeg"
+        image = open_image(data)
+        tokens_before = vision_tokens(image.width, image.height, args.model)
+
+        tier, confidence, local_ms = "vision", float("nan"), 0.0
+        if local_ocr_available() and looks_text_dense(image):
+            seconds, (_text, confidence, words) = _median_seconds(lambda: local_ocr(image), args.repeat)
+            local_ms = seconds * 1000
+            if confidence >= OCR_MIN_CONFIDENCE and words >= OCR_MIN_WORDS:
+                tier = "local"
+        if tier == "local":
+            sent, tokens_after = 0, 0
+        else:
+            prepared = prepare_image(data, mimetype, image)
+            sent, tokens_after = len(prepared.data), vision_tokens(prepared.width, prepared.height, args.model)
+
+        totals["raw"] += len(data)
+        totals["sent"] += sent
+        totals["tokens_before"] += tokens_before
+        totals["tokens_after"] += tokens_after
+        line = (f"{os.path.basename(path):<18}{len(data):>10}{sent:>10}{tier:>8}{confidence:>6.0f}{local_ms:>10.0f}"
+                f"{tokens_before:>14}{tokens_after:>9}")
+        if args.vision:
+            before, _ = _median_seconds(lambda: _vision_ocr(data, mimetype, args.model, tokens_before + 600), args.repeat)
+            after, _ = _median_seconds(lambda: extract_text(data, mimetype, args.model), args.repeat)
+            line += f"{before:>10.2f}{after:>11.2f}"
+        print(line)
+
+    price = args.price_per_mtok / 1_000_000
+    print(f"\nBytes al modelo: {totals['raw']} -> {totals['sent']} "
+          f"({1 - totals['sent'] / totals['raw']:.0%} menos)")
+    print(f"Tokens de imagen: {totals['tokens_before']} -> {totals['tokens_after']}; costo de entrada "
+          f"${totals['tokens_before'] * price:.5f} -> ${totals['tokens_after'] * price:.5f} por lote")
+
+
+if __name__ == "__main__":
+    main()
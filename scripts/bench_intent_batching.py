@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark de clasificación de intención: llamadas individuales vs por lotes.
+
+Lanza N clasificaciones con distintos niveles de concurrencia (sesiones
+simultáneas) y compara throughput, latencia por petición (p50/p95) y número
+de llamadas al LLM. Usa el modelo del router configurado (ROUTER_MODEL o
+MODEL_NAME) y hace llamadas reales a OpenAI.
+
+El archivo de mensajes es texto plano (un mensaje por línea) o JSONL con
+{"text": "...", "context": "..."}.
+
+Uso:
+    python scripts/bench_intent_batching.py --messages bench/messages.txt --n 64 --concurrency 1,8,32
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.intent_batcher import IntentBatcher  # noqa: E402
+from app.llm_utils import make_stage_llms  # noqa: E402
+from app.router import make_router  # noqa: E402
+
+SAMPLE_MESSAGES = [
+    "Hola, buenas tardes",
+    "¿Tienen zapatos negros talla 38?",
+    "¿Dónde está mi pedido 1234?",
+    "¿Qué métodos de pago tienen?",
+    "Quiero comprar la pulsera dorada",
+    "Quiero hablar con una persona",
+    "mi correo es ana@example.com",
+    "¿Cuánto tarda el envío a Arequipa?",
+]
+
+
+def _load(path):
+    if not path:
+        return [{"text": t, "context": ""} for t in SAMPLE_MESSAGES]
+    items = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                obj = json.loads(line)
+                items.append({"text": obj["text"], "context": obj.get("context", "")})
+            else:
+                items.append({"text": line, "context": ""})
+    return items
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+
+
+def _run(fn, items, n, concurrency):
+    latencies = []
+
+    def one(i):
+        item = items[i % len(items)]
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", default=None)
+    parser.add_argument("--n", type=int, default=64, help="Clasificaciones por nivel de concurrencia")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--wait-ms", type=float, default=8)
+    parser.add_argument("--max-batch", type=int, default=16)
+    args = parser.parse_args()
+
+    items = _load(args.messages)
+    llms = make_stage_llms()
+    router, _, _ = make_router(llms["router"], summary_llm=llms["summary"])
+
+    single_calls = []  # list.append es atómico entre hilos
+
+    def single(item):
+        single_calls.append(1)
+        return router.invoke({"input": item["text"], "context": item["context"]})
+
+    def batched(item):
+        intent = batcher.classify(item["text"], item["context"])
+        if intent is None:
+            return single(item)
+        return intent
+
+    print(f"{'conc':>5} {'modo':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'llamadas':>9}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for mode in ("single", "batched"):
+            single_calls.clear()
+            batcher = IntentBatcher(llms["router"], max_wait_ms=args.wait_ms, max_batch=args.max_batch)
+            flushes = []
+            original_flush = batcher._flush
+            batcher._flush = lambda batch: (flushes.append(len(batch)), original_flush(batch))
+            elapsed, latencies = _run(single if mode == "single" else batched, items, args.n, concurrency)
+            llm_calls = len(single_calls) + sum(1 for size in flushes if size > 1)
+            print(
+                f"{concurrency:>5} {mode:<8} {args.n / elapsed:>8.1f} {_pct(latencies, 0.5):>8.0f} "
+                f"{_pct(latencies, 0.95):>8.0f} {llm_calls:>9}"
+            )
+        print(f"{'':>5} (lote medio: {statistics.mean(flushes) if flushes else 0:.1f})")
+
+
+if __name__ == "__main__":
+    main()
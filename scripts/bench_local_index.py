@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia: índice en proceso (NumPy) vs Qdrant, por tamaño de colección.
+
+Para cada tamaño crea una colección temporal en Qdrant con vectores
+aleatorios, construye el mismo índice local y mide top-k con los mismos
+vectores de consulta (sin coste de embedding). La colección temporal se
+borra al terminar.
+
+Uso:
+    python scripts/bench_local_index.py --sizes 100,500,2000,10000,50000 --dim 1536 --queries 200
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from qdrant_client.http import models as qm  # noqa: E402
+
+from app.vector.local_index import LocalVectorIndex  # noqa: E402
+from app.vector.vector import _client  # noqa: E402
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+
+
+def _time(fn, queries):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_size(client, size: int, dim: int, n_queries: int, k: int):
+    rng = np.random.default_rng(size)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32)
+    queries = rng.standard_normal((n_queries, dim), dtype=np.float32)
+    collection = f"bench_local_{uuid.uuid4().hex[:8]}"
+
+    client.create_collection(collection, vectors_config=qm.VectorParams(size=dim, distance=qm.Distance.COSINE))
+    try:
+        for start in range(0, size, 512):
+            batch = vectors[start:start + 512]
+            client.upsert(collection, points=[
+                qm.PointStruct(id=start + i, vector=v.tolist(), payload={"page_content": str(start + i)})
+                for i, v in enumerate(batch)
+            ])
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        local = LocalVectorIndex(normalized, [{"page_content": str(i)} for i in range(size)])
+
+        local_lat = _time(lambda q: local.search_by_vector(q, k), queries)
+        qdrant_lat = _time(lambda q: client.search(collection, query_vector=q.tolist(), limit=k), queries)
+
+        # Mismos resultados: el índice local debe coincidir con Qdrant (top-1)
+        agree = sum(
+            local.search_by_vector(q, 1)[0][0].page_content == str(client.search(collection, query_vector=q.tolist(), limit=1)[0].id)
+            for q in queries[:20]
+        )
+        return local_lat, qdrant_lat, agree / min(20, len(queries))
+    finally:
+        client.delete_collection(collection)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,500,2000,10000,50000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    client = _client()
+    print(f"{'puntos':>8} {'local p50':>10} {'local p95':>10} {'qdrant p50':>11} {'qdrant p95':>11} {'top1 =':>7}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        local_lat, qdrant_lat, agree = bench_size(client, size, args.dim, args.queries, args.k)
+        print(
+            f"{size:>8} {_pct(local_lat, 0.5):>9.2f}ms {_pct(local_lat, 0.95):>9.2f}ms "
+            f"{_pct(qdrant_lat, 0.5):>10.2f}ms {_pct(qdrant_lat, 0.95):>10.2f}ms {agree:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark de perfiles de pipeline: nodos ejecutados y latencia por intención.
+
+Ejecuta cada mensaje contra dos grafos compilados —perfiles actuales
+(PIPELINE_PROFILES / SYNTHESIZER_ENABLED) y pipeline completo
+(handler -> synthesize -> guardrail)— y agrupa por la intención clasificada.
+Hace llamadas reales (router, agentes, guardrail).
+
+Uso:
+    python scripts/bench_pipeline_profiles.py --messages bench/messages.txt --repeat 3
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from app.graph import FULL_PROFILES, _run_config, build_graph, resolve_profiles  # noqa: E402
+
+SAMPLE_MESSAGES = [
+    "Hola, buenas tardes",
+    "¿Tienen zapatos negros talla 38?",
+    "¿Qué métodos de pago tienen?",
+    "¿Dónde está mi pedido 1234?",
+    "Quiero hablar con una persona",
+]
+
+
+def _initial_state(text: str, i: int):
+    return {
+        "messages": [HumanMessage(content=text)],
+        "intent": "",
+        "session_id": f"bench-pipeline-{i}",
+        "context_summary": "",
+        "raw_output": "",
+        "final_output": "",
+        "disable_guardrail": False,
+        "flow": None,
+        "flow_bypass": False,
+    }
+
+
+async def _run(graph, text: str, i: int):
+    nodes = []
+    intent = ""
+    start = time.perf_counter()
+    async for update in graph.astream(_initial_state(text, i), config=_run_config([]), stream_mode="updates"):
+        for node, output in update.items():
+            nodes.append(node)
+            if node == "classify_intent" and isinstance(output, dict):
+                intent = output.get("intent", "")
+    return intent, len(nodes), time.perf_counter() - start
+
+
+async def main_async(messages, repeat):
+    graphs = {
+        "perfil": build_graph().compile(),
+        "completo": build_graph(FULL_PROFILES, synthesizer=True).compile(),
+    }
+    results = defaultdict(lambda: defaultdict(list))  # intent -> modo -> [(nodos, s)]
+    i = 0
+    for _ in range(repeat):
+        for text in messages:
+            for mode, graph in graphs.items():
+                intent, count, elapsed = await _run(graph, text, i)
+                results[intent][mode].append((count, elapsed))
+                i += 1
+
+    print("Perfiles efectivos:")
+    for node, steps in resolve_profiles().items():
+        print(f"  {node:<18} -> {' -> '.join(steps) or 'END'}")
+    print(f"\n{'intención':<18} {'modo':<9} {'nodos':>5} {'p50 ms':>8} {'media ms':>9}")
+    for intent in sorted(results):
+        for mode in graphs:
+            runs = results[intent][mode]
+            if not runs:
+                continue
+            latencies = sorted(r[1] for r in runs)
+            print(
+                f"{intent:<18} {mode:<9} {runs[0][0]:>5} {latencies[len(latencies) // 2] * 1000:>8.0f} "
+                f"{statistics.mean(latencies) * 1000:>9.0f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", default=None, help="Un mensaje por línea")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    messages = SAMPLE_MESSAGES
+    if args.messages:
+        with open(args.messages, encoding="utf-8") as fh:
+            messages = [line.strip() for line in fh if line.strip()]
+    asyncio.run(main_async(messages, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
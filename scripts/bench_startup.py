@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark de arranque en frío.
+
+1. Tiempo de `import app.main` medido con `python -X importtime` (proceso nuevo),
+   con los módulos más costosos por tiempo acumulado.
+2. Tiempo del warm-up del lifespan (compilación del grafo, runtime, prompts, pools).
+
+Uso:
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --top 25 --budget-ms 800   # falla si el import supera el presupuesto
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def measure_importtime(module: str):
+    """Ejecuta `python -X importtime -c 'import <module>'` y parsea stderr."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit(f"❌ Falló import {module}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+            # El nombre conserva la sangría (2 espacios por nivel de anidación)
+            rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+        except ValueError:
+            continue
+    total_us = max((r[0] for r in rows if not r[2].startswith(" ")), default=0)
+    return wall, total_us, rows
+
+
+def measure_warmup():
+    sys.path.insert(0, ROOT)
+    import app.main as main
+
+    async def run():
+        start = time.perf_counter()
+        async with main.lifespan(main.app):
+            elapsed = time.perf_counter() - start
+        return elapsed
+
+    return asyncio.run(run()), dict(main._startup_timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Máximo permitido para el import")
+    parser.add_argument("--skip-warmup", action="store_true")
+    args = parser.parse_args()
+
+    wall, total_us, rows = measure_importtime(args.module)
+    print(f"Import {args.module}: {total_us / 1000:.1f} ms (proceso completo: {wall * 1000:.0f} ms)\n")
+    print(f"{'cumulative ms':>13} {'self ms':>8}  módulo")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {name.strip()}")
+
+    if not args.skip_warmup:
+        elapsed, phases = measure_warmup()
+        print(f"\nWarm-up del lifespan: {elapsed * 1000:.0f} ms")
+        for phase, seconds in phases.items():
+            print(f"  {phase:<14} {seconds * 1000:>8.0f} ms")
+
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        raise SystemExit(f"❌ Import de {args.module} supera el presupuesto de {args.budget_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
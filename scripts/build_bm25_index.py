@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Construye (o refresca) el índice BM25 local de una colección Qdrant e
+incrementa su versión (`kbver:`), lo que invalida la caché de recuperación y
+regenera el índice local en memoria (app/vector/local_index.py). Es el paso a
+correr después de cargar una colección por fuera (other_kb).
+
+Uso:
+    python scripts/build_bm25_index.py                # catalog_kb
+    python scripts/build_bm25_index.py --collection other_kb
+    python scripts/build_bm25_index.py --collection other_kb --no-bm25   # solo la versión
+
+Los procesos en ejecución detectan el nuevo archivo (mtime) y lo recargan
+en la siguiente consulta, así que no hace falta reiniciar el servicio.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.vector.vector import _client  # noqa: E402
+from app.vector.bm25 import build_and_save  # noqa: E402
+from app.vector.retrieval_cache import bump_collection_version  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice BM25 local desde Qdrant")
+    parser.add_argument("--collection", default="catalog_kb")
+    parser.add_argument("--no-bm25", action="store_true", help="Solo incrementar la versión de la colección")
+    args = parser.parse_args()
+
+    start = time.time()
+    try:
+        if not args.no_bm25:
+            build_and_save(_client(), args.collection)
+            print(f"✅ Índice construido en {time.time() - start:.2f}s")
+    finally:
+        version = bump_collection_version(args.collection)
+        print(f"✅ Versión de '{args.collection}': {version}")
+
+
+if __name__ == "__main__":
+    main()
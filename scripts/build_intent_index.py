@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Construye (o refresca) el índice k-NN de intenciones.
+
+Parte de los ejemplos semilla del ROUTER_PROMPT y añade los JSONL indicados
+(p. ej. exportados de logs de producción), uno por línea:
+    {"text": "tienen sandalias talla 37?", "intent": "consulta_producto"}
+
+Uso:
+    python scripts/build_intent_index.py
+    python scripts/build_intent_index.py --examples data/intents/produccion.jsonl
+    python scripts/build_intent_index.py --eval data/intents/holdout.jsonl   # precisión por umbral
+
+Los workers detectan el nuevo labels.json (mtime) y recargan el índice sin reiniciar.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.intent_knn import build_index, get_knn_classifier, load_examples  # noqa: E402
+
+
+def evaluate(path: str):
+    classifier = get_knn_classifier()
+    with open(path, encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh if line.strip()]
+    predictions = []
+    start = time.perf_counter()
+    for row in rows:
+        intent, confidence = classifier.predict(row["text"])
+        predictions.append((confidence, intent == row["intent"]))
+    per_query_ms = (time.perf_counter() - start) / max(len(rows), 1) * 1000
+    print(f"\n{len(rows)} consultas, {per_query_ms:.1f} ms/consulta")
+    print(f"{'umbral':>7} {'cobertura':>10} {'precisión':>10}")
+    for threshold in (0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9):
+        covered = [ok for confidence, ok in predictions if confidence >= threshold]
+        coverage = len(covered) / len(predictions) if predictions else 0.0
+        precision = sum(covered) / len(covered) if covered else 0.0
+        print(f"{threshold:>7.2f} {coverage:>10.1%} {precision:>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice k-NN de intenciones")
+    parser.add_argument("--examples", nargs="*", default=[], help="JSONL con ejemplos etiquetados adicionales")
+    parser.add_argument("--eval", default=None, help="JSONL etiquetado para medir cobertura/precisión por umbral")
+    args = parser.parse_args()
+
+    start = time.time()
+    examples = load_examples(args.examples)
+    count = build_index(examples)
+    print(f"✅ {count} ejemplos indexados en {time.time() - start:.2f}s")
+
+    if args.eval:
+        evaluate(args.eval)
+
+
+if __name__ == "__main__":
+    main()
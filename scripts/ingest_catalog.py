@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Sincroniza el catálogo de WooCommerce con la colección Qdrant `catalog_kb`.
+
+Uso:
+    python scripts/ingest_catalog.py                 # incremental (desde el checkpoint)
+    python scripts/ingest_catalog.py --full          # reconstrucción completa; borra lo que no se re-emitió
+    python scripts/ingest_catalog.py --prune         # incremental + elimina productos borrados
+
+Requiere WC_URL, WC_KEY, WC_SECRET, QDRANT_URL y OPENAI_API_KEY en el entorno.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.vector.ingest import INGEST_CONCURRENCY, INGEST_EMBED_BATCH, sync_catalog  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta WooCommerce -> Qdrant")
+    parser.add_argument("--collection", default="catalog_kb")
+    parser.add_argument("--full", action="store_true", help="Ignora el checkpoint y reprocesa todo")
+    parser.add_argument("--prune", action="store_true", help="Elimina productos que ya no existen")
+    parser.add_argument("--no-bm25", action="store_true", help="No reconstruir el índice BM25 al final")
+    parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH)
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    args = parser.parse_args()
+
+    summary = sync_catalog(
+        collection=args.collection,
+        full=args.full,
+        prune=args.prune,
+        rebuild_bm25=not args.no_bm25,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    print("✅ Ingesta terminada:")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Migra en caliente los valores JSON legados de Redis al codec compacto (app/codec.py).
+
+- Historial (`message_store:*`, listas): cada entrada legada se reescribe como
+  mensaje compacto. La lista se reemplaza con WATCH/MULTI: si otra réplica
+  escribe a la vez, se reintenta esa clave. Conserva el TTL.
+- Flujo (`flow:*`) y cachés (`woo:*`, `ret:*`): strings; SET ... KEEPTTL.
+
+La app lee ambos formatos, así que la migración es opcional y puede correr
+con tráfico; `agent_orchestrator_codec_legacy_reads_total` baja a 0 al terminar.
+
+Uso:
+    python scripts/migrate_redis_codec.py --dry-run
+    python scripts/migrate_redis_codec.py --patterns "message_store:*,flow:*"
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import redis  # noqa: E402
+
+from app.cache import REDIS_URL  # noqa: E402
+from app.codec import decode, decode_message, encode, encode_message, is_legacy  # noqa: E402
+
+DEFAULT_PATTERNS = "message_store:*,flow:*,woo:*,ret:*"
+
+
+def migrate_list(client, key: str, dry_run: bool):
+    """(bytes antes, bytes después) de una lista de historial."""
+    while True:
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                entries = pipe.lrange(key, 0, -1)
+                if not any(is_legacy(e) for e in entries):
+                    pipe.unwatch()
+                    return 0, 0
+                new = [encode_message(decode_message(e, "migration")) if is_legacy(e) else e for e in entries]
+                before, after = sum(map(len, entries)), sum(map(len, new))
+                if dry_run:
+                    pipe.unwatch()
+                    return before, after
+                ttl = pipe.pttl(key)
+                pipe.multi()
+                pipe.delete(key)
+                # LRANGE devuelve el orden de la lista (LPUSH: más nuevo primero); RPUSH lo conserva
+                pipe.rpush(key, *new)
+                if ttl and ttl > 0:
+                    pipe.pexpire(key, ttl)
+                pipe.execute()
+                return before, after
+            except redis.WatchError:
+                continue
+
+
+def migrate_string(client, key: str, dry_run: bool):
+    raw = client.get(key)
+    if not raw or not is_legacy(raw):
+        return 0, 0
+    new = encode(decode(raw, "migration"))
+    if not dry_run:
+        # Solo si nadie lo reescribió entretanto
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != raw:
+                    return 0, 0
+                pipe.multi()
+                pipe.set(key, new, keepttl=True)
+                pipe.execute()
+            except redis.WatchError:
+                return 0, 0
+    return len(raw), len(new)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", default=DEFAULT_PATTERNS)
+    parser.add_argument("--dry-run", action="store_true", help="Solo medir el ahorro, sin escribir")
+    parser.add_argument("--scan-count", type=int, default=500)
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(REDIS_URL)
+    client.ping()
+    for pattern in [p.strip() for p in args.patterns.split(",") if p.strip()]:
+        keys = migrated = before = after = 0
+        for key in client.scan_iter(match=pattern, count=args.scan_count):
+            keys += 1
+            kind = client.type(key)
+            if kind == b"list":
+                b, a = migrate_list(client, key, args.dry_run)
+            elif kind == b"string":
+                b, a = migrate_string(client, key, args.dry_run)
+            else:
+                continue
+            if b:
+                migrated += 1
+                before += b
+                after += a
+        saved = (1 - after / before) if before else 0.0
+        print(f"{pattern:<18} claves={keys:>7} legadas={migrated:>7} "
+              f"bytes {before:>10} -> {after:>10} ({saved:.0%} menos){' [dry-run]' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
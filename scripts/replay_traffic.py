@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Replay del tráfico capturado (app/traffic_capture.py) contra una instancia local.
+
+Lee los capture-*.jsonl y re-envía cada request a --target respetando los
+tiempos de llegada originales (divididos por --speed: 2 = el doble de rápido,
+0 = todo de una). Cada request lleva X-Replay-Id con el id grabado.
+
+Las dependencias downstream se sirven desde un stub en --stub-port que
+devuelve lo grabado para ese request (y con la misma latencia, salvo
+--no-latency):
+- agentes HTTP (cualquier POST): por (replay id, path, orden de llamada),
+- LLM (/v1/chat/completions, también en streaming SSE): por (replay id,
+  etapa X-Replay-Stage, orden),
+- embeddings (/v1/embeddings): vector determinista por texto,
+- webhooks salientes (/sink): se aceptan y se cuentan.
+Lo que el stub no encuentra se cuenta como "miss" (el agente responde vacío).
+
+La instancia local se levanta con el stub como destino de todo:
+
+    REPLAY_MODE=true
+    OPENAI_BASE_URL=http://localhost:9100/v1
+    AGENT_PRODUCTS_URL=http://localhost:9100   (y AGENT_PEDIDOS/OTROS/SALUDOS/PAGOS_URL)
+    CHATWOOT_BOT_WEBHOOK_URL=http://localhost:9100/sink
+    CHATWOOT_URL=http://localhost:9100
+    INTENT_BATCHING=false   (el lote mezcla requests: el stub no podría asignar respuestas)
+    WC_URL=                 (sin WooCommerce real)
+    CAPTURE_ENABLED=false
+
+Sin los bytes del media (CAPTURE_MEDIA=false, o sin --media) se envía el
+texto ya transcrito/extraído, así el replay no depende de Whisper ni del OCR.
+
+Uso:
+    python scripts/replay_traffic.py data/capture --target http://localhost:8000 --speed 1
+    python scripts/replay_traffic.py data/capture/capture-20250312-*.jsonl --speed 4 --limit 500
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx  # noqa: E402
+
+from app.traffic_capture import REPLAY_HEADER, REPLAY_STAGE_HEADER  # noqa: E402
+
+
+def load_records(paths: List[str], limit: Optional[int]) -> List[Dict[str, Any]]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "capture-*.jsonl"))))
+        else:
+            files.extend(sorted(glob.glob(path)))
+    records = []
+    for name in files:
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+class StubState:
+    """Respuestas grabadas por request, consumidas en el orden en que se pidieron."""
+
+    def __init__(self, records: List[Dict[str, Any]], latency: bool):
+        self.latency = latency
+        self.queues: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+        for record in records:
+            for call in record.get("downstream", []):
+                self.queues[(record["id"], call["kind"], call["target"])].append(call)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = defaultdict(int)
+        self.sink = 0
+
+    def take(self, replay_id: Optional[str], kind: str, target: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            queue = self.queues.get((replay_id, kind, target))
+            if not queue:
+                self.misses[f"{kind}:{target}"] += 1
+                return None
+            self.hits += 1
+            return queue.pop(0)
+
+
+def _completion(call: Dict[str, Any], model: str) -> Dict[str, Any]:
+    response = call["response"]
+    message = {"role": "assistant", "content": response.get("content") or ""}
+    if response.get("tool_calls"):
+        message["tool_calls"] = response["tool_calls"]
+    return {
+        "id": "chatcmpl-replay",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if response.get("tool_calls") else "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _sse_chunks(content: str, model: str):
+    base = {"id": "chatcmpl-replay", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    # Trozos de ~20 caracteres: suficiente para ejercitar el streaming por segmentos
+    for i in range(0, len(content), 20):
+        yield "data: " + json.dumps({**base, "choices": [{"index": 0, "delta": {"content": content[i:i + 20]}, "finish_reason": None}]}) + "\n\n"
+    yield "data: " + json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _embedding(text: str, dims: int) -> List[float]:
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(seed[i % len(seed)] - 128) / 128.0 for i in range(dims)]
+
+
+def build_stub(state: StubState):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    stub = FastAPI(title="replay stub")
+
+    async def _sleep(call: Dict[str, Any]):
+        if state.latency:
+            await asyncio.sleep(call["latency"])
+
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "replay")
+        call = state.take(request.headers.get(REPLAY_HEADER), "llm", request.headers.get(REPLAY_STAGE_HEADER, "default"))
+        if call is None:
+            call = {"latency": 0.0, "response": {"content": ""}}
+        await _sleep(call)
+        if body.get("stream"):
+            return StreamingResponse(_sse_chunks(call["response"].get("content") or "", model), media_type="text/event-stream")
+        return _completion(call, model)
+
+    @stub.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        dims = body.get("dimensions") or 1536
+        return {
+            "object": "list",
+            "model": body.get("model", "replay"),
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(str(t), dims)} for i, t in enumerate(inputs)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @stub.post("/sink")
+    async def sink():
+        state.sink += 1
+        return {"ok": True}
+
+    @stub.api_route("/{path:path}", methods=["GET", "POST"])
+    async def agent(path: str, request: Request):
+        call = state.take(request.headers.get(REPLAY_HEADER), "agent", "/" + path)
+        if call is None:
+            return JSONResponse({"result": ""}, status_code=200 if request.method == "POST" else 404)
+        await _sleep(call)
+        return call["response"]
+
+    return stub
+
+
+def start_stub(state: StubState, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(build_stub(state), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def send(client: httpx.AsyncClient, target: str, record: Dict[str, Any], media_dir: Optional[str]) -> Dict[str, Any]:
+    url = target.rstrip("/") + record["endpoint"]
+    headers = {REPLAY_HEADER: record["id"]}
+    params = record.get("query") or {}
+    media = record.get("media") or {}
+    blob = None
+    if media_dir and media.get("sha256"):
+        path = os.path.join(media_dir, media["sha256"])
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                blob = f.read()
+    start = time.perf_counter()
+    try:
+        if blob is not None:
+            resp = await client.post(
+                url, params=params, headers=headers,
+                data={"session_id": record["session"], "mimetype": media.get("mimetype") or "",
+                      "filename": "replay" + (record.get("filename_ext") or "")},
+                files={"file": ("replay" + (record.get("filename_ext") or ""), blob, media.get("mimetype") or "application/octet-stream")},
+            )
+        else:
+            text = record.get("text") if "media" not in record else record.get("processed_text")
+            resp = await client.post(url, params=params, headers=headers, json={"session_id": record["session"], "text": text or ""})
+        # En /webhook/stream la latencia es la del stream completo
+        await resp.aread()
+        status = resp.status_code
+    except Exception as e:
+        print(f"[WARN] {record['id']}: {e}")
+        status = 0
+    return {"id": record["id"], "status": status, "latency": time.perf_counter() - start, "original": record.get("latency")}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def replay(records: List[Dict[str, Any]], target: str, speed: float, media_dir: Optional[str], timeout: float) -> List[Dict[str, Any]]:
+    t0 = records[0]["ts"]
+    loop_start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=timeout) as client:
+
+        async def scheduled(record):
+            if speed > 0:
+                delay = (record["ts"] - t0) / speed - (time.perf_counter() - loop_start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            return await send(client, target, record, media_dir)
+
+        return await asyncio.gather(*(scheduled(r) for r in records))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Directorios de captura o archivos capture-*.jsonl (globs)")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de velocidad (1 = original, 0 = sin esperas)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--no-stub", action="store_true", help="No levantar el stub (downstream reales)")
+    parser.add_argument("--no-latency", action="store_true", help="El stub responde sin la latencia grabada")
+    parser.add_argument("--media", action="store_true", help="Enviar los bytes del media si están en <captura>/media")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", default=None, help="JSONL con el resultado por request")
+    args = parser.parse_args()
+
+    records = load_records(args.paths, args.limit)
+    if not records:
+        print("❌ Sin requests capturados")
+        sys.exit(1)
+    state = StubState(records, latency=not args.no_latency)
+    server = None if args.no_stub else start_stub(state, args.stub_port)
+    media_dir = None
+    if args.media:
+        base = args.paths[0] if os.path.isdir(args.paths[0]) else os.path.dirname(args.paths[0])
+        media_dir = os.path.join(base, "media")
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Reproduciendo {len(records)} requests ({span:.0f}s originales, velocidad x{args.speed}) contra {args.target}")
+    start = time.perf_counter()
+    results = asyncio.run(replay(records, args.target, args.speed, media_dir, args.timeout))
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.should_exit = True
+
+    ok = [r for r in results if 200 <= r["status"] < 300]
+    latencies = [r["latency"] for r in ok]
+    original = [r["original"] for r in ok if r["original"] is not None]
+    statuses = defaultdict(int)
+    for r in results:
+        statuses[r["status"]] += 1
+    print(f"\nDuración: {elapsed:.1f}s  throughput: {len(results) / elapsed:.1f} req/s  estados: {dict(sorted(statuses.items()))}")
+    print(f"{'':<10}{'p50':>8}{'p95':>8}{'p99':>8}{'media':>8}")
+    print(f"{'replay':<10}" + "".join(f"{_percentile(latencies, q):>8.3f}" for q in (0.5, 0.95, 0.99))
+          + f"{statistics.mean(latencies) if latencies else float('nan'):>8.3f}")
+    if original:
+        print(f"{'original':<10}" + "".join(f"{_percentile(original, q):>8.3f}" for q in (0.5, 0.95, 0.99))
+              + f"{statistics.mean(original):>8.3f}")
+    if not args.no_stub:
+        print(f"\nStub: {state.hits} respuestas grabadas servidas, {state.sink} webhooks salientes")
+        if state.misses:
+            print("Sin respuesta grabada (miss): " + ", ".join(f"{k} x{v}" for k, v in sorted(state.misses.items())))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r) + "\n")
+
+
+if __name__ == "__main__":
+    main()
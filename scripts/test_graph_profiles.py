@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Pruebas offline de los perfiles de pipeline del grafo (app/graph.py).
+
+1. Con SYNTHESIZER_ENABLED=false (el default) cada handler termina con una
+   respuesta no vacía en `final_output`, pase o no por el guardrail.
+2. Lo mismo con synthesize activo y con el perfil completo.
+3. Un PIPELINE_PROFILES inválido se ignora con un aviso en vez de romper el arranque.
+
+Sin red: el clasificador, los tools de los agentes y el guardrail se reemplazan
+por dobles; no hace falta Redis ni OpenAI.
+
+Uso:
+    python scripts/test_graph_profiles.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+import app.graph as graph  # noqa: E402
+
+INTENTS = ["productos", "pedido", "otro", "saludo", "seguimiento", "humano"]
+
+
+class FakeTool:
+    def __init__(self, name: str):
+        self.name = name
+
+    async def _arun(self, query, **kwargs):
+        return f"respuesta de {self.name}"
+
+    def _run(self, query, **kwargs):
+        return f"respuesta de {self.name}"
+
+
+def _patch():
+    """Dobles para todo lo que sale del proceso; build_graph toma los nodos del módulo al construir."""
+    for name in ("products_tool", "orders_tool", "knowledge_tool", "greeting_tool", "tracking_tool", "human_tool"):
+        setattr(graph, name, FakeTool(name))
+    graph.enqueue_label = lambda *args, **kwargs: None
+    graph.classify_intent = lambda state: {"intent": state["intent"]}
+
+
+def _state(intent: str) -> dict:
+    return {
+        "messages": [HumanMessage(content="hola")],
+        "intent": intent,
+        "session_id": "test",
+        "context_summary": "",
+        "raw_output": "",
+        "final_output": "",
+        "flow": None,
+        "flow_bypass": False,
+        # El guardrail real llama al LLM: aquí se salta por request (el nodo igual corre)
+        "disable_guardrail": True,
+        "deadline": None,
+    }
+
+
+async def _replies(profiles=None, synthesizer=False) -> dict:
+    compiled = graph.build_graph(profiles, synthesizer).compile()
+    replies = {}
+    for intent in INTENTS:
+        result = await compiled.ainvoke(_state(intent))
+        replies[intent] = result.get("final_output")
+    return replies
+
+
+def _check(label: str, replies: dict) -> bool:
+    empty = [intent for intent, reply in replies.items() if not reply]
+    if empty:
+        print(f"❌ {label}: respuesta vacía para {empty}")
+        return False
+    print(f"✅ {label}: respuesta no vacía para las {len(replies)} intenciones")
+    return True
+
+
+def test_invalid_env_profiles() -> bool:
+    saved = os.environ.get("PIPELINE_PROFILES")
+    try:
+        os.environ["PIPELINE_PROFILES"] = "{no es json"
+        bad_json = graph._profiles_from_env()
+        os.environ["PIPELINE_PROFILES"] = '["guardrail"]'
+        bad_shape = graph._profiles_from_env()
+        os.environ["PIPELINE_PROFILES"] = '{"handle_greeting": []}'
+        good = graph._profiles_from_env()
+        # Nodo desconocido, nodo repetido/desordenado y handler desconocido
+        os.environ["PIPELINE_PROFILES"] = (
+            '{"handle_greeting": ["guardrail_v2"], "handle_orders": ["guardrail", "synthesize", "guardrail"],'
+            ' "handle_nada": ["guardrail"]}'
+        )
+        cleaned = graph._profiles_from_env()
+    finally:
+        if saved is None:
+            os.environ.pop("PIPELINE_PROFILES", None)
+        else:
+            os.environ["PIPELINE_PROFILES"] = saved
+    ok = (
+        bad_json == {} and bad_shape == {} and good == {"handle_greeting": []}
+        and cleaned == {"handle_greeting": [], "handle_orders": ["synthesize", "guardrail"]}
+    )
+    print(("✅" if ok else "❌") + " PIPELINE_PROFILES inválido se ignora")
+    if ok:
+        # El perfil saneado compila y termina (sin nodo fantasma ni ciclo del guardrail)
+        replies = asyncio.run(_replies({**graph.PIPELINE_PROFILES, **cleaned}, synthesizer=True))
+        ok = _check("perfil saneado", replies)
+    return ok
+
+
+def main():
+    _patch()
+    results = [
+        _check("synthesizer off (default)", asyncio.run(_replies())),
+        _check("synthesizer on", asyncio.run(_replies(synthesizer=True))),
+        _check("perfil completo sin synthesize", asyncio.run(_replies(graph.FULL_PROFILES))),
+        test_invalid_env_profiles(),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Prueba multi-proceso del lease por sesión (app/session_lock.py) contra un Redis local.
+
+1. Exclusión: varios procesos martillean la misma sesión; cada turno lee el
+   largo del historial, espera un poco y escribe el siguiente número de
+   secuencia con `fenced_lpush`. Sin lock habría secuencias repetidas; con el
+   lease deben quedar 0..N-1 sin huecos y nunca dos turnos a la vez.
+2. Fencing: un proceso pierde el lease (pausa más larga que el TTL, sin
+   renovar), otro lo toma y escribe; la escritura tardía del primero debe
+   rechazarse con LeaseLost y el token del segundo debe ser mayor.
+3. Renovación: `session_lease` con TTL corto se mantiene más de un TTL y otro
+   proceso no puede tomarlo mientras tanto.
+
+Uso:
+    REDIS_URL=redis://localhost:6379/15 python scripts/test_session_lock.py --workers 8 --turns 25
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Antes de importar app: session_lease usa el cliente de app.cache con esta URL
+REDIS_URL = os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+
+import redis  # noqa: E402
+
+from app.session_lock import LeaseLost, SessionLease, session_lease  # noqa: E402
+
+
+def _client():
+    return redis.Redis.from_url(REDIS_URL)
+
+
+def _hammer(worker: int, session_id: str, turns: int):
+    client = _client()
+    history = f"message_store:{session_id}"
+    inside = f"test:inside:{session_id}"
+    for _ in range(turns):
+        lease = SessionLease(session_id, ttl_ms=5000)
+        if not lease.acquire(client, wait=30):
+            raise SystemExit(f"worker {worker}: no obtuvo el lease")
+        try:
+            if client.incr(inside) > 1:
+                client.set(f"test:overlap:{session_id}", 1)
+            seq = client.llen(history)
+            time.sleep(random.uniform(0.001, 0.01))
+            lease.fenced_lpush(client, history, json.dumps({"seq": seq, "worker": worker, "token": lease.token}))
+            client.decr(inside)
+        finally:
+            lease.release(client)
+
+
+def test_mutual_exclusion(workers: int, turns: int) -> bool:
+    session_id = f"test-{uuid.uuid4().hex[:8]}"
+    procs = [mp.Process(target=_hammer, args=(w, session_id, turns)) for w in range(workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    client = _client()
+    entries = [json.loads(x) for x in reversed(client.lrange(f"message_store:{session_id}", 0, -1))]
+    seqs = [e["seq"] for e in entries]
+    tokens = [e["token"] for e in entries]
+    overlap = client.exists(f"test:overlap:{session_id}")
+    client.delete(f"message_store:{session_id}", f"test:inside:{session_id}", f"test:overlap:{session_id}", f"sessfence:{session_id}")
+
+    total = workers * turns
+    ok = all(p.exitcode == 0 for p in procs) and seqs == list(range(total)) and tokens == sorted(tokens) and not overlap
+    print(f"{'✅' if ok else '❌'} Exclusión: {len(seqs)}/{total} turnos en orden, "
+          f"solapes={bool(overlap)}, tokens crecientes={tokens == sorted(tokens)} ({elapsed:.2f}s)")
+    return ok
+
+
+def _stale_holder(session_id: str, queue):
+    client = _client()
+    lease = SessionLease(session_id, ttl_ms=300)
+    assert lease.acquire(client, wait=5)
+    queue.put(("a_token", lease.token))
+    time.sleep(0.8)  # pausa tipo GC / event loop bloqueado: el lease expira sin renovar
+    try:
+        lease.fenced_lpush(client, f"message_store:{session_id}", json.dumps({"writer": "stale"}))
+        queue.put(("a_write", "accepted"))
+    except LeaseLost:
+        queue.put(("a_write", "rejected"))
+
+
+def _new_holder(session_id: str, queue):
+    client = _client()
+    time.sleep(0.5)
+    lease = SessionLease(session_id, ttl_ms=5000)
+    assert lease.acquire(client, wait=5)
+    queue.put(("b_token", lease.token))
+    lease.fenced_lpush(client, f"message_store:{session_id}", json.dumps({"writer": "new"}))
+    time.sleep(0.6)  # sigue con el lease mientras el primero intenta escribir
+    lease.release(client)
+
+
+def test_fencing() -> bool:
+    session_id = f"test-{uuid.uuid4().hex[:8]}"
+    queue = mp.Queue()
+    procs = [mp.Process(target=_stale_holder, args=(session_id, queue)), mp.Process(target=_new_holder, args=(session_id, queue))]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    results = dict(queue.get() for _ in range(3))
+
+    client = _client()
+    writers = [json.loads(x)["writer"] for x in client.lrange(f"message_store:{session_id}", 0, -1)]
+    client.delete(f"message_store:{session_id}", f"sessfence:{session_id}")
+
+    ok = results.get("a_write") == "rejected" and results["b_token"] > results["a_token"] and writers == ["new"]
+    print(f"{'✅' if ok else '❌'} Fencing: escritura tardía {results.get('a_write')}, "
+          f"tokens {results['a_token']} -> {results['b_token']}, historial={writers}")
+    return ok
+
+
+def _try_steal(session_id: str, queue):
+    client = _client()
+    time.sleep(0.6)  # más que el TTL: solo sigue tomado si se renovó
+    queue.put(SessionLease(session_id).try_acquire(client))
+
+
+async def _hold(session_id: str, seconds: float):
+    async with session_lease(session_id, ttl_ms=300) as lease:
+        await asyncio.sleep(seconds)
+        return lease is not None and not lease.lost
+
+
+def test_renewal() -> bool:
+    session_id = f"test-{uuid.uuid4().hex[:8]}"
+    queue = mp.Queue()
+    thief = mp.Process(target=_try_steal, args=(session_id, queue))
+    thief.start()
+    held = asyncio.run(_hold(session_id, 1.2))
+    thief.join()
+    stolen = queue.get()
+    _client().delete(f"sessfence:{session_id}", f"sesslock:{session_id}")
+
+    ok = held and not stolen
+    print(f"{'✅' if ok else '❌'} Renovación: lease mantenido {held}, robado por otro proceso {stolen}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=25)
+    args = parser.parse_args()
+
+    try:
+        _client().ping()
+    except Exception as e:
+        print(f"❌ Redis no disponible en {REDIS_URL}: {e}")
+        sys.exit(1)
+
+    results = [test_mutual_exclusion(args.workers, args.turns), test_fencing(), test_renewal()]
+    print(f"\n{sum(results)}/{len(results)} pruebas OK")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
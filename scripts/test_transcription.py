@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Pruebas offline de los motores de transcripción (app/transcription.py).
+
+1. Selección: `auto` elige local para notas cortas y OpenAI para largas;
+   `local` sin faster-whisper cae a OpenAI.
+2. Fallback: si el motor local falla, se reintenta con OpenAI.
+   (1 y 2 usan motores falsos registrados con `register_engine`: sin red.)
+3. Motor local real (si faster-whisper está instalado): transcribe los audios
+   de --fixtures con el modelo de LOCAL_WHISPER_MODEL (un directorio con el
+   modelo CTranslate2 para correr sin red) y mide arranque en frío vs modelo
+   residente.
+
+Uso:
+    HF_HUB_OFFLINE=1 LOCAL_WHISPER_MODEL=models/whisper-small-ct2 \\
+        python scripts/test_transcription.py --fixtures bench/audio
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+
+import app.transcription as transcription  # noqa: E402
+from app.audio_prep import AUDIO_SAMPLE_RATE, TrimmedAudio  # noqa: E402
+from app.transcription import TranscriptionEngine, get_engine, register_engine, select_engine  # noqa: E402
+
+
+class FakeEngine(TranscriptionEngine):
+    def __init__(self, name: str, text: str = "", fail: bool = False, available: bool = True):
+        self.name, self.text, self.fail, self._available = name, text, fail, available
+        self.calls = 0
+
+    def available(self) -> bool:
+        return self._available
+
+    def transcribe(self, data, filename, trimmed):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError(f"{self.name} caído")
+        return self.text
+
+
+def _trimmed(seconds: float) -> TrimmedAudio:
+    pcm = np.zeros(int(seconds * AUDIO_SAMPLE_RATE), dtype=np.int16)
+    return TrimmedAudio(pcm=pcm, db=np.zeros(0), raw_bytes=0, original_seconds=seconds)
+
+
+def test_selection() -> bool:
+    saved = {name: get_engine(name) for name in ("openai", "local")}
+    try:
+        register_engine(FakeEngine("openai"))
+        register_engine(FakeEngine("local"))
+        short = select_engine(_trimmed(transcription.TRANSCRIPTION_LOCAL_MAX_SECONDS - 1), "auto").name
+        long_ = select_engine(_trimmed(transcription.TRANSCRIPTION_LOCAL_MAX_SECONDS + 1), "auto").name
+        unknown = select_engine(None, "auto").name
+        register_engine(FakeEngine("local", available=False))
+        missing = select_engine(_trimmed(5), "local").name
+    finally:
+        for engine in saved.values():
+            register_engine(engine)
+    ok = (short, long_, unknown, missing) == ("local", "openai", "openai", "openai")
+    print(f"{'✅' if ok else '❌'} Selección: corta={short}, larga={long_}, sin duración={unknown}, local no disponible={missing}")
+    return ok
+
+
+def test_fallback() -> bool:
+    saved = {name: get_engine(name) for name in ("openai", "local")}
+    fallback = transcription.TRANSCRIPTION_FALLBACK
+    remote = FakeEngine("openai", text="texto de openai")
+    try:
+        transcription.TRANSCRIPTION_FALLBACK = True
+        register_engine(remote)
+        register_engine(FakeEngine("local", fail=True))
+        text = transcription.transcribe(b"no-es-audio", "nota.ogg", engine="local")
+    finally:
+        transcription.TRANSCRIPTION_FALLBACK = fallback
+        for engine in saved.values():
+            register_engine(engine)
+    ok = text == "texto de openai" and remote.calls == 1
+    print(f"{'✅' if ok else '❌'} Fallback: local falla -> '{text}' (llamadas a openai: {remote.calls})")
+    return ok
+
+
+def test_local_engine(fixtures: str) -> bool:
+    engine = get_engine("local")
+    if not engine.available():
+        print("⏭️  Motor local: faster-whisper no instalado, se omite")
+        return True
+    paths = sorted(glob.glob(os.path.join(fixtures, "*.ogg")) + glob.glob(os.path.join(fixtures, "*.wav")))
+    if not paths:
+        print(f"⏭️  Motor local: sin audios en {fixtures}, se omite")
+        return True
+    start = time.perf_counter()
+    engine.warm_up()
+    print(f"   Modelo '{transcription.LOCAL_WHISPER_MODEL}' cargado en {time.perf_counter() - start:.2f}s")
+    ok = engine.available()
+    try:
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            start = time.perf_counter()
+            text = transcription.transcribe(data, os.path.basename(path), engine="local")
+            print(f"   {os.path.basename(path):<16} {time.perf_counter() - start:>6.2f}s  {text[:80]!r}")
+            ok = ok and not text.startswith("Error en transcripción")
+    finally:
+        engine.shutdown()
+    print(f"{'✅' if ok else '❌'} Motor local")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default="bench/audio")
+    args = parser.parse_args()
+
+    results = [test_selection(), test_fallback(), test_local_engine(args.fixtures)]
+    print(f"\n{sum(results)}/{len(results)} pruebas OK")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()